@@ -1,6 +1,83 @@
 """
 Nodes of AST of vsl
+
+Every node class declares __slots__, so a node carries no per-instance __dict__.
+Set config.ast_validate = False to skip the structural checks in the constructors.
+
+Machine-generated expressions can nest far deeper than the recursion limit of Python, so the
+passes over whole trees use walk() or postorder(), or keep an explicit stack of their own.
 """
+import config
+
+# AST node class => names of its fields, see node_fields()
+_fields = {}
+
+
+def node_fields(node_class):
+    """
+    Return the names of the fields of an AST node class, including the inherited ones, in
+    the order of the declaration
+    :param node_class:
+    :return: tuple
+    """
+    names = _fields.get(node_class)
+    if names is None:
+        names = tuple(name for cls in reversed(node_class.__mro__) for name in getattr(cls, '__slots__', ()))
+        _fields[node_class] = names
+    return names
+
+
+def iter_children(node):
+    """
+    Yield the child nodes of a node in the order of its fields, the items of the list
+    fields in their order. None fields are skipped
+    :param node: ASTNode
+    :return:
+    """
+    for name in node_fields(node.__class__):
+        value = getattr(node, name)
+        if isinstance(value, ASTNode):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, ASTNode):
+                    yield item
+
+
+def walk(node):
+    """
+    Yield the nodes of a tree in pre-order. The walk keeps its own stack, so the depth of the
+    tree is not limited by the recursion limit
+    :param node: ASTNode
+    :return:
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = list(iter_children(node))
+        children.reverse()
+        stack.extend(children)
+
+
+def postorder(node):
+    """
+    Yield the nodes of a tree in post-order, every node after its children. Like walk(), it
+    keeps its own stack
+    :param node: ASTNode
+    :return:
+    """
+    # (node, whether its children are on the stack already)
+    stack = [(node, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+        stack.append((node, True))
+        children = list(iter_children(node))
+        children.reverse()
+        stack.extend((child, False) for child in children)
 
 
 def only_contains(_list, _type):
@@ -11,223 +88,289 @@ def only_contains(_list, _type):
     :param _type:
     :return:
     """
-    for instance in _list:
-        if not isinstance(instance, _type) or not issubclass(type(instance), _type):
-            return False
-    return True
+    return all(isinstance(instance, _type) for instance in _list)
 
 
 class ASTNode(object):
+    __slots__ = ()
+
     def to_json(self):
         """
         Return a json dump-able value for AST visualizing
         :return:
         """
+        # Post-order, so the values of the children are ready when a node needs them
+        values = {}
+
+        def json_of(node):
+            return values[id(node)] if node is not None else None
+
+        for node in postorder(self):
+            values[id(node)] = node._to_json(json_of)
+        return values[id(self)]
+
+    def _to_json(self, json_of):
+        """
+        Return the json value of this node
+        :param json_of: returns the json value of a child node
+        :return:
+        """
         pass
 
 
 class Statement(ASTNode):
-    pass
+    __slots__ = ()
 
 
 class Program(ASTNode):
+    __slots__ = ('function_list',)
+
     def __init__(self, function_list):
-        assert only_contains(function_list, FunctionDefinition)
+        if config.ast_validate:
+            assert only_contains(function_list, FunctionDefinition)
 
         self.function_list = function_list
 
-    def to_json(self):
-        return {'program': [item.to_json() for item in self.function_list]}
+    def _to_json(self, json_of):
+        return {'program': [json_of(item) for item in self.function_list]}
 
 
 class FunctionDefinition(ASTNode):
+    __slots__ = ('name', 'parameter_list', 'body')
+
     def __init__(self, name, parameter_list, body):
-        assert isinstance(name, ID)
-        assert only_contains(parameter_list, ID)
-        assert issubclass(type(body), Block)
+        if config.ast_validate:
+            assert isinstance(name, ID)
+            assert only_contains(parameter_list, ID)
+            assert issubclass(type(body), Block)
 
         self.name = name
         self.parameter_list = parameter_list
         self.body = body
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'function_definition': {
-            'name': self.name.to_json(),
-            'parameter_list': [item.to_json() for item in self.parameter_list],
-            'body': self.body.to_json(),
+            'name': json_of(self.name),
+            'parameter_list': [json_of(item) for item in self.parameter_list],
+            'body': json_of(self.body),
         }}
 
 
 class Block(ASTNode):
+    __slots__ = ('declaration_list', 'statement_list')
+
     def __init__(self, declaration_list, statement_list):
-        assert only_contains(declaration_list, VariableDeclaration)
-        assert only_contains(statement_list, Statement)
+        if config.ast_validate:
+            assert only_contains(declaration_list, VariableDeclaration)
+            assert only_contains(statement_list, Statement)
 
         self.declaration_list = declaration_list
         self.statement_list = statement_list
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'block': {
-            'declaration_list': [item.to_json() for item in self.declaration_list],
-            'statement_list': [item.to_json() for item in self.statement_list],
+            'declaration_list': [json_of(item) for item in self.declaration_list],
+            'statement_list': [json_of(item) for item in self.statement_list],
         }}
 
 
 class VariableDeclaration(ASTNode):
+    __slots__ = ('variable_list',)
+
     def __init__(self, variable_list):
-        assert only_contains(variable_list, ID)
+        if config.ast_validate:
+            assert only_contains(variable_list, ID)
 
         self.variable_list = variable_list
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'variable_declaration': {
-            'variable_list': [item.to_json() for item in self.variable_list]
+            'variable_list': [json_of(item) for item in self.variable_list]
         }}
 
 
 class AssignStatement(Statement):
+    __slots__ = ('left_variable', 'right_expression')
+
     def __init__(self, left_variable, right_expression):
-        assert isinstance(left_variable, ID)
-        assert issubclass(type(right_expression), Expression)
+        if config.ast_validate:
+            assert isinstance(left_variable, ID)
+            assert issubclass(type(right_expression), Expression)
 
         self.left_variable = left_variable
         self.right_expression = right_expression
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'assign_statement': {
-            'left_variable': self.left_variable.to_json(),
-            'right_expression': self.right_expression.to_json(),
+            'left_variable': json_of(self.left_variable),
+            'right_expression': json_of(self.right_expression),
         }}
 
 
 class IfStatement(Statement):
+    __slots__ = ('test', 'then_block', 'else_block')
+
     def __init__(self, test, then_block, else_block=None):
-        assert issubclass(type(test), Expression)
-        assert isinstance(then_block, Block)
-        if else_block:
-            assert isinstance(else_block, Block)
+        if config.ast_validate:
+            assert issubclass(type(test), Expression)
+            assert isinstance(then_block, Block)
+            if else_block:
+                assert isinstance(else_block, Block)
 
         self.test = test
         self.then_block = then_block
         self.else_block = else_block
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'if_statement': {
-            'test': self.test.to_json(),
-            'then_block': self.then_block.to_json(),
-            'else_block': self.else_block.to_json() if self.else_block is not None else None,
+            'test': json_of(self.test),
+            'then_block': json_of(self.then_block),
+            'else_block': json_of(self.else_block),
         }}
 
 
 class WhileStatement(Statement):
+    __slots__ = ('test', 'block')
+
     def __init__(self, test, block):
-        assert issubclass(type(test), Expression)
-        assert isinstance(block, Block)
+        if config.ast_validate:
+            assert issubclass(type(test), Expression)
+            assert isinstance(block, Block)
 
         self.test = test
         self.block = block
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'while_statement': {
-            'test': self.test.to_json(),
-            'block': self.block.to_json(),
+            'test': json_of(self.test),
+            'block': json_of(self.block),
         }}
 
 
 class ReturnStatement(Statement):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
-        assert issubclass(type(expression), Expression)
+        if config.ast_validate:
+            assert issubclass(type(expression), Expression)
 
         self.expression = expression
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'return_statement': {
-            'expression': self.expression.to_json(),
+            'expression': json_of(self.expression),
         }}
 
 
 class PrintStatement(Statement):
+    __slots__ = ('print_list',)
+
     def __init__(self, print_list):
-        assert isinstance(print_list, list)  # Though print_list should only contain expression and TEXT
+        if config.ast_validate:
+            assert isinstance(print_list, list)  # Though print_list should only contain expression and TEXT
 
         self.print_list = print_list
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'print_statement': {
-            'print_list': [item.to_json() for item in self.print_list],
+            'print_list': [json_of(item) for item in self.print_list],
         }}
 
 
 class Expression(ASTNode):
-    minus_flag = False  # Remind to check this in codegen
+    __slots__ = ('minus_flag',)
+
+    def __init__(self):
+        self.minus_flag = False  # Remind to check this in codegen
 
     def change_minus_flag(self):
         """
         Every time we meet UMINUS, call this function
-        :return:
+        :return: the expression itself
         """
         self.minus_flag = not self.minus_flag
+        return self
 
 
 class BinaryOperation(Expression):
+    __slots__ = ('left_expression', 'operator', 'right_expression')
+
     def __init__(self, left_expression, operator, right_expression):
-        assert issubclass(type(left_expression), Expression)
-        assert operator in ('+', '-', '*', '/',)
+        if config.ast_validate:
+            assert issubclass(type(left_expression), Expression)
+            assert operator in ('+', '-', '*', '/',)
 
         self.left_expression = left_expression
         self.right_expression = right_expression
         self.operator = operator
+        Expression.__init__(self)
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'binary_operation': {
-            'left_expression': self.left_expression.to_json(),
+            'left_expression': json_of(self.left_expression),
             'operator': self.operator,
-            'right_expression': self.right_expression.to_json(),
+            'right_expression': json_of(self.right_expression),
         }}
 
 
 class Number(Expression):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         # p[index] lost the LexToken object, only returns the value of it
-        assert isinstance(value, float)
+        if config.ast_validate:
+            assert isinstance(value, float)
 
         self.value = value
+        Expression.__init__(self)
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'number': self.value}
 
 
 class ID(Expression):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         # p[index] lost the LexToken object, only returns the value of it
-        assert isinstance(name, str)
+        if config.ast_validate:
+            assert isinstance(name, str)
 
         self.name = name
+        Expression.__init__(self)
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'id': self.name}
 
 
 class FunctionCall(Expression):
+    __slots__ = ('name', 'argument_list')
+
     def __init__(self, name, argument_list):
-        assert isinstance(name, ID)
-        assert argument_list is None or only_contains(argument_list, Expression)
+        if config.ast_validate:
+            assert isinstance(name, ID)
+            assert argument_list is None or only_contains(argument_list, Expression)
 
         self.name = name
         self.argument_list = argument_list
+        Expression.__init__(self)
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'function_call': {
-            'name': self.name.to_json(),
-            'argument_list': [item.to_json() for item in self.argument_list],
+            'name': json_of(self.name),
+            'argument_list': [json_of(item) for item in self.argument_list]
+            if self.argument_list is not None else None,
         }}
 
 
 class Text(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        assert isinstance(value, str)
+        if config.ast_validate:
+            assert isinstance(value, str)
 
         self.value = value
 
-    def to_json(self):
+    def _to_json(self, json_of):
         return {'text': self.value}
@@ -0,0 +1,492 @@
+"""
+astcodec.py
+
+Compact binary encoding of the AST
+
+A stream is the header MAGIC + VERSION byte, followed by records. Every record is the varint
+byte length of one encoded node tree, followed by the tree in pre-order:
+
+    node     tag byte, with MINUS set for an Expression with minus_flag, then its fields
+    list     varint count, then the items
+    string   varint 0 then the varint length and the UTF-8 bytes of a new string, or
+             varint i for the i-th string of the stream
+    Number   TAG_INTEGER with a varint for the integral values below 2^53, otherwise
+             TAG_NUMBER with a little-endian double
+
+The strings are shared by all the records of a stream, so the records are decoded in order.
+Both directions keep an explicit stack, so the depth of a tree is not limited by recursion.
+A decoder reads every version up to its own. New node kinds only add tags, and a change of
+an existing encoding bumps VERSION.
+"""
+import io
+import math
+import struct
+from types import GeneratorType
+
+from ast import (Program, FunctionDefinition, Block, VariableDeclaration, AssignStatement, IfStatement,
+                 WhileStatement, ReturnStatement, PrintStatement, Statement, Expression, BinaryOperation, Number,
+                 ID, FunctionCall, Text)
+
+MAGIC = b'VSLA'
+VERSION = 1
+
+TAG_NONE = 0
+TAG_PROGRAM = 1
+TAG_FUNCTION_DEFINITION = 2
+TAG_BLOCK = 3
+TAG_VARIABLE_DECLARATION = 4
+TAG_ASSIGN_STATEMENT = 5
+TAG_IF_STATEMENT = 6
+TAG_WHILE_STATEMENT = 7
+TAG_RETURN_STATEMENT = 8
+TAG_PRINT_STATEMENT = 9
+TAG_BINARY_OPERATION = 10
+TAG_NUMBER = 11
+TAG_INTEGER = 12
+TAG_ID = 13
+TAG_FUNCTION_CALL = 14
+TAG_TEXT = 15
+
+# Set in the tag of an Expression whose minus_flag is set
+MINUS = 0x80
+
+OPERATORS = '+-*/'
+
+_DOUBLE = struct.Struct('<d')
+
+
+class CodecError(Exception):
+    pass
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+class Encoder(object):
+    """Writes AST nodes to a binary stream, one record per write()"""
+    def __init__(self, stream):
+        """
+        :param stream: binary file object, the header is written at once
+        """
+        self.stream = stream
+        # string => index, from 1
+        self.strings = {}
+        stream.write(MAGIC + bytes((VERSION,)))
+
+    def write(self, node):
+        """
+        Encode a node tree as one record
+        :param node: ASTNode
+        :return: size of the record
+        """
+        out = bytearray()
+        self._tree(node, out)
+        header = bytearray()
+        _write_varint(header, len(out))
+        self.stream.write(header)
+        self.stream.write(out)
+        return len(header) + len(out)
+
+    def _string(self, value, out):
+        index = self.strings.get(value)
+        if index is not None:
+            _write_varint(out, index)
+            return
+        self.strings[value] = len(self.strings) + 1
+        data = value.encode('utf-8')
+        out.append(0)
+        _write_varint(out, len(data))
+        out += data
+
+    def _tree(self, root, out):
+        """
+        Encode a node tree in pre-order with an explicit stack
+        """
+        # Nodes, None, and the lists and _Arguments of the fields still to write
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            if item is None:
+                out.append(TAG_NONE)
+            elif isinstance(item, list):
+                _write_varint(out, len(item))
+                stack.extend(reversed(item))
+            elif isinstance(item, _Arguments):
+                # 0 for no argument list, otherwise the count + 1
+                if item.argument_list is None:
+                    out.append(0)
+                else:
+                    _write_varint(out, len(item.argument_list) + 1)
+                    stack.extend(reversed(item.argument_list))
+            else:
+                try:
+                    encoder = _ENCODERS[item.__class__]
+                except KeyError:
+                    raise CodecError('Can not encode: {!r}'.format(item))
+                fields = encoder(self, item, out, MINUS if isinstance(item, Expression) and item.minus_flag else 0)
+                stack.extend(reversed(fields))
+
+    # The encoding methods write the tag and the scalar fields of a node, and return its
+    # other fields in order, which _tree() writes after it
+
+    def _Program(self, node, out, minus):
+        out.append(TAG_PROGRAM)
+        return node.function_list,
+
+    def _FunctionDefinition(self, node, out, minus):
+        out.append(TAG_FUNCTION_DEFINITION)
+        return node.name, node.parameter_list, node.body
+
+    def _Block(self, node, out, minus):
+        out.append(TAG_BLOCK)
+        return node.declaration_list, node.statement_list
+
+    def _VariableDeclaration(self, node, out, minus):
+        out.append(TAG_VARIABLE_DECLARATION)
+        return node.variable_list,
+
+    def _AssignStatement(self, node, out, minus):
+        out.append(TAG_ASSIGN_STATEMENT)
+        return node.left_variable, node.right_expression
+
+    def _IfStatement(self, node, out, minus):
+        out.append(TAG_IF_STATEMENT)
+        return node.test, node.then_block, node.else_block
+
+    def _WhileStatement(self, node, out, minus):
+        out.append(TAG_WHILE_STATEMENT)
+        return node.test, node.block
+
+    def _ReturnStatement(self, node, out, minus):
+        out.append(TAG_RETURN_STATEMENT)
+        return node.expression,
+
+    def _PrintStatement(self, node, out, minus):
+        out.append(TAG_PRINT_STATEMENT)
+        return node.print_list,
+
+    def _BinaryOperation(self, node, out, minus):
+        out.append(TAG_BINARY_OPERATION | minus)
+        out.append(OPERATORS.index(node.operator))
+        return node.left_expression, node.right_expression
+
+    def _Number(self, node, out, minus):
+        value = node.value
+        if value.is_integer() and 0 <= value < 2 ** 53 and math.copysign(1, value) > 0:
+            out.append(TAG_INTEGER | minus)
+            _write_varint(out, int(value))
+        else:
+            out.append(TAG_NUMBER | minus)
+            out += _DOUBLE.pack(value)
+        return ()
+
+    def _ID(self, node, out, minus):
+        out.append(TAG_ID | minus)
+        self._string(node.name, out)
+        return ()
+
+    def _FunctionCall(self, node, out, minus):
+        out.append(TAG_FUNCTION_CALL | minus)
+        return node.name, _Arguments(node.argument_list)
+
+    def _Text(self, node, out, minus):
+        out.append(TAG_TEXT)
+        self._string(node.value, out)
+        return ()
+
+
+class _Arguments(object):
+    """The argument list of a FunctionCall to write, which can be None"""
+    __slots__ = ('argument_list',)
+
+    def __init__(self, argument_list):
+        self.argument_list = argument_list
+
+
+# Node class => encoding method
+_ENCODERS = {cls: getattr(Encoder, '_' + cls.__name__) for cls in (
+    Program, FunctionDefinition, Block, VariableDeclaration, AssignStatement, IfStatement, WhileStatement,
+    ReturnStatement, PrintStatement, BinaryOperation, Number, ID, FunctionCall, Text)}
+
+
+class Decoder(object):
+    """Reads the AST nodes of a binary stream written by an Encoder, one record per read()"""
+    def __init__(self, stream):
+        """
+        :param stream: binary file object, the header is read at once
+        """
+        self.stream = stream
+        self.strings = [None]
+
+        header = stream.read(len(MAGIC) + 1)
+        if len(header) != len(MAGIC) + 1 or header[:len(MAGIC)] != MAGIC:
+            raise CodecError('Not an encoded AST')
+        self.version = header[-1]
+        if not 1 <= self.version <= VERSION:
+            raise CodecError('Unsupported version {}, expected 1 to {}'.format(self.version, VERSION))
+
+        self.data = b''
+        self.position = 0
+
+    def read(self):
+        """
+        Decode the next record
+        :return: ASTNode, or None at the end of the stream
+        """
+        length = 0
+        shift = 0
+        while True:
+            byte = self.stream.read(1)
+            if not byte:
+                if shift:
+                    raise CodecError('Truncated record length')
+                return None
+            length |= (byte[0] & 0x7f) << shift
+            shift += 7
+            if byte[0] < 0x80:
+                break
+
+        self.data = self.stream.read(length)
+        self.position = 0
+        if len(self.data) != length:
+            raise CodecError('Truncated record')
+        try:
+            node = self._tree()
+        except (IndexError, KeyError, ValueError, struct.error) as error:
+            raise CodecError('Corrupted record: {!r}'.format(error))
+        if self.position != length:
+            raise CodecError('Trailing bytes in record')
+        self.data = b''
+        return node
+
+    def __iter__(self):
+        node = self.read()
+        while node is not None:
+            yield node
+            node = self.read()
+
+    def _varint(self):
+        data = self.data
+        value = 0
+        shift = 0
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def _string(self):
+        index = self._varint()
+        if index:
+            return self.strings[index]
+        length = self._varint()
+        end = self.position + length
+        if end > len(self.data):
+            raise CodecError('Truncated string')
+        value = self.data[self.position:end].decode('utf-8')
+        self.position = end
+        self.strings.append(value)
+        return value
+
+    def _tree(self):
+        """
+        Decode a node tree with an explicit stack of the decoding methods
+        :return: ASTNode or None
+        """
+        data = self.data
+        # (generator of a decoding method, tag, expected class) of the nodes being decoded
+        stack = []
+        expected = None
+        while True:
+            tag = data[self.position]
+            self.position += 1
+            if tag == TAG_NONE:
+                value = None
+            else:
+                decoder = _DECODERS.get(tag & ~MINUS)
+                if decoder is None:
+                    raise CodecError('Unknown tag: {}'.format(tag))
+                value = decoder(self)
+                if isinstance(value, GeneratorType):
+                    stack.append((value, tag, expected))
+                    value = None  # starts the generator
+                else:
+                    value = self._check(value, tag, expected)
+
+            # Hand the value to the node it belongs to, until a node asks for its next child
+            while stack:
+                generator, tag, cls = stack[-1]
+                try:
+                    expected = generator.send(value)
+                    break
+                except StopIteration as stop:
+                    stack.pop()
+                    value = self._check(stop.value, tag, cls)
+            else:
+                return value
+
+    @staticmethod
+    def _check(node, tag, cls):
+        """
+        :param cls: the expected node class, Expression, Statement or None for any
+        """
+        if cls is not None and not isinstance(node, cls):
+            raise CodecError('Expected {}, got {}'.format(cls.__name__, node.__class__.__name__))
+        if isinstance(node, Expression):
+            node.minus_flag = bool(tag & MINUS)
+        elif tag & MINUS:
+            raise CodecError('Minus flag on {}'.format(node.__class__.__name__))
+        return node
+
+    def _list(self, cls):
+        items = []
+        for _ in range(self._varint()):
+            items.append((yield cls))
+        return items
+
+    # The decoding methods skip the constructors, _check() checks the structure. The methods
+    # of the nodes with children are generators, which yield the expected class of every child
+    # to _tree() and receive the decoded child.
+
+    def _Program(self):
+        node = Program.__new__(Program)
+        node.function_list = yield from self._list(FunctionDefinition)
+        return node
+
+    def _FunctionDefinition(self):
+        node = FunctionDefinition.__new__(FunctionDefinition)
+        node.name = yield ID
+        node.parameter_list = yield from self._list(ID)
+        node.body = yield Block
+        return node
+
+    def _Block(self):
+        node = Block.__new__(Block)
+        node.declaration_list = yield from self._list(VariableDeclaration)
+        node.statement_list = yield from self._list(Statement)
+        return node
+
+    def _VariableDeclaration(self):
+        node = VariableDeclaration.__new__(VariableDeclaration)
+        node.variable_list = yield from self._list(ID)
+        return node
+
+    def _AssignStatement(self):
+        node = AssignStatement.__new__(AssignStatement)
+        node.left_variable = yield ID
+        node.right_expression = yield Expression
+        return node
+
+    def _IfStatement(self):
+        node = IfStatement.__new__(IfStatement)
+        node.test = yield Expression
+        node.then_block = yield Block
+        node.else_block = yield Block
+        return node
+
+    def _WhileStatement(self):
+        node = WhileStatement.__new__(WhileStatement)
+        node.test = yield Expression
+        node.block = yield Block
+        return node
+
+    def _ReturnStatement(self):
+        node = ReturnStatement.__new__(ReturnStatement)
+        node.expression = yield Expression
+        return node
+
+    def _PrintStatement(self):
+        node = PrintStatement.__new__(PrintStatement)
+        node.print_list = yield from self._list(None)
+        return node
+
+    def _BinaryOperation(self):
+        node = BinaryOperation.__new__(BinaryOperation)
+        node.operator = OPERATORS[self.data[self.position]]
+        self.position += 1
+        node.left_expression = yield Expression
+        node.right_expression = yield Expression
+        return node
+
+    def _Number(self):
+        node = Number.__new__(Number)
+        node.value, = _DOUBLE.unpack_from(self.data, self.position)
+        self.position += _DOUBLE.size
+        return node
+
+    def _Integer(self):
+        node = Number.__new__(Number)
+        node.value = float(self._varint())
+        return node
+
+    def _ID(self):
+        node = ID.__new__(ID)
+        node.name = self._string()
+        return node
+
+    def _FunctionCall(self):
+        node = FunctionCall.__new__(FunctionCall)
+        node.name = yield ID
+        count = self._varint()
+        if count:
+            node.argument_list = []
+            for _ in range(count - 1):
+                node.argument_list.append((yield Expression))
+        else:
+            node.argument_list = None
+        return node
+
+    def _Text(self):
+        node = Text.__new__(Text)
+        node.value = self._string()
+        return node
+
+
+# Tag without MINUS => decoding method
+_DECODERS = {
+    TAG_PROGRAM: Decoder._Program,
+    TAG_FUNCTION_DEFINITION: Decoder._FunctionDefinition,
+    TAG_BLOCK: Decoder._Block,
+    TAG_VARIABLE_DECLARATION: Decoder._VariableDeclaration,
+    TAG_ASSIGN_STATEMENT: Decoder._AssignStatement,
+    TAG_IF_STATEMENT: Decoder._IfStatement,
+    TAG_WHILE_STATEMENT: Decoder._WhileStatement,
+    TAG_RETURN_STATEMENT: Decoder._ReturnStatement,
+    TAG_PRINT_STATEMENT: Decoder._PrintStatement,
+    TAG_BINARY_OPERATION: Decoder._BinaryOperation,
+    TAG_NUMBER: Decoder._Number,
+    TAG_INTEGER: Decoder._Integer,
+    TAG_ID: Decoder._ID,
+    TAG_FUNCTION_CALL: Decoder._FunctionCall,
+    TAG_TEXT: Decoder._Text,
+}
+
+
+def dumps(node):
+    """
+    Encode a node tree into a stream of one record
+    :param node: ASTNode
+    :return: bytes
+    """
+    stream = io.BytesIO()
+    Encoder(stream).write(node)
+    return stream.getvalue()
+
+
+def loads(data):
+    """
+    Decode a stream of one record
+    :param data: bytes
+    :return: ASTNode
+    """
+    decoder = Decoder(io.BytesIO(data))
+    node = decoder.read()
+    if node is None or decoder.read() is not None:
+        raise CodecError('Expected exactly one record')
+    return node
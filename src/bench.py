@@ -0,0 +1,997 @@
+"""
+bench.py
+
+Benchmarks of vslcpy
+
+Usage:
+ python bench.py lexer [--size MB]
+ python bench.py scaling [--max-statements N]
+ python bench.py memory [--size MB]
+ python bench.py lowering [--functions N]
+ python bench.py strings [--prints N]
+ python bench.py codegen [--statements N] [--operands N]
+ python bench.py loops [--iterations N]
+ python bench.py ssa [--variables N] [--iterations N]
+ python bench.py inlining [--iterations N]
+ python bench.py partitions [--functions N] [--opt-level N] [--max-partitions N]
+ python bench.py phases [--shape SHAPE ...] [--scales N ...] [--output FILE] [--baseline FILE]
+ python bench.py incremental [--functions N] [--statements N]
+ python bench.py streaming [--size MB]
+ python bench.py codec [--functions N] [--statements N]
+ python bench.py deep [--max-operands N]
+ python bench.py integers [--size N]
+ python bench.py tailcalls [--max-depth N]
+ python bench.py memo [--size N]
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import pickle
+import platform
+import sys
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stderr
+from ctypes import CFUNCTYPE, c_double
+
+import llvmlite.binding as llvm
+from llvmlite import ir
+from llvmlite._version import get_versions as llvmlite_version
+
+import astcodec
+import config
+from ast import BinaryOperation, Expression, FunctionCall
+from codegen import LLVMCodeGenerator
+from driver import compile_file
+from evaluator import VSLCEvaluator, initialize, lower, get_target_machine
+from folding import fold
+from incremental import IncrementalCompiler
+from lex import VSLCLexer
+from optimizer import INLINE_THRESHOLDS, OPT_LEVELS, get_optimizer, set_opt_level
+from partition import compile_partitioned
+from scanner import VSLCScanner
+from utils import capture_fd
+from vslgen import SHAPES, generate, generate_expression, generate_function, generate_program, generate_source
+from yacc import parser_pool
+
+
+def build_module(code):
+    """
+    Parse and codegen a program in compile mode
+    :param code:
+    :return: the code generator
+    """
+    with parser_pool.parser() as parser:
+        node = parser.parse(code)
+    generator = LLVMCodeGenerator('compile', module_name='bench')
+    generator.generate_code(node)
+    return generator
+
+
+def _timeit(func):
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def bench_lexer(args):
+    code = generate_source(int(args.size * 1024 * 1024))
+
+    def run_ply():
+        lexer = VSLCLexer()
+        lexer.build()
+        lexer.lexer.input(code)
+        count = 0
+        token = lexer.lexer.token
+        while token():
+            count += 1
+        return count
+
+    def run_scanner():
+        count = 0
+        for _ in VSLCScanner().scan(code):
+            count += 1
+        return count
+
+    with tempfile.NamedTemporaryFile('w', suffix='.vsl', delete=False) as source_file:
+        source_file.write(code)
+
+    def run_scanner_mmap():
+        count = 0
+        for _ in VSLCScanner().scan_file(source_file.name):
+            count += 1
+        return count
+
+    print('source: {:.1f} MB'.format(len(code) / 1024 / 1024))
+    try:
+        for name, func in (('ply', run_ply), ('scanner', run_scanner), ('scanner (mmap)', run_scanner_mmap)):
+            elapsed, count = _timeit(func)
+            print('{:<16}{:>10} tokens {:>8.3f} s {:>12.0f} tokens/s'.format(name, count, elapsed, count / elapsed))
+    finally:
+        os.remove(source_file.name)
+
+
+def bench_scaling(args):
+    """
+    Parse time of a single function with a growing number of statements.
+    Linear list building keeps the time per statement flat.
+    """
+    print('{:>10}{:>10}{:>14}'.format('statements', 'seconds', 'us/statement'))
+    statements = 1000
+    while statements <= args.max_statements:
+        code = generate_function(0, statements // 2)  # two statements per step
+        with parser_pool.parser() as parser:
+            elapsed, _ = _timeit(lambda: parser.parse(code))
+        print('{:>10}{:>10.3f}{:>14.2f}'.format(statements, elapsed, elapsed / statements * 1e6))
+        statements *= 10
+
+
+def bench_memory(args):
+    """
+    Memory retained by the AST of generated programs, with and without validation
+    """
+    print('{:>10}{:>12}{:>10}{:>10}{:>10}'.format('source MB', 'AST MB', 'ratio', 'validate', 'seconds'))
+    size = 0.25
+    while size <= args.size:
+        code = generate_source(int(size * 1024 * 1024))
+        for validate in (True, False):
+            config.ast_validate = validate
+            with parser_pool.parser() as parser:
+                tracemalloc.start()
+                elapsed, node = _timeit(lambda: parser.parse(code))
+                retained, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            del node
+            print('{:>10.2f}{:>12.2f}{:>10.2f}{:>10}{:>10.3f}'.format(
+                len(code) / 1024 / 1024, retained / 1024 / 1024, retained / len(code), str(validate), elapsed))
+        size *= 2
+    config.ast_validate = True
+
+
+def bench_lowering(args):
+    """
+    Time of each lowering phase on a large module, and of evaluating and compiling
+    the same module twice with and without the lowering cache
+    """
+    initialize()
+    generator = build_module(generate_program(args.functions, 20))
+    module = generator.module
+
+    print('phase                         seconds')
+    elapsed, ir_text = _timeit(lambda: str(module))
+    print('{:<28}{:>9.3f}'.format('serialize IR', elapsed))
+    elapsed, llvmmod = _timeit(lambda: llvm.parse_assembly(ir_text))
+    print('{:<28}{:>9.3f}'.format('parse IR', elapsed))
+    elapsed, target_machine = _timeit(lambda: llvm.Target.from_default_triple().create_target_machine())
+    print('{:<28}{:>9.3f}'.format('create target machine', elapsed))
+    elapsed, _ = _timeit(lambda: target_machine.emit_assembly(llvmmod))
+    print('{:<28}{:>9.3f}'.format('dump machine code', elapsed))
+    elapsed, _ = _timeit(lambda: target_machine.emit_object(llvmmod))
+    print('{:<28}{:>9.3f}'.format('emit object', elapsed))
+
+    print()
+    print('call x2                  uncached    cached     saved')
+    for name in ('evaluate', 'compile_to_object_code'):
+        times = []
+        for version in (None, generator.module_version):
+            evaluator = VSLCEvaluator()
+            method = getattr(evaluator, name)
+            elapsed, _ = _timeit(lambda: (method(module, version), method(module, version)))
+            times.append(elapsed)
+        print('{:<24}{:>9.3f}{:>10.3f}{:>10.3f}'.format(name, times[0], times[1], times[0] - times[1]))
+
+
+def bench_strings(args):
+    """
+    Number of global constants and IR size of print-heavy programs.
+    Without interning every PRINT created one format string and one string per TEXT.
+    """
+    print('{:>8}{:>14}{:>16}{:>12}{:>14}'.format('prints', 'globals', 'uninterned', 'IR KB', 'deterministic'))
+    prints = 100
+    while prints <= args.prints:
+        lines = ['FUNC main()', '{', '  VAR i']
+        for i in range(prints):
+            lines.append('  PRINT "i=", i, ", step ", {}, "\\n"'.format(i % 7))
+        lines.append('}')
+        code = '\n'.join(lines)
+
+        module = build_module(code).module
+        ir_text = str(module)
+        strings = [value for value in module.global_values if value.name.startswith('.str.')]
+        uninterned = prints * 4  # one format + three TEXT per PRINT
+        deterministic = ir_text == str(build_module(code).module)
+        print('{:>8}{:>14}{:>16}{:>12.1f}{:>14}'.format(
+            prints, len(strings), uninterned, len(ir_text) / 1024, str(deterministic)))
+        prints *= 10
+
+
+class _GetattrCodeGenerator(LLVMCodeGenerator):
+    """The recursive visit with lookup by method name, before the dispatch table and the explicit
+    stack of the expressions, for comparison"""
+    def _codegen(self, node):
+        assert isinstance(node, node.__class__)  # the type check each visitor used to do
+        if isinstance(node, BinaryOperation):
+            value = self._codegen_BinaryOperation(node, self._codegen(node.left_expression),
+                                                  self._codegen(node.right_expression))
+        elif isinstance(node, FunctionCall):
+            callee = self._callee(node)
+            value = self._codegen_FunctionCall(node, callee, [self._codegen(argument)
+                                                              for argument in node.argument_list or ()])
+        else:
+            value = getattr(self, '_codegen_' + node.__class__.__name__)(node)
+        if isinstance(node, Expression) and node.minus_flag:
+            value = self.builder.fsub(ir.Constant(ir.DoubleType(), -0.0), value, 'negtmp')
+        return value
+
+
+def bench_codegen(args):
+    """
+    Codegen time of large expression trees with the dispatch table and explicit stack, and with
+    the recursive getattr() lookup
+    """
+    lines = ['FUNC main()', '{', '  VAR a, b']
+    for i in range(args.statements):
+        lines.append('  a := {}'.format(generate_expression(args.operands, i)))
+    lines.append('  RETURN a')
+    lines.append('}')
+    with parser_pool.parser() as parser:
+        node = parser.parse('\n'.join(lines))
+
+    nodes = args.statements * (args.operands * 2 - 1)
+    print('{} statements, {} expression nodes'.format(args.statements, nodes))
+    for name, generator_class in (('getattr, recursive', _GetattrCodeGenerator),
+                                  ('dispatch table, stack', LLVMCodeGenerator)):
+        best = min(_timeit(lambda: generator_class('compile').generate_code(node))[0] for _ in range(args.repeat))
+        print('{:<24}{:>8.3f} s {:>8.2f} us/node'.format(name, best, best / nodes * 1e6))
+
+
+LOOP_PROGRAM = '''
+FUNC main()
+{
+  VAR i, s
+  i := %d
+  s := 0
+  WHILE i DO
+  {
+    s := s + i * 2 - 1
+    i := i - 1
+  }
+  DONE
+  RETURN s
+}
+'''
+
+RECURSIVE_PROGRAM = '''
+FUNC sum(i, s)
+{
+  IF i THEN RETURN sum(i - 1, s + i * 2 - 1) FI
+  RETURN s
+}
+FUNC main()
+{
+  RETURN sum(%d, 0)
+}
+'''
+
+
+def bench_loops(args):
+    """
+    Run time of a WHILE loop against the same iteration written as recursion, at -O0 and -O2
+    """
+    print('{:<12}{:>6}{:>12}{:>12}{:>12}'.format('program', 'opt', 'iterations', 'compile s', 'run s'))
+    for opt_level in (0, 2):
+        config.opt_level = opt_level
+        for name, program in (('loop', LOOP_PROGRAM), ('recursive', RECURSIVE_PROGRAM)):
+            generator = build_module(program % args.iterations)
+            evaluator = VSLCEvaluator()
+            version = generator.module_version
+            # The first evaluation includes lowering and JIT compilation, the second only runs main
+            first, result = _timeit(lambda: evaluator.evaluate(generator.module, version))
+            run, _ = _timeit(lambda: evaluator.evaluate(generator.module, version))
+            assert result == args.iterations ** 2, result
+            print('{:<12}{:>6}{:>12}{:>12.4f}{:>12.4f}'.format(name, '-O%d' % opt_level, args.iterations,
+                                                             first - run, run))
+    config.opt_level = 0
+
+
+def bench_ssa(args):
+    """
+    IR size and run time at -O0 of a variable-heavy loop, with and without SSA promotion
+    """
+    names = ['v%d' % i for i in range(args.variables)]
+    lines = ['FUNC main()', '{', '  VAR i, ' + ', '.join(names), '  i := %d' % args.iterations, '  WHILE i DO', '  {']
+    lines.append('    VAR t')  # declared in the loop body
+    for previous, name in zip(names, names[1:]):
+        lines.append('    {} := {} + {} * 0.5 - t'.format(name, name, previous))
+    lines.append('    t := {} / 1000'.format(names[-1]))
+    lines.append('    i := i - 1')
+    lines.append('  }')
+    lines.append('  DONE')
+    lines.append('  RETURN {}'.format(names[-1]))
+    lines.append('}')
+    generator = build_module('\n'.join(lines))
+
+    config.opt_level = 0
+    print('{:<12}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('promotion', 'IR KB', 'alloca', 'load', 'store', 'run s'))
+    for promotion in (False, True):
+        config.ssa_promotion = promotion
+        ir_text = str(lower(generator.module))
+        evaluator = VSLCEvaluator()
+        version = generator.module_version
+        evaluator.evaluate(generator.module, version)
+        run, _ = _timeit(lambda: evaluator.evaluate(generator.module, version))
+        print('{:<12}{:>10.1f}{:>10}{:>10}{:>10}{:>10.4f}'.format(
+            str(promotion), len(ir_text) / 1024, ir_text.count(' alloca '), ir_text.count(' load '),
+            ir_text.count('store '), run))
+    config.ssa_promotion = True
+
+
+INLINING_PROGRAM = '''
+FUNC sq(x)
+{
+  RETURN x * x
+}
+FUNC main()
+{
+  VAR i, s
+  i := %d
+  WHILE i DO
+  {
+    s := s + sq(i) - sq(i - 1)
+    i := i - 1
+  }
+  DONE
+  RETURN s
+}
+'''
+
+
+def bench_inlining(args):
+    """
+    Calls left in a loop calling a small function and run time at every -O level. The levels
+    with an inliner must inline the calls
+    """
+    print('{:<6}{:>10}{:>8}{:>10}'.format('level', 'threshold', 'calls', 'run s'))
+    for level in sorted(OPT_LEVELS):
+        set_opt_level(level)
+        generator = build_module(INLINING_PROGRAM % args.iterations)
+        calls = str(lower(generator.module).get_function('main')).count(' @sq(')
+        evaluator = VSLCEvaluator()
+        version = generator.module_version
+        evaluator.evaluate(generator.module, version)
+        run, result = _timeit(lambda: evaluator.evaluate(generator.module, version))
+        threshold = INLINE_THRESHOLDS.get((config.opt_level, config.size_level))
+        print('{:<6}{:>10}{:>8}{:>10.4f}'.format('-O' + level, threshold or '', calls, run))
+        assert result == args.iterations ** 2, result
+        assert threshold is None or calls == 0, 'sq is not inlined at -O{}'.format(level)
+    set_opt_level('0')
+
+
+def bench_partitions(args):
+    """
+    Codegen and object emission of one large program as a single module, against the
+    function-level partitions compiled in parallel
+    """
+    config.opt_level = args.opt_level
+    with parser_pool.parser() as parser:
+        program = parser.parse(generate_program(args.functions, 20))
+
+    def run_single():
+        generator = LLVMCodeGenerator('compile', module_name='bench')
+        generator.generate_code(program)
+        return VSLCEvaluator().compile_to_object_code(generator.module)
+
+    print('CPUs: {}, -O{}, {} functions'.format(os.cpu_count(), args.opt_level, args.functions + 1))
+    print('{:<16}{:>10}{:>10}{:>10}'.format('mode', 'seconds', 'speedup', 'KB'))
+    single, obj_code = _timeit(run_single)
+    print('{:<16}{:>10.3f}{:>10.2f}{:>10.1f}'.format('single module', single, 1, len(obj_code) / 1024))
+    partitions = 2
+    while partitions <= args.max_partitions:
+        elapsed, archive = _timeit(lambda: compile_partitioned(program, 'bench', partitions))
+        print('{:<16}{:>10.3f}{:>10.2f}{:>10.1f}'.format('%d partitions' % partitions, elapsed, single / elapsed,
+                                                         len(archive) / 1024))
+        partitions *= 2
+    config.opt_level = 0
+
+
+# Phases timed by measure_phases(), in order
+PHASES = ('lex', 'parse', 'fold', 'codegen', 'serialize', 'parse_ir', 'optimize', 'emit', 'jit', 'run')
+
+
+def measure_phases(code):
+    """
+    Time every phase of compiling and running a program. 'lex' runs VSLCLexer alone, while
+    'parse' includes the lexing driven by the parser. The output of the program is discarded.
+    :param code: VSL source code
+    :return: dict of the sizes and of the seconds of every phase
+    """
+    phases = {}
+    record = {'source_bytes': len(code), 'phases': phases}
+
+    def run_lexer():
+        lexer = VSLCLexer()
+        lexer.build()
+        lexer.lexer.input(code)
+        count = 0
+        token = lexer.lexer.token
+        while token():
+            count += 1
+        return count
+
+    phases['lex'], record['tokens'] = _timeit(run_lexer)
+    with parser_pool.parser() as parser:
+        phases['parse'], node = _timeit(lambda: parser.parse(code))
+    phases['fold'], node = _timeit(lambda: fold(node) if config.ast_fold else node)
+
+    generator = LLVMCodeGenerator('compile', module_name='bench')
+    phases['codegen'], _ = _timeit(lambda: generator.generate_code(node))
+    phases['serialize'], ir_text = _timeit(lambda: str(generator.module))
+    record['ir_bytes'] = len(ir_text)
+    phases['parse_ir'], llvmmod = _timeit(lambda: llvm.parse_assembly(ir_text))
+    phases['optimize'], _ = _timeit(lambda: get_optimizer().run(llvmmod))
+
+    target_machine = get_target_machine(codemodel='small', opt=config.opt_level)
+    phases['emit'], obj_code = _timeit(lambda: target_machine.emit_object(llvmmod))
+    record['object_bytes'] = len(obj_code)
+
+    def create_engine():
+        # The engine takes ownership of the optimized module and of its own target machine
+        engine = llvm.create_mcjit_compiler(
+            llvmmod, llvm.Target.from_default_triple().create_target_machine(opt=config.opt_level))
+        engine.finalize_object()
+        return engine
+
+    phases['jit'], engine = _timeit(create_engine)
+    main_function = CFUNCTYPE(c_double)(engine.get_function_address('main'))
+    with capture_fd(1, io.StringIO()):
+        phases['run'], record['result'] = _timeit(main_function)
+    engine.close()
+    return record
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_phases(args):
+    """
+    Time of every phase against the scale of generated programs of every shape. The times
+    are printed in microseconds per unit of scale, so a phase which scales linearly keeps
+    a flat column. The results can be saved as JSON and compared with an earlier run.
+    """
+    initialize()
+    config.opt_level = args.opt_level
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            for run in json.load(baseline_file)['runs']:
+                baseline[run['shape'], run['scale']] = run['phases']
+
+    results = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'llvmlite': llvmlite_version()['version'],
+            'opt_level': config.opt_level,
+            'depth': args.depth,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'runs': [],
+    }
+
+    print('us per unit of scale' + (', ratio to the baseline in parentheses' if baseline else ''))
+    print('{:<12}{:>8}{:>9}'.format('shape', 'scale', 'KB') + ''.join('{:>10}'.format(phase) for phase in PHASES))
+    for shape in args.shape or sorted(SHAPES):
+        for scale in args.scales:
+            record = measure_phases(generate(shape, scale, args.depth))
+            record['shape'] = shape
+            record['scale'] = scale
+            results['runs'].append(record)
+
+            row = '{:<12}{:>8}{:>9.1f}'.format(shape, scale, record['source_bytes'] / 1024)
+            for phase in PHASES:
+                row += '{:>10.2f}'.format(record['phases'][phase] / max(scale, 1) * 1e6)
+            print(row)
+            old = baseline.get((shape, scale))
+            if old is not None:
+                print(' ' * 29 + ''.join('{:>10}'.format('({:.2f})'.format(record['phases'][phase] / old[phase])
+                                                         if old.get(phase) else '-') for phase in PHASES))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+        print('Results have been saved to the \'{}\' file.'.format(args.output))
+    config.opt_level = 0
+
+
+def bench_incremental(args):
+    """
+    Recompile time of a large program after editing one function, incremental against
+    the whole-program codegen
+    """
+    initialize()
+    code = generate_program(args.functions - 1, args.statements)
+    # Edit one statement in the middle function
+    middle = 'FUNC f{}('.format(args.functions // 2)
+    start = code.index(middle)
+    edited = code[:start] + code[start:].replace('(a + 0) * b', '(a + 1) * b', 1)
+    assert edited != code
+
+    def parse(source):
+        with parser_pool.parser() as parser:
+            return parser.parse(source)
+
+    def compile_whole(program):
+        generator = LLVMCodeGenerator('compile', module_name='bench')
+        generator.generate_code(program)
+        return VSLCEvaluator().compile_to_object_code(generator.module)
+
+    compiler = IncrementalCompiler()
+    elapsed, program = _timeit(lambda: parse(code))
+    print('{} functions, {:.1f} KB, parse {:.3f} s (the same for every mode)'.format(
+        args.functions, len(code) / 1024, elapsed))
+    print('{:<28}{:>10}{:>10}{:>10}'.format('compile', 'seconds', 'generated', 'reused'))
+    elapsed, _ = _timeit(lambda: compile_whole(program))
+    print('{:<28}{:>10.3f}{:>10}{:>10}'.format('whole program', elapsed, args.functions, 0))
+    elapsed, _ = _timeit(lambda: compiler.compile(program))
+    print('{:<28}{:>10.3f}{:>10}{:>10}'.format('incremental, cold', elapsed, compiler.generated, compiler.reused))
+    elapsed, _ = _timeit(lambda: compiler.compile(program))
+    print('{:<28}{:>10.3f}{:>10}{:>10}'.format('incremental, unchanged', elapsed, compiler.generated,
+                                              compiler.reused))
+
+    program = parse(edited)
+    elapsed, _ = _timeit(lambda: compile_whole(program))
+    print('{:<28}{:>10.3f}{:>10}{:>10}'.format('whole program, 1 edit', elapsed, args.functions, 0))
+    elapsed, llvmmod = _timeit(lambda: compiler.link(program))
+    print('{:<28}{:>10.3f}{:>10}{:>10}'.format('incremental link, 1 edit', elapsed, compiler.generated,
+                                              compiler.reused))
+    target_machine = get_target_machine(codemodel='small', opt=config.opt_level)
+    elapsed, _ = _timeit(lambda: target_machine.emit_object(llvmmod))
+    print('{:<28}{:>10.3f}'.format('  + emit', elapsed))
+
+
+def _run_in_child(func):
+    """
+    Run a function in a forked process
+    :param func: returns a json dump-able value
+    :return: the value, or None if the process crashed
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        with os.fdopen(write_fd, 'w') as pipe:
+            json.dump(func(), pipe)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        data = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    return json.loads(data) if status == 0 else None
+
+
+def _measure_in_child(func):
+    """
+    Run a function in a forked process, whose peak memory is not raised by the earlier runs
+    :return: seconds, traced Python peak bytes, maximum resident set KB
+    """
+    def measure():
+        tracemalloc.start()
+        elapsed, _ = _timeit(func)
+        _, peak = tracemalloc.get_traced_memory()
+        return elapsed, peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return _run_in_child(measure)
+
+
+def bench_streaming(args):
+    """
+    Peak memory of the regular compile of generated files against the streaming mode
+    """
+    initialize()
+    config.object_cache = False
+    # Fork after the parser tables and LLVM are loaded, so that they're not measured
+    with parser_pool.parser():
+        pass
+    print('{:>10}{:>12}{:>14}{:>12}{:>10}'.format('source MB', 'mode', 'py peak MB', 'maxrss MB', 'seconds'))
+    with tempfile.TemporaryDirectory() as directory:
+        source_filename = os.path.join(directory, 'bench.vsl')
+        object_filename = os.path.join(directory, 'a.out')
+        size = 0.25
+        while size <= args.size:
+            with open(source_filename, 'w') as source_file:
+                source_file.write(generate_source(int(size * 1024 * 1024)))
+                source_file.write('FUNC main()\n{\n  RETURN f0(1, 2)\n}\n')
+            for streaming in (False, True):
+                config.streaming = streaming
+                elapsed, peak, maxrss = _measure_in_child(lambda: compile_file(source_filename, object_filename))
+                print('{:>10.2f}{:>12}{:>14.2f}{:>12.1f}{:>10.3f}'.format(
+                    os.path.getsize(source_filename) / 1024 / 1024, 'streaming' if streaming else 'regular',
+                    peak / 1024 / 1024, maxrss / 1024, elapsed))
+            size *= 2
+    config.streaming = False
+
+
+def bench_codec(args):
+    """
+    Size and speed of the binary AST encoding against to_json + json.dumps, pickle and re-parsing
+    """
+    code = generate_program(args.functions - 1, args.statements)
+    with parser_pool.parser() as parser:
+        parse_time, program = _timeit(lambda: parser.parse(code))
+
+    print('{} functions, {:.1f} KB of source'.format(args.functions, len(code) / 1024))
+    print('{:<16}{:>10}{:>12}{:>12}'.format('format', 'KB', 'encode s', 'decode s'))
+    print('{:<16}{:>10.1f}{:>12}{:>12.3f}'.format('source, parse', len(code) / 1024, '-', parse_time))
+
+    encode_time, data = _timeit(lambda: json.dumps(program.to_json()).encode('utf-8'))
+    # Only back to dicts, there is no decoder from JSON to AST nodes
+    decode_time, _ = _timeit(lambda: json.loads(data))
+    print('{:<16}{:>10.1f}{:>12.3f}{:>12.3f}'.format('json', len(data) / 1024, encode_time, decode_time))
+
+    encode_time, data = _timeit(lambda: pickle.dumps(program, pickle.HIGHEST_PROTOCOL))
+    decode_time, _ = _timeit(lambda: pickle.loads(data))
+    print('{:<16}{:>10.1f}{:>12.3f}{:>12.3f}'.format('pickle', len(data) / 1024, encode_time, decode_time))
+
+    encode_time, data = _timeit(lambda: astcodec.dumps(program))
+    decode_time, _ = _timeit(lambda: astcodec.loads(data))
+    print('{:<16}{:>10.1f}{:>12.3f}{:>12.3f}'.format('astcodec', len(data) / 1024, encode_time, decode_time))
+
+    def encode_functions():
+        stream = io.BytesIO()
+        encoder = astcodec.Encoder(stream)
+        for function in program.function_list:
+            encoder.write(function)
+        return stream.getvalue()
+
+    encode_time, data = _timeit(encode_functions)
+    decode_time, _ = _timeit(lambda: list(astcodec.Decoder(io.BytesIO(data))))
+    print('{:<16}{:>10.1f}{:>12.3f}{:>12.3f}'.format('  per function', len(data) / 1024, encode_time, decode_time))
+
+
+def bench_deep(args):
+    """
+    Time of every pass over chains of operators and nested parentheses, far deeper than the
+    recursion limit
+    """
+    print('recursion limit {}'.format(sys.getrecursionlimit()))
+    print('{:<8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'shape', 'operands', 'parse', 'to_json', 'encode', 'decode', 'fold', 'codegen'))
+    operands = 1000
+    while operands <= args.max_operands:
+        for shape in ('chain', 'nested'):
+            if shape == 'chain':
+                expression = ' + '.join(['a', 'b'] * (operands // 2))
+            else:
+                expression = '(a + ' * (operands - 1) + 'b' + ')' * (operands - 1)
+            code = 'FUNC main()\n{\n  VAR a, b\n  a := 1\n  b := 2\n  RETURN %s\n}\n' % expression
+
+            with parser_pool.parser() as parser:
+                parse_time, node = _timeit(lambda: parser.parse(code))
+            json_time, _ = _timeit(node.to_json)
+            encode_time, data = _timeit(lambda: astcodec.dumps(node))
+            decode_time, _ = _timeit(lambda: astcodec.loads(data))
+            fold_time, node = _timeit(lambda: fold(node))
+            codegen_time, _ = _timeit(lambda: LLVMCodeGenerator('compile', module_name='bench').generate_code(node))
+            print('{:<8}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+                shape, operands, parse_time, json_time, encode_time, decode_time, fold_time, codegen_time))
+            del node, data
+        operands *= 10
+
+
+# Kernel name => program of integer arithmetic, whose results stay exact in doubles
+INTEGER_KERNELS = {
+    'sum': LOOP_PROGRAM,
+    'nested': '''
+FUNC main()
+{
+  VAR i, j, s
+  i := %d
+  WHILE i DO
+  {
+    j := 100
+    WHILE j DO
+    {
+      s := s + i * j - 3 * j
+      j := j - 1
+    }
+    DONE
+    i := i - 1
+  }
+  DONE
+  RETURN s
+}
+''',
+    'counters': '''
+FUNC main()
+{
+  VAR n, i, even, odd, s
+  n := %d
+  WHILE n - i DO
+  {
+    IF even - odd THEN odd := odd + 1 ELSE even := even + 1 FI
+    s := s + even * 2 - odd
+    i := i + 1
+  }
+  DONE
+  RETURN s - n
+}
+''',
+}
+
+
+def bench_integers(args):
+    """
+    Run time of integer kernels with all-double code against the integer inference, at -O0 and -O2
+    """
+    print('{:<10}{:>6}{:>10}{:>12}{:>12}{:>12}'.format('kernel', 'opt', 'inference', 'compile s', 'run s', 'speedup'))
+    for opt_level in (0, 2):
+        config.opt_level = opt_level
+        for name, program in INTEGER_KERNELS.items():
+            code = program % (args.size if name != 'nested' else args.size // 100)
+            results = []
+            for inference in (False, True):
+                config.integer_inference = inference
+                generator = build_module(code)
+                evaluator = VSLCEvaluator()
+                version = generator.module_version
+                # The first evaluation includes lowering and JIT compilation, the second only runs main
+                first, result = _timeit(lambda: evaluator.evaluate(generator.module, version))
+                run, _ = _timeit(lambda: evaluator.evaluate(generator.module, version))
+                results.append((result, run))
+                print('{:<10}{:>6}{:>10}{:>12.4f}{:>12.4f}{:>12}'.format(
+                    name, '-O%d' % opt_level, 'on' if inference else 'off', first - run, run,
+                    '{:.2f}x'.format(results[0][1] / run) if inference else ''))
+            assert results[0][0] == results[1][0], results
+    config.integer_inference = False
+    config.opt_level = 0
+
+
+TAIL_RECURSIVE_PROGRAM = '''
+FUNC count(i, s)
+{
+  IF i THEN RETURN count(i - 1, s + 1) FI
+  RETURN s
+}
+FUNC main()
+{
+  RETURN count(%d, 0)
+}
+'''
+
+
+def bench_tailcalls(args):
+    """
+    Run time and stack use of tail recursion with and without the tail-call elimination
+    """
+    initialize()
+    stack_limit = resource.getrlimit(resource.RLIMIT_STACK)[0]
+    print('stack limit {}'.format('unlimited' if stack_limit == resource.RLIM_INFINITY else
+                                  '{} MB'.format(stack_limit // 1024 // 1024)))
+    print('{:>6}{:>12}{:>8}{:>12}{:>12}'.format('opt', 'depth', 'TCE', 'run s', 'stack MB'))
+
+    def run(depth):
+        # Warm up, so that the JIT of the measured run adds little to the resident set
+        VSLCEvaluator().evaluate(build_module(TAIL_RECURSIVE_PROGRAM % 1).module)
+        module = build_module(TAIL_RECURSIVE_PROGRAM % depth).module
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        elapsed, result = _timeit(lambda: VSLCEvaluator().evaluate(module))
+        assert result == depth, result
+        return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    for opt_level in (0, 2):
+        config.opt_level = opt_level
+        depth = 1000
+        while depth <= args.max_depth:
+            for elimination in (False, True):
+                config.tail_call_elimination = elimination
+                measured = _run_in_child(lambda: run(depth))
+                if measured is None:
+                    print('{:>6}{:>12}{:>8}{:>24}'.format('-O%d' % opt_level, depth, 'on' if elimination else 'off',
+                                                         'stack overflow'))
+                else:
+                    print('{:>6}{:>12}{:>8}{:>12.4f}{:>12.1f}'.format('-O%d' % opt_level, depth,
+                                                                     'on' if elimination else 'off',
+                                                                     measured[0], measured[1] / 1024))
+            depth *= 10
+    config.tail_call_elimination = True
+    config.opt_level = 0
+
+
+MEMO_KERNELS = {
+    'fib': ('''
+FUNC fib(n)
+{
+  IF 2 - n THEN RETURN n FI
+  RETURN fib(n - 1) + fib(n - 2)
+}
+FUNC main()
+{
+  RETURN fib(%d)
+}
+''', lambda size: (size,)),
+    'binom': ('''
+FUNC binom(n, k)
+{
+  IF k THEN IF n - k THEN RETURN binom(n - 1, k - 1) + binom(n - 1, k) FI FI
+  RETURN 1
+}
+FUNC main()
+{
+  RETURN binom(%d, %d)
+}
+''', lambda size: (size - 6, (size - 6) // 2)),
+    # A loop calling a pure function on a cycle of distinct arguments, which fit in the table
+    # or keep evicting each other
+    'cycle': ('''
+FUNC work(x)
+{
+  VAR i, s
+  i := 100
+  WHILE i DO
+  {
+    s := s + x * i
+    i := i - 1
+  }
+  DONE
+  RETURN s
+}
+FUNC main()
+{
+  VAR n, k, s
+  n := 1000000
+  WHILE n DO
+  {
+    k := k + 1
+    IF k - %d THEN k := 0 FI
+    s := s + work(k)
+    n := n - 1
+  }
+  DONE
+  RETURN s
+}
+''', None),
+}
+
+
+def bench_memo(args):
+    """
+    Run time and hit rate of recursive and looping kernels with and without the memoization of
+    the pure functions, at -O0 and -O2
+    """
+    # The memo tables keep their entries between the runs of an engine, so every measure
+    # includes the JIT compilation of a fresh engine
+    print('{:<16}{:>6}{:>8}{:>12}{:>10}{:>12}'.format('kernel', 'opt', 'memo', 'jit+run s', 'hits %', 'speedup'))
+    cases = [(name, arguments(args.size)) for name, (_, arguments) in MEMO_KERNELS.items() if arguments]
+    cases += [('cycle', (cycle,)) for cycle in (config.memo_table_size // 4, config.memo_table_size * 16)]
+    for opt_level in (0, 2):
+        config.opt_level = opt_level
+        for name, arguments in cases:
+            code = MEMO_KERNELS[name][0] % arguments
+            results = []
+            for memoize in (False, True):
+                config.memoize = memoize
+                evaluator = VSLCEvaluator()
+                module = build_module(code).module
+                with redirect_stderr(io.StringIO()):
+                    elapsed, result = _timeit(lambda: evaluator.evaluate(module))
+                results.append((result, elapsed))
+                hits = sum(hits for _, hits, _ in evaluator.memo_counters)
+                calls = hits + sum(misses for _, _, misses in evaluator.memo_counters)
+                print('{:<16}{:>6}{:>8}{:>12.4f}{:>10}{:>12}'.format(
+                    '{}({})'.format(name, ', '.join(map(str, arguments))), '-O%d' % opt_level, 'on' if memoize else 'off', elapsed,
+                    '{:.1f}'.format(100.0 * hits / calls) if memoize else '',
+                    '{:.2f}x'.format(results[0][1] / elapsed) if memoize else ''))
+            assert results[0][0] == results[1][0], results
+    config.memoize = False
+    config.opt_level = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='vslcpy benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    lexer_parser = subparsers.add_parser('lexer', help='tokens/sec of VSLCLexer against VSLCScanner')
+    lexer_parser.add_argument('--size', type=float, default=4, help='size of the generated source in MB')
+    lexer_parser.set_defaults(func=bench_lexer)
+
+    scaling_parser = subparsers.add_parser('scaling', help='parse time against the number of statements')
+    scaling_parser.add_argument('--max-statements', type=int, default=100000)
+    scaling_parser.set_defaults(func=bench_scaling)
+
+    memory_parser = subparsers.add_parser('memory', help='memory retained by the AST of generated programs')
+    memory_parser.add_argument('--size', type=float, default=4, help='size of the largest source in MB')
+    memory_parser.set_defaults(func=bench_memory)
+
+    lowering_parser = subparsers.add_parser('lowering', help='time of the lowering phases on a large module')
+    lowering_parser.add_argument('--functions', type=int, default=500)
+    lowering_parser.set_defaults(func=bench_lowering)
+
+    strings_parser = subparsers.add_parser('strings', help='global constants and IR size of print-heavy programs')
+    strings_parser.add_argument('--prints', type=int, default=10000)
+    strings_parser.set_defaults(func=bench_strings)
+
+    codegen_parser = subparsers.add_parser('codegen', help='codegen time of large expression trees')
+    codegen_parser.add_argument('--statements', type=int, default=200)
+    codegen_parser.add_argument('--operands', type=int, default=256)
+    codegen_parser.add_argument('--repeat', type=int, default=5)
+    codegen_parser.set_defaults(func=bench_codegen)
+
+    loops_parser = subparsers.add_parser('loops', help='WHILE loops against recursion')
+    loops_parser.add_argument('--iterations', type=int, default=100000)
+    loops_parser.set_defaults(func=bench_loops)
+
+    ssa_parser = subparsers.add_parser('ssa', help='SSA promotion of variable-heavy functions at -O0')
+    ssa_parser.add_argument('--variables', type=int, default=50)
+    ssa_parser.add_argument('--iterations', type=int, default=100000)
+    ssa_parser.set_defaults(func=bench_ssa)
+
+    inlining_parser = subparsers.add_parser('inlining', help='inlining of a small function at every -O level')
+    inlining_parser.add_argument('--iterations', type=int, default=10000000)
+    inlining_parser.set_defaults(func=bench_inlining)
+
+    partitions_parser = subparsers.add_parser('partitions', help='parallel codegen partitions of one program')
+    partitions_parser.add_argument('--functions', type=int, default=2000)
+    partitions_parser.add_argument('--opt-level', type=int, default=2)
+    partitions_parser.add_argument('--max-partitions', type=int, default=max(2, os.cpu_count() or 1))
+    partitions_parser.set_defaults(func=bench_partitions)
+
+    phases_parser = subparsers.add_parser('phases', help='time of every phase on generated programs')
+    phases_parser.add_argument('--shape', nargs='+', choices=sorted(SHAPES), default=None,
+                               help='program shapes, all by default')
+    phases_parser.add_argument('--scales', nargs='+', type=int, default=[100, 1000, 10000])
+    phases_parser.add_argument('--depth', type=int, default=32,
+                               help='nesting depth of expressions and recursion depth')
+    phases_parser.add_argument('--opt-level', type=int, default=0)
+    phases_parser.add_argument('--output', default=None, help='save the results as JSON')
+    phases_parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    phases_parser.set_defaults(func=bench_phases)
+
+    incremental_parser = subparsers.add_parser('incremental', help='recompile after a one-function edit')
+    incremental_parser.add_argument('--functions', type=int, default=5000)
+    incremental_parser.add_argument('--statements', type=int, default=5)
+    incremental_parser.set_defaults(func=bench_incremental)
+
+    streaming_parser = subparsers.add_parser('streaming', help='peak memory of the streaming compile mode')
+    streaming_parser.add_argument('--size', type=float, default=4, help='largest source in MB')
+    streaming_parser.set_defaults(func=bench_streaming)
+
+    codec_parser = subparsers.add_parser('codec', help='binary AST encoding against JSON, pickle and re-parsing')
+    codec_parser.add_argument('--functions', type=int, default=2000)
+    codec_parser.add_argument('--statements', type=int, default=10)
+    codec_parser.set_defaults(func=bench_codec)
+
+    deep_parser = subparsers.add_parser('deep', help='passes over expressions deeper than the recursion limit')
+    deep_parser.add_argument('--max-operands', type=int, default=1000000)
+    deep_parser.set_defaults(func=bench_deep)
+
+    integers_parser = subparsers.add_parser('integers', help='integer kernels with and without the integer inference')
+    integers_parser.add_argument('--size', type=int, default=10000000, help='iterations of every kernel')
+    integers_parser.set_defaults(func=bench_integers)
+
+    tailcalls_parser = subparsers.add_parser('tailcalls', help='tail recursion with and without the elimination')
+    tailcalls_parser.add_argument('--max-depth', type=int, default=100000000)
+    tailcalls_parser.set_defaults(func=bench_tailcalls)
+
+    memo_parser = subparsers.add_parser('memo', help='recursive and looping kernels with and without the memoization')
+    memo_parser.add_argument('--size', type=int, default=35, help='argument of fib, binom takes size - 6')
+    memo_parser.set_defaults(func=bench_memo)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+cache.py
+
+Content-addressed on-disk cache of compiled object code.
+
+An entry is keyed by the hash of the source text, the config values which affect
+code generation, the llvmlite version and the target triple. So a hit can skip
+the whole lexing, parsing, codegen and object emission pipeline.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+import llvmlite.binding as llvm
+from llvmlite._version import get_versions as llvmlite_version
+
+import config
+
+# Names of the config values which change the produced object code
+KEY_CONFIG = (
+    'main_function_name',
+    'float_format',
+    'ast_fold',
+    'integer_inference',
+    'tail_call_elimination',
+    'memoize',
+    'memo_table_size',
+    'opt_level',
+    'size_level',
+    'inline_threshold',
+    'loop_vectorize',
+    'slp_vectorize',
+    'ssa_promotion',
+    'codegen_partitions',
+    'incremental',
+)
+
+STATS_FILE = 'stats.json'
+
+# Held locked while the stats file is updated. The stats file itself is replaced on every update,
+# so it can't hold the lock
+STATS_LOCK_FILE = 'stats.lock'
+
+
+def fingerprint():
+    """
+    Everything besides the source which the produced code depends on: the config values
+    of KEY_CONFIG, the llvmlite version and the target triple
+    :return: bytes
+    """
+    parts = ['{}={!r}'.format(name, getattr(config, name)) for name in KEY_CONFIG]
+    parts.append('llvmlite={}'.format(llvmlite_version()['version']))
+    parts.append('triple={}'.format(llvm.get_default_triple()))
+    return ''.join('\0' + part for part in parts).encode('utf-8')
+
+
+def default_directory():
+    """
+    Directory of the caches, config.cache_dir or '~/.cache/vslc'
+    :return:
+    """
+    return config.cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'vslc')
+
+
+class ObjectCache(object):
+    """Size-bounded object code cache living in a directory
+
+    Entries are evicted in least recently used order when the total size exceeds
+    max_size. Every hit refreshes the mtime of the entry. The entries are files named
+    <key><suffix>, so caches of different contents can share a directory.
+    """
+    def __init__(self, directory=None, max_size=None, suffix='.o'):
+        if directory is None:
+            directory = default_directory()
+        if max_size is None:
+            max_size = config.cache_max_size
+        assert isinstance(max_size, int) and max_size > 0
+
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(code):
+        """
+        Compute the cache key of a piece of source code
+        :param code: VSL source code
+        :return: hex digest
+        """
+        assert isinstance(code, str)
+
+        digest = hashlib.sha256()
+        digest.update(code.encode('utf-8'))
+        digest.update(fingerprint())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """
+        Return the cached object code or None
+        :param key:
+        :return:
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as obj_file:
+                obj_code = obj_file.read()
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        os.utime(path)  # mark as recently used
+        self._count('hits')
+        return obj_code
+
+    def put(self, key, obj_code):
+        """
+        Store the object code, then evict old entries when the cache is too large
+        :param key:
+        :param obj_code:
+        :return:
+        """
+        assert isinstance(obj_code, bytes)
+
+        self._write_atomic(self._path(key), obj_code)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size
+        :return: number of the removed entries
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by another process
+                continue
+            total_size -= size
+            removed += 1
+        if removed:
+            self._count('evictions', removed)
+        return removed
+
+    def stats(self):
+        """
+        Return the hit/miss/eviction counters and the current size of the cache
+        :return:
+        """
+        stats = self._read_stats()
+        stats['entries'] = 0
+        stats['size'] = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                stats['entries'] += 1
+                stats['size'] += entry.stat().st_size
+        return stats
+
+    def _read_stats(self):
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        try:
+            with open(os.path.join(self.directory, STATS_FILE), 'r') as stats_file:
+                stats.update(json.load(stats_file))
+        except (FileNotFoundError, ValueError):
+            pass
+        return stats
+
+    def _count(self, name, n=1):
+        # The workers of the parallel drivers share the directory, so the read-modify-write
+        # must not interleave with another one
+        with open(os.path.join(self.directory, STATS_LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                stats = self._read_stats()
+                stats[name] += n
+                self._write_atomic(os.path.join(self.directory, STATS_FILE), json.dumps(stats).encode('utf-8'))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path, data):
+        # Write into a temporary file then rename, so that a concurrent reader never sees half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # evict() only sees the entries, so a temporary file left behind would never go
+            os.unlink(tmp_path)
+            raise
@@ -6,16 +6,44 @@ LLVM IR Code Generation
 from llvmlite import ir
 
 from ast import Program, Block, FunctionDefinition, AssignStatement, BinaryOperation, IfStatement, \
-    VariableDeclaration, FunctionCall, ReturnStatement, WhileStatement, PrintStatement, Text
+    VariableDeclaration, FunctionCall, ReturnStatement, WhileStatement, PrintStatement, Text, Expression, Number, \
+    ID, ASTNode, walk
 import config
-from utils import ran6
+from purity import is_pure
+from tracing import phase, count_nodes, count_instructions
+from typeinfer import infer_integers
+
+
+# Suffixes of the names of the hit and miss counters of a memoized function, see
+# _codegen_memo_wrapper()
+MEMO_HITS_SUFFIX = '.memo.hits'
+MEMO_MISSES_SUFFIX = '.memo.misses'
+
+# Multiplier of the Fibonacci hashing of the memo tables, 2^64 / golden ratio as a signed i64
+_MEMO_HASH_MULTIPLIER = 0x9E3779B97F4A7C15 - 2 ** 64
 
 
 class CodegenError(Exception):
     pass
 
 
+def is_self_tail_call(function, expression):
+    """
+    Return True if a RETURN expression of a function is a call of the function itself with all
+    its parameters, which can be turned into a jump back to the start of the function
+    :param function: FunctionDefinition
+    :param expression: Expression of a ReturnStatement
+    :return:
+    """
+    return isinstance(expression, FunctionCall) and not expression.minus_flag and \
+        expression.name.name == function.name.name and \
+        len(expression.argument_list or ()) == len(function.parameter_list)
+
+
 class LLVMCodeGenerator(object):
+    # AST node class => (visitor, whether the node is an Expression), see _codegen()
+    _dispatch_table = {}
+
     def __init__(self, mode, module_name=''):
         """Initialize the code generator.
 
@@ -23,7 +51,10 @@ class LLVMCodeGenerator(object):
         scope, we make a compromise in order to run the shell mode.
 
         In 'shell' mode, all codes in the global scope are lying in a predefined function
-        named 'main', which is created when the generator init'd.
+        named 'main.<n>', which is created when the generator init'd. Variables declared in
+        the global scope are global variables of the module. The module of the shell can be
+        detached by detach_module() and handed to a JITSession, then the generator goes on
+        with a new module numbered n + 1.
 
         Otherwise in the compile mode, we do not allow separated statements in the global
         scope, which is guaranteed by the syntax analysis. So there must be a function
@@ -32,81 +63,236 @@ class LLVMCodeGenerator(object):
         assert mode in ('shell', 'compile',)
 
         self.mode = mode
-        self.module = ir.Module(module_name)
-        if mode == 'shell':
-            main_function_type = ir.FunctionType(ir.VoidType(), ())
-            main_function = ir.Function(self.module, main_function_type, name=config.main_function_name)
+        self.module_name = module_name
 
-            # The main block start before the return block. The llvmlite stores the blocks
-            # in a OrderedDict.
-            self.block = main_function.append_basic_block('entry')
+        # Bumped whenever code is generated into the module. Evaluators cache the lowered
+        # module per version.
+        self.module_version = 0
 
-            # Current IR builder.
-            # In compile mode, it will be init'd at the start of the _codegen_FunctionDefinition().
-            # In shell mode, self.builder is init'd here at __init__() of the code generator.
-            # But remember to save it when call a _codegen_FunctionDefinition(), then restore it
-            # at the end of the _codegen_FunctionDefinition()
-            self.builder = ir.IRBuilder(self.block)
-
-            # Generate the ret void code in advance and set the builder to the start of the entry block
-            self.builder.ret_void()
-            self.builder.position_at_start(self.block)
-
-            # Manages a symbol table while the predefined 'main' function is being codegen'd.
-            self.main_symbol_table = {}
-
-            # ========  LLVM IR After __init__('shell')  ===========
-            # ; ModuleID = ""
-            # target triple = "unknown-unknown-unknown"
-            # target datalayout = ""
-            #
-            # define void @"main"()
-            # {
-            # entry:
-            # ; <= current self.builder should be here
-            #   ret void
-            # }
-            # ======================  END  =========================
+        # Manages a symbol table while the 'main' function is being codegen'd.
+        self.main_symbol_table = {}
 
         # Manages a symbol table while a function is being codegen'd. Maps var
         # names to ir.Value which represents the var's address (alloca).
         self.function_symbol_table = {}
 
+        # The current FunctionDefinition, the allocas of its parameters in order, and the block
+        # which its self tail calls branch to when config.tail_call_elimination is on
+        self.function = None
+        self.parameter_allocas = []
+        self.tail_recursion_block = None
+        # The call whose result is returned at once, see _codegen_ReturnStatement()
+        self.tail_call = None
+
+        # Names of the variables of the current function which are kept in i64, and id() of
+        # its expression nodes which are computed in i64, when config.integer_inference is on.
+        # See typeinfer.py
+        self.integer_variables = set()
+        self.integer_expressions = set()
+
+        # C strings of the module by content, see _intern_cstr()
+        self.constant_pool = {}
+        # Prefix of the names of the C strings. Modules which are linked together get different
+        # prefixes, so that the linker doesn't need to rename their constants apart.
+        self.constant_prefix = '.str'
+
+        # Types of all the defined functions. In shell mode they are declared again in
+        # every new module, so that the code of the new module can call them.
+        self.function_types = {}
+
+        # Functions defined in other modules, name => number of parameters. They are declared
+        # on their first call, see declare_function()
+        self.external_functions = {}
+
+        # Names of the pure functions defined so far, when config.memoize is on. See purity.py
+        self.pure_functions = set()
+
+        if mode == 'shell':
+            self.module_count = 0
+            self._start_shell_module()
+        else:
+            self.module = ir.Module(module_name)
+            self.main_function = None
+
+            # Init'd at the start of the _codegen_FunctionDefinition()
+            self.builder = None
+
+    def _start_shell_module(self):
+        """Start a new module of the shell with the predefined 'main.<n>' function
+
+        Functions and global variables of the previous modules are declared in it.
+        """
+        self.module = ir.Module(self.module_name)
+        self.module_version += 1
+        self.constant_pool = {}
+
+        for function_name, function_type in self.function_types.items():
+            ir.Function(self.module, function_type, function_name)
+        for name in self.main_symbol_table:
+            # A global variable without initializer is an external declaration
+            self.main_symbol_table[name] = ir.GlobalVariable(self.module, ir.DoubleType(), name)
+
+        main_function_type = ir.FunctionType(ir.VoidType(), ())
+        self.main_function = ir.Function(self.module, main_function_type,
+                                         name='{}.{}'.format(config.main_function_name, self.module_count))
+        self.module_count += 1
+
+        self.block = self.main_function.append_basic_block('entry')
+
+        # Current IR builder.
+        # In compile mode, it will be init'd at the start of the _codegen_FunctionDefinition().
+        # In shell mode, self.builder is init'd here at __init__() of the code generator.
+        # But remember to save it when call a _codegen_FunctionDefinition(), then restore it
+        # at the end of the _codegen_FunctionDefinition()
+        # The ret void is generated by detach_module().
+        self.builder = ir.IRBuilder(self.block)
+
+        # ========  LLVM IR After _start_shell_module()  ===========
+        # ; ModuleID = "<stdin>"
+        # target triple = "unknown-unknown-unknown"
+        # target datalayout = ""
+        #
+        # define void @"main.0"()
+        # {
+        # entry:
+        # ; <= current self.builder should be here
+        # }
+        # ========================  END  ===========================
+
+    def detach_module(self):
+        """Shell mode: terminate the 'main.<n>' function and start the next module
+
+        :return: the finished module and the name of its 'main.<n>' function
+        """
+        assert self.mode == 'shell'
+
+        if not self.builder.block.is_terminated:
+            self.builder.ret_void()
+        module, main_function_name = self.module, self.main_function.name
+        self._start_shell_module()
+        return module, main_function_name
+
+    def declare_function(self, name, parameter_count):
+        """Declare a function defined in another module, so that the code of this module can call it
+
+        The declaration is resolved when the objects are linked together.
+        :param name: function name
+        :param parameter_count: number of the parameters
+        :return: ir.Function
+        """
+        assert name not in self.module.globals, 'function already in the module: {}'.format(name)
+
+        function_type = ir.FunctionType(ir.DoubleType(), [ir.DoubleType()] * parameter_count)
+        return ir.Function(self.module, function_type, name)
+
     def generate_code(self, node):
         assert isinstance(node, (
             Program, Block, list)), 'root node should be one of Program, Block or a list of FunctionDefinition'
 
-        if isinstance(node, list):  # FunctionDefinition in shell mode
-            for i in node:
-                assert isinstance(i, FunctionDefinition)
-                self._codegen(i)
-        elif isinstance(node, Program):  # only the program mode will have a Program root node
-            self._codegen(node)
-        elif isinstance(node, Block):  # shell mode line input. Insert them into the main function
-            self._codegen(node)
+        self.module_version += 1
+
+        with phase('codegen', module=self.module_name) as span:
+            if isinstance(node, list):  # FunctionDefinition in shell mode
+                for i in node:
+                    assert isinstance(i, FunctionDefinition)
+                    self._codegen(i)
+            elif isinstance(node, Program):  # only the program mode will have a Program root node
+                self._codegen(node)
+            elif isinstance(node, Block):  # shell mode line input. Insert them into the main function
+                self._codegen(node)
+
+            if config.trace:
+                span.set(nodes=count_nodes(node), instructions=count_instructions(self.module))
 
     def _codegen(self, node):
         """Node visitor. Dispathces upon node type.
 
-        For AST node of class Foo, calls self._codegen_Foo. Each visitor is
-        expected to return a llvmlite.ir.Value.
+        For AST node of class Foo, calls self._codegen_Foo, looked up in the dispatch
+        table built once by _build_dispatch_table(). Each visitor is expected to return
+        a llvmlite.ir.Value. Expressions are generated by _codegen_expression().
+        """
+        if config.codegen_debug:
+            assert isinstance(node, ASTNode), 'not an AST node: {!r}'.format(node)
+        try:
+            visitor, is_expression = self._dispatch_table[node.__class__]
+        except KeyError:
+            raise CodegenError('No codegen for node: {}'.format(node.__class__.__name__))
+        if is_expression:
+            return self._codegen_expression(node)
+        return visitor(self, node)
+
+    def _codegen_expression(self, root):
+        """Generate an expression tree in post-order with an explicit stack
+
+        Machine-generated chains of operators nest far deeper than the recursion limit. The
+        operands of a BinaryOperation or a FunctionCall are generated first, left to right, then
+        its visitor is called with their values. So the code is the same as of a recursive visit.
         """
-        method = '_codegen_' + node.__class__.__name__
-        return getattr(self, method)(node)
+        table = self._dispatch_table
+        values = []
+        # (node, None) when the node is entered, (node, state) when its operands are generated.
+        # The state of a FunctionCall is its callee.
+        stack = [(root, None)]
+        while stack:
+            node, state = stack.pop()
+            node_class = node.__class__
+            if node_class is BinaryOperation:
+                if state is None:
+                    stack.append((node, True))
+                    stack.append((node.right_expression, None))
+                    stack.append((node.left_expression, None))
+                    continue
+                rhs = values.pop()
+                lhs = values.pop()
+                value = table[node_class][0](self, node, lhs, rhs)
+            elif node_class is FunctionCall:
+                if state is None:
+                    stack.append((node, self._callee(node)))
+                    if node.argument_list is not None:
+                        stack.extend((argument, None) for argument in reversed(node.argument_list))
+                    continue
+                start = len(values) - (len(node.argument_list) if node.argument_list is not None else 0)
+                arguments = values[start:]
+                del values[start:]
+                value = table[node_class][0](self, node, state, arguments)
+            else:
+                try:
+                    visitor, is_expression = table[node_class]
+                except KeyError:
+                    raise CodegenError('No codegen for node: {}'.format(node_class.__name__))
+                if not is_expression:
+                    raise CodegenError('Not an expression: {}'.format(node_class.__name__))
+                value = visitor(self, node)
+
+            if node.minus_flag:
+                if id(node) in self.integer_expressions:
+                    value = self.builder.neg(value, 'negtmp')
+                else:
+                    # Unary minus. 'fsub -0.0, x' is the canonical form of fneg
+                    value = self.builder.fsub(ir.Constant(ir.DoubleType(), -0.0), self._to_double(value), 'negtmp')
+            values.append(value)
+        return values.pop()
+
+    def _to_double(self, value):
+        """
+        Convert an i64 value of the integer inference to double, other values are returned as is
+        :param value: ir.Value
+        :return: ir.Value
+        """
+        if not isinstance(value.type, ir.IntType):
+            return value
+        if isinstance(value, ir.Constant):
+            return ir.Constant(ir.DoubleType(), float(value.constant))
+        return self.builder.sitofp(value, ir.DoubleType(), 'todouble')
 
     def _codegen_Number(self, node):
+        if id(node) in self.integer_expressions:
+            return ir.Constant(ir.IntType(64), int(node.value))
         return ir.Constant(ir.DoubleType(), float(node.value))
 
     def _codegen_Text(self, node):
-        assert isinstance(node, Text)
-
         escaped_text = bytes(node.value.strip('"'), encoding='utf-8').decode('unicode_escape')
-        c_str = LLVMCodeGenerator.to_cstr(escaped_text)
-        global_fmt = ir.GlobalVariable(self.module, c_str.type, name="fstr_" + ran6())
-        global_fmt.linkage = 'internal'
-        global_fmt.global_constant = True
-        global_fmt.initializer = c_str
-        return self.builder.bitcast(global_fmt, ir.IntType(8).as_pointer())
+        return self.builder.bitcast(self._intern_cstr(escaped_text), ir.IntType(8).as_pointer())
 
     def _codegen_ID(self, node):  # This is ID callee, not declare
         # Find the ID in the function scope first
@@ -121,8 +307,6 @@ class LLVMCodeGenerator(object):
         return self.builder.load(var_addr, node.name)
 
     def _codegen_AssignStatement(self, node):
-        assert isinstance(node, AssignStatement)
-
         # Find the ID in the function scope first. Remember to empty the function_symbol_table
         # when FunctionDefinition finished codegen
         if node.left_variable.name in self.function_symbol_table:
@@ -133,13 +317,28 @@ class LLVMCodeGenerator(object):
             except KeyError:
                 raise CodegenError("NameError: name '{}' is not defined".format(node.left_variable.name))
         right_expression_value = self._codegen(node.right_expression)
+        if isinstance(var_addr.type.pointee, ir.IntType):
+            # The type inference only keeps a variable in i64 if all its values are integral
+            assert isinstance(right_expression_value.type, ir.IntType), \
+                'not integral: {}'.format(node.left_variable.name)
+        else:
+            right_expression_value = self._to_double(right_expression_value)
         self.builder.store(right_expression_value, var_addr)
 
-    def _codegen_BinaryOperation(self, node):
-        assert isinstance(node, BinaryOperation)
-
-        lhs = self._codegen(node.left_expression)
-        rhs = self._codegen(node.right_expression)
+    def _codegen_BinaryOperation(self, node, lhs, rhs):
+        # The operands are generated by _codegen_expression()
+        if id(node) in self.integer_expressions:
+            # The type inference proved the operands and the result within +-2^53, so they
+            # never overflow
+            assert isinstance(lhs.type, ir.IntType) and isinstance(rhs.type, ir.IntType)
+            if node.operator == '+':
+                return self.builder.add(lhs, rhs, 'addtmp', flags=('nsw',))
+            elif node.operator == '-':
+                return self.builder.sub(lhs, rhs, 'subtmp', flags=('nsw',))
+            elif node.operator == '*':
+                return self.builder.mul(lhs, rhs, 'multmp', flags=('nsw',))
+        lhs = self._to_double(lhs)
+        rhs = self._to_double(rhs)
 
         if node.operator == '+':
             return self.builder.fadd(lhs, rhs, 'addtmp')
@@ -153,74 +352,134 @@ class LLVMCodeGenerator(object):
             raise CodegenError('No such operator: {}'.format(node.operator))
 
     def _codegen_IfStatement(self, node):
-        assert isinstance(node, IfStatement)
-
-        # Floating-point ordered compare lhs with rhs.
-        test_gt_0 = self.builder.fcmp_ordered('>', self._codegen(node.test), ir.Constant(ir.DoubleType(), 0.0))
+        test_gt_0 = self._codegen_test(node.test)
 
-        store_builder = self.builder
-
-        if_block = ir.Block(self.builder.block, name='if_stmt' + ran6())
-        self.builder.append_basic_block(if_block)
-        self.builder.position_at_start(if_block)
-        with self.builder.if_else(test_gt_0) as (then, otherwise):
-            with then:
+        if node.else_block is None:
+            with self.builder.if_then(test_gt_0):
                 # emit instructions for when the predicate is true
                 self._codegen(node.then_block)
-            with otherwise:
-                # emit instructions for when the predicate is false
-                self._codegen(node.else_block)
-        # There are no instructions following the if-else block
+        else:
+            with self.builder.if_else(test_gt_0) as (then, otherwise):
+                with then:
+                    # emit instructions for when the predicate is true
+                    self._codegen(node.then_block)
+                with otherwise:
+                    # emit instructions for when the predicate is false
+                    self._codegen(node.else_block)
+        # The following statements are emitted into the merge block of the if-else
 
     def _codegen_WhileStatement(self, node):
-        assert isinstance(node, WhileStatement)
-        # TODO
+        # The loop is lowered into the canonical form which the LLVM loop passes expect:
+        #
+        #   <current block>:    the preheader, it only branches to the header
+        #     br while.cond
+        #   while.cond:         the header, the only block entering the loop
+        #     %test = fcmp ogt <test>, 0.0
+        #     br %test, while.body, while.end
+        #   while.body:         the body, its last block is the single latch
+        #     ...
+        #     br while.cond
+        #   while.end:          the single exit
+        header = self.builder.append_basic_block('while.cond')
+        body = self.builder.append_basic_block('while.body')
+        exit_block = self.builder.append_basic_block('while.end')
+        self.builder.branch(header)
+
+        self.builder.position_at_end(header)
+        self.builder.cbranch(self._codegen_test(node.test), body, exit_block)
+
+        self.builder.position_at_end(body)
+        self._codegen(node.block)
+        if not self.builder.block.is_terminated:
+            self.builder.branch(header)
+
+        self.builder.position_at_end(exit_block)
+
+    def _codegen_test(self, test):
+        """
+        Code of the test of IF and WHILE, which holds when the expression is > 0.0
+        :param test: Expression
+        :return: i1 value
+        """
+        value = self._codegen(test)
+        if isinstance(value.type, ir.IntType):
+            return self.builder.icmp_signed('>', value, ir.Constant(ir.IntType(64), 0), 'test')
+        # Floating-point ordered compare the test with 0.0
+        return self.builder.fcmp_ordered('>', value, ir.Constant(ir.DoubleType(), 0.0), 'test')
 
     def _codegen_VariableDeclaration(self, node):
-        assert isinstance(node, VariableDeclaration)
-
         for var in node.variable_list:
             name = var.name
 
             # Emit the initializer before adding the variable to scope. This
             # prefents the initializer from referencing the variable itself.
-            init_val = ir.Constant(ir.DoubleType(), 0.0)  # init values to 0.0
-
-            # Create an alloca for the induction var and store the init value to it.
-            # As VSL grammar defined, variable declaration should be before its assignment.
-            var_addr = self.builder.alloca(ir.DoubleType(), size=None, name=name)
-            self.builder.store(init_val, var_addr)
+            if name in self.integer_variables and self.builder.function is not self.main_function:
+                init_val = ir.Constant(ir.IntType(64), 0)
+            else:
+                init_val = ir.Constant(ir.DoubleType(), 0.0)  # init values to 0.0
 
             # Store the symbol name, address pair into the symbol table.
             # Decided by where the scope you are.
-            if self.builder.function._name == 'main':  # TODO check whether the builder is working on the 'main' function
-                self.main_symbol_table[name] = var_addr
+            if self.builder.function is self.main_function:
+                # Variables of the shell live in global variables, so that their values
+                # survive between the modules of the shell.
+                var_addr = self.main_symbol_table.get(name)
+                if var_addr is None:
+                    var_addr = ir.GlobalVariable(self.module, ir.DoubleType(), name)
+                    var_addr.initializer = init_val
+                    self.main_symbol_table[name] = var_addr
             else:
+                # Create an alloca for the induction var and store the init value to it.
+                # As VSL grammar defined, variable declaration should be before its assignment.
+                var_addr = self._create_entry_block_alloca(name, init_val.type)
                 self.function_symbol_table[name] = var_addr
+            self.builder.store(init_val, var_addr)
 
-    def _codegen_FunctionCall(self, node):
-        assert isinstance(node, FunctionCall)
+    def _create_entry_block_alloca(self, name, value_type=None):
+        """
+        Create an alloca in the entry block of the current function, whichever block the
+        builder is in. Allocas in nested blocks would grow the stack on every iteration of
+        a loop, and only entry block allocas are promoted to SSA registers by LLVM.
+        :param name:
+        :param value_type: ir.DoubleType() by default
+        :return:
+        """
+        # The builder appends to the end of the current block, where goto_entry_block() returns
+        with self.builder.goto_entry_block():
+            return self.builder.alloca(value_type or ir.DoubleType(), size=None, name=name)
 
+    def _callee(self, node):
+        """
+        Find the callee of a FunctionCall and check its argument count, before the arguments
+        are generated
+        :param node: FunctionCall
+        :return: ir.Function
+        """
         # Find the callee in the global scope of the module.
         # Need match the function name and also the number of parameter
-        callee_func = self.module.get_global(node.name.name)
+        callee_func = self.module.globals.get(node.name.name)
+        if callee_func is None and node.name.name in self.external_functions:
+            callee_func = self.declare_function(node.name.name, self.external_functions[node.name.name])
         if callee_func is None or not isinstance(callee_func, ir.Function):
-            raise CodegenError('Call to unknown function', node.name)
+            raise CodegenError('Call to unknown function: {}'.format(node.name.name))
         if node.argument_list is None:
             arglen = 0
         else:
             arglen = len(node.argument_list)
         if len(callee_func.args) != arglen:
-            raise CodegenError('Call argument length', len(node.argument_list), 'mismatch', node.name)
-        if node.argument_list is None:
-            call_args = []
-        else:
-            call_args = [self._codegen(arg) for arg in node.argument_list]
-        return self.builder.call(callee_func, call_args, 'calltmp')
+            raise CodegenError('Call argument length {} mismatch: {}'.format(arglen, node.name.name))
+        return callee_func
+
+    def _codegen_FunctionCall(self, node, callee_func, call_args):
+        # The callee is found by _callee() and the arguments are generated by _codegen_expression()
+        tail = False
+        if node is self.tail_call and not node.minus_flag and self.function is not None:
+            # The result is returned at once. With the same prototype as the caller, the call
+            # is guaranteed to reuse the stack frame of the caller
+            tail = 'musttail' if callee_func.function_type == self.builder.function.function_type else 'tail'
+        return self.builder.call(callee_func, [self._to_double(arg) for arg in call_args], 'calltmp', tail=tail)
 
     def _codegen_FunctionDefinition(self, node):
-        assert isinstance(node, FunctionDefinition)
-
         # Create the function skeleton from the prototype. -----------------------
         # Check section before create the new builder and entry block
         function_name = node.name.name
@@ -234,11 +493,24 @@ class LLVMCodeGenerator(object):
         else:
             # Otherwise create a new function
             func = ir.Function(self.module, function_type, function_name)
+            self.function_types[function_name] = function_type
+
+        # A memoized function is generated as '<name>.body', and '<name>' is the wrapper which
+        # looks up the memo table first. The calls of the body go to the wrapper too.
+        wrapper = None
+        if config.memoize and is_pure(node, self.pure_functions):
+            self.pure_functions.add(function_name)
+            if node.parameter_list:
+                wrapper = func
+                func = ir.Function(self.module, function_type, function_name + '.body')
+                func.linkage = 'internal'
         # ------------------------------------------------------------------------
 
         # Reset the symbol table. Prototype generation will pre-populate it with
         # function arguments.
         self.function_symbol_table = {}
+        if config.integer_inference:
+            self.integer_variables, self.integer_expressions = infer_integers(node)
         # Store the current builder (in main function)
         stored_builder = self.builder
 
@@ -247,51 +519,140 @@ class LLVMCodeGenerator(object):
         self.builder = ir.IRBuilder(bb_entry)
 
         # Add all arguments to the symbol table and create their allocas
+        self.function = node
+        self.parameter_allocas = []
         for i, arg in enumerate(func.args):
-            arg.name = node.parameter_list[i]
-            alloca = self.builder.alloca(ir.DoubleType(), name=arg.name)
+            name = node.parameter_list[i].name
+            arg.name = name
+            alloca = self._create_entry_block_alloca(name)
             self.builder.store(arg, alloca)
-            self.function_symbol_table[arg.name.name] = alloca
+            self.function_symbol_table[name] = alloca
+            self.parameter_allocas.append(alloca)
+
+        # The self tail calls store their arguments into the parameters and branch to the block
+        # after the entry block, which turns the recursion into a loop. So the recursion depth
+        # doesn't grow the stack, at every optimization level
+        self.tail_recursion_block = None
+        if config.tail_call_elimination and any(
+                isinstance(statement, ReturnStatement) and is_self_tail_call(node, statement.expression)
+                for statement in walk(node.body)):
+            self.tail_recursion_block = func.append_basic_block('tailrecurse')
+            self.builder.branch(self.tail_recursion_block)
+            self.builder.position_at_end(self.tail_recursion_block)
 
         # We will handle ReturnStatement in the body of the FunctionDefinition
         self._codegen(node.body)
         # But we finally create a ret instruction here to return 0.0 to handle the case
         # that no ReturnStatement in the body of the FunctionDefinition
-        self.builder.ret(ir.Constant(ir.DoubleType(), 0.0))
+        if not self.builder.block.is_terminated:
+            self.builder.ret(ir.Constant(ir.DoubleType(), 0.0))
 
         # Reset the function symbol table for the reason of @self._codegen_AssignStatement+3
         self.function_symbol_table = {}
+        self.integer_variables = set()
+        self.integer_expressions = set()
+        self.function = None
+        self.parameter_allocas = []
+        self.tail_recursion_block = None
+
+        if wrapper is not None:
+            self._codegen_memo_wrapper(wrapper, func)
+            func = wrapper
 
         # Restore the builder (in main function)
         self.builder = stored_builder
         return func
 
-    def _codegen_Block(self, node):
-        assert isinstance(node, Block)
+    def _codegen_memo_wrapper(self, wrapper, body):
+        """
+        Generate the wrapper of a memoized function. It looks up the arguments in a
+        direct-mapped table of config.memo_table_size entries, indexed by the Fibonacci hash of
+        their bits. On a miss it calls the body and stores the result in the slot, evicting the
+        entry there. The hits and misses are counted in '<name>.memo.hits' and '<name>.memo.misses'
+        :param wrapper: ir.Function
+        :param body: ir.Function of the generated function body
+        :return:
+        """
+        table_size = config.memo_table_size
+        assert table_size > 1 and table_size & (table_size - 1) == 0, 'memo_table_size must be a power of 2'
+
+        i8, i32, i64 = ir.IntType(8), ir.IntType(32), ir.IntType(64)
+        count = len(wrapper.args)
+        # { the argument bits, the result, whether the entry is used }
+        entry_type = ir.LiteralStructType([ir.ArrayType(i64, count), ir.DoubleType(), i8])
+        table = ir.GlobalVariable(self.module, ir.ArrayType(entry_type, table_size), wrapper.name + '.memo')
+        table.linkage = 'internal'
+        table.initializer = ir.Constant(table.type.pointee, None)
+        counters = []
+        for suffix in (MEMO_HITS_SUFFIX, MEMO_MISSES_SUFFIX):
+            counter = ir.GlobalVariable(self.module, i64, wrapper.name + suffix)
+            counter.initializer = ir.Constant(i64, 0)
+            counters.append(counter)
+        hits, misses = counters
+
+        builder = ir.IRBuilder(wrapper.append_basic_block('entry'))
+        for arg, parameter in zip(wrapper.args, body.args):
+            arg.name = parameter.name
+        bits = [builder.bitcast(arg, i64, arg.name + '.bits') for arg in wrapper.args]
+        key_hash = ir.Constant(i64, 0)
+        for value in bits:
+            key_hash = builder.mul(builder.xor(key_hash, value), ir.Constant(i64, _MEMO_HASH_MULTIPLIER), 'hash')
+        index = builder.lshr(key_hash, ir.Constant(i64, 64 - table_size.bit_length() + 1), 'index')
+        slot = builder.gep(table, [ir.Constant(i32, 0), index], name='slot')
+
+        def field(*indices):
+            return builder.gep(slot, [ir.Constant(i32, 0)] + [ir.Constant(i32, i) for i in indices])
+
+        hit = builder.icmp_unsigned('!=', builder.load(field(2)), ir.Constant(i8, 0), 'used')
+        for i, value in enumerate(bits):
+            hit = builder.and_(hit, builder.icmp_unsigned('==', builder.load(field(0, i)), value), 'hit')
+
+        with builder.if_else(hit) as (then, otherwise):
+            with then:
+                builder.store(builder.add(builder.load(hits), ir.Constant(i64, 1)), hits)
+                builder.ret(builder.load(field(1), 'memo'))
+            with otherwise:
+                builder.store(builder.add(builder.load(misses), ir.Constant(i64, 1)), misses)
+                result = builder.call(body, wrapper.args, 'result')
+                for i, value in enumerate(bits):
+                    builder.store(value, field(0, i))
+                builder.store(result, field(1))
+                builder.store(ir.Constant(i8, 1), field(2))
+                builder.ret(result)
+        builder.unreachable()
 
+    def _codegen_Block(self, node):
         # Process each declaration
         for declaration in node.declaration_list:
             self._codegen(declaration)
 
         # Process each statement
         for statement in node.statement_list:
+            if self.builder.block.is_terminated:
+                break  # statements after a RETURN are unreachable
             self._codegen(statement)
 
     def _codegen_Program(self, node):
-        assert isinstance(node, Program)
-
         for i in node.function_list:
             self._codegen(i)
 
     def _codegen_ReturnStatement(self, node):
-        assert isinstance(node, ReturnStatement)
-
-        return_value = self._codegen(node.expression)
-        self.builder.ret(return_value)
+        if self.tail_recursion_block is not None and is_self_tail_call(self.function, node.expression):
+            # Tail-call elimination. Every argument is evaluated before any parameter is assigned
+            arguments = [self._to_double(self._codegen(argument)) for argument in node.expression.argument_list or ()]
+            for alloca, argument in zip(self.parameter_allocas, arguments):
+                self.builder.store(argument, alloca)
+            self.builder.branch(self.tail_recursion_block)
+            return
+
+        self.tail_call = node.expression if config.tail_call_elimination else None
+        try:
+            return_value = self._codegen(node.expression)
+        finally:
+            self.tail_call = None
+        self.builder.ret(self._to_double(return_value))
 
     def _codegen_PrintStatement(self, node):
-        assert isinstance(node, PrintStatement)
-
         voidptr_ty = ir.IntType(8).as_pointer()
 
         printf = self.module.globals.get('printf', None)
@@ -306,16 +667,26 @@ class LLVMCodeGenerator(object):
             else:
                 format_string += config.float_format
 
-        c_format_string = LLVMCodeGenerator.to_cstr(format_string)
-
-        # A global format
-        global_fmt = ir.GlobalVariable(self.module, c_format_string.type, name="fstr_" + ran6())
-        global_fmt.linkage = 'internal'
-        global_fmt.global_constant = True
-        global_fmt.initializer = c_format_string
+        fmt_arg = self.builder.bitcast(self._intern_cstr(format_string), voidptr_ty)
+        self.builder.call(printf, [fmt_arg] + [self._to_double(self._codegen(i)) for i in node.print_list])
 
-        fmt_arg = self.builder.bitcast(global_fmt, voidptr_ty)
-        self.builder.call(printf, [fmt_arg] + [self._codegen(i) for i in node.print_list])
+    def _intern_cstr(self, python_str):
+        """
+        Return the global constant C string of the content, created once per module.
+        Names are numbered in the order of creation, so that the same program always
+        produces the same IR.
+        :param python_str:
+        :return: ir.GlobalVariable
+        """
+        global_str = self.constant_pool.get(python_str)
+        if global_str is None:
+            c_str = LLVMCodeGenerator.to_cstr(python_str)
+            global_str = ir.GlobalVariable(self.module, c_str.type, name='{}.{}'.format(self.constant_prefix, len(self.constant_pool)))
+            global_str.linkage = 'internal'
+            global_str.global_constant = True
+            global_str.initializer = c_str
+            self.constant_pool[python_str] = global_str
+        return global_str
 
     @staticmethod
     def to_cstr(python_str):
@@ -323,3 +694,21 @@ class LLVMCodeGenerator(object):
 
         python_str += '\0'
         return ir.Constant(ir.ArrayType(ir.IntType(8), len(python_str)), bytearray(python_str.encode("utf8")))
+
+
+def _build_dispatch_table(generator_class):
+    """
+    Map every AST node class to its visitor _codegen_<class name> of the generator class.
+    A subclass overriding visitors needs its own table.
+    :param generator_class:
+    :return:
+    """
+    generator_class._dispatch_table = {
+        node_class: (getattr(generator_class, '_codegen_' + node_class.__name__), issubclass(node_class, Expression))
+        for node_class in (Program, FunctionDefinition, Block, VariableDeclaration, AssignStatement, IfStatement,
+                           WhileStatement, ReturnStatement, PrintStatement, BinaryOperation, Number, ID,
+                           FunctionCall, Text)
+    }
+
+
+_build_dispatch_table(LLVMCodeGenerator)
@@ -15,19 +15,92 @@ parser_debug = False
 #
 lexer_optimize = False
 
+# Tokenizer used by the parser.
+# 'ply' for the VSLCLexer, 'scanner' for the single-regex VSLCScanner
+lexer_backend = 'ply'
+
 #
 parser_optimize = False
 
+# Run the structural checks in the constructors of the AST nodes.
+# Turn it off in production to build the AST faster
+ast_validate = True
+
 # The resulting parsing table will be written to a file called parsetab.py.
 # If you disable table generation, yacc() will regenerate the parsing tables each time it runs
 # (which may take awhile depending on how large your grammar is).
 write_table = True
 
-# Enable optimize passed of LLVM
-llvm_optimize = False
+# LLVM optimization level 0-3, the -O option of vslc.py
+opt_level = 0
+
+# LLVM size optimization level. 1 for -Os, 2 for -Oz
+size_level = 0
+
+# Inlining threshold of the LLVM inliner. None to derive it from opt_level and size_level
+inline_threshold = None
+
+# Enable the LLVM loop vectorizer
+loop_vectorize = False
+
+# Enable the LLVM SLP (superword-level parallelism) vectorizer
+slp_vectorize = False
+
+# Promote the variables from stack slots to SSA registers, even when opt_level is 0
+ssa_promotion = True
+
+# Record the time of the optimization passes and report it, the --time-passes option of vslc.py
+time_passes = False
+
+# Trace the phases of the compilation, the --trace option of vslc.py. See tracing.py
+trace = False
+
+# Also trace the peak of the Python heap of every phase. It slows the compilation down
+trace_memory = False
+
+# Stages dumped while lowering and evaluating. Any of
+# 'ir': the unoptimized LLVM IR, 'optimized': the optimized LLVM IR, 'asm': the machine code
+llvmdump = ()
+
+# Split a compiled program by function into this many modules, which are generated, optimized
+# and emitted in parallel. The output is then a static archive of one object per partition.
+# 1 to compile one module, 0 for one partition per CPU
+codegen_partitions = 1
 
-# Dump binary code after evaluate
-llvmdump = True
+# Compile only the functions changed since an earlier compile, and reuse the optimized bitcode
+# of the others. It's kept in the 'functions' directory of the cache. See incremental.py
+incremental = False
+
+# Compile a file function by function from a memory map, so that the memory is bounded by the
+# largest function. The output is a static archive of chunk objects. See streaming.py
+streaming = False
+
+# Number of IR instructions generated into a chunk of the streaming mode before it's emitted
+streaming_chunk_instructions = 20000
+
+# Fold constant expressions and drop constant branches of the AST before codegen
+ast_fold = True
+
+# Keep the local variables which are proven to only hold integers within +-2^53, and the +, -
+# and * on them, in i64 instead of double. See typeinfer.py. The results are the same as with
+# doubles
+integer_inference = False
+
+# Turn the calls of a function to itself in RETURN into a jump back to its start, so that
+# recursion used for iteration runs in constant stack. The other calls in RETURN are marked
+# as tail calls
+tail_call_elimination = True
+
+# Memoize the pure functions with parameters, see purity.py. Each of them gets a direct-mapped
+# table of memo_table_size entries keyed on the bits of its arguments, where a new result
+# evicts the entry in its slot. The evaluators report the hit rates after a run
+memoize = False
+
+# Number of entries of the memo table of each memoized function, a power of 2
+memo_table_size = 4096
+
+# Check the AST node types while generating code
+codegen_debug = False
 
 # Main function name
 main_function_name = 'main'
@@ -35,3 +108,12 @@ main_function_name = 'main'
 # Float print format
 # %.nf for keeping 'n' decimal(s)
 float_format = '%.1f'
+
+# Cache the object code of compiled files, keyed by the source text and the config above
+object_cache = True
+
+# Directory of the object cache. None for '~/.cache/vslc'
+cache_dir = None
+
+# Maximum total size in bytes of the object cache. Least recently used entries are evicted first
+cache_max_size = 256 * 1024 * 1024
@@ -0,0 +1,218 @@
+"""
+driver.py
+
+Compilation driver of vslc: compiles one source, or many sources across a process pool
+"""
+import io
+import os
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+
+import config
+from ast import Program
+from cache import ObjectCache
+from codegen import LLVMCodeGenerator, CodegenError
+from evaluator import VSLCEvaluator, initialize, get_target_machine
+from folding import fold
+from incremental import get_incremental_compiler
+from partition import compile_partitioned, partition_count
+from streaming import StreamingError, compile_streaming
+from tracing import phase, take_events, add_events
+from yacc import parser_pool
+
+# Outcome of compiling one file. 'output' holds everything the compilation printed
+# and 'events' the traced phases, see tracing.py
+CompileResult = namedtuple('CompileResult', ('filename', 'object_filename', 'ok', 'output', 'elapsed', 'size',
+                                             'events'))
+
+
+class CompileError(Exception):
+    pass
+
+
+def parse_source(code):
+    """
+    Parse a VSL program and fold it if enabled. Syntax errors are printed by the parser
+    :param code: VSL source code
+    :return: Program
+    """
+    with parser_pool.parser() as parser:
+        node = parser.parse(code)
+
+    if not isinstance(node, Program):
+        raise CompileError('compilation failed')
+
+    if config.ast_fold:
+        node = fold(node)
+    return node
+
+
+def compile_source(code, filename='<string>'):
+    """
+    Compile VSL source code into object code, through the object cache if enabled
+    :param code: VSL source code
+    :param filename: name of the module
+    :return: object code, or a static archive when config.codegen_partitions is not 1
+    """
+    if config.object_cache:
+        with phase('cache') as span:
+            cache = ObjectCache()
+            key = cache.key(code)
+            obj_code = cache.get(key)
+            span.set(hit=obj_code is not None)
+        if obj_code is not None:
+            return obj_code
+    else:
+        cache = None
+
+    node = parse_source(code)
+
+    partitions = partition_count()
+    if config.incremental:
+        obj_code = get_incremental_compiler().compile(node, filename)
+    elif partitions > 1:
+        obj_code = compile_partitioned(node, filename, partitions)
+    else:
+        generator = LLVMCodeGenerator('compile', module_name=filename)
+        generator.generate_code(node)
+
+        evaluator = VSLCEvaluator()
+        obj_code = evaluator.compile_to_object_code(generator.module)
+
+    if cache is not None:
+        cache.put(key, obj_code)
+    return obj_code
+
+
+def compile_file(filename, object_filename):
+    """
+    Compile a VSL source file into an object file
+    :param filename:
+    :param object_filename:
+    :return:
+    """
+    with phase('compile', file=filename):
+        if config.streaming:
+            try:
+                obj_code = compile_streaming(filename)
+            except StreamingError as error:
+                raise CompileError(str(error))
+        else:
+            with phase('read') as span:
+                with open(filename, 'r') as source_code_file:
+                    code = source_code_file.read()
+                span.set(bytes=len(code))
+
+            obj_code = compile_source(code, filename)
+
+        with open(object_filename, 'wb') as obj_file:
+            obj_file.write(obj_code)
+
+
+def object_filenames(filenames, output_dir):
+    """
+    Map every source file to '<output_dir>/<name>.o'
+    :param filenames:
+    :param output_dir:
+    :return:
+    """
+    result = []
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        result.append(os.path.join(output_dir, name + '.o'))
+    duplicates = sorted(set(name for name in result if result.count(name) > 1))
+    if duplicates:
+        raise CompileError('Several sources would be output to: {}'.format(', '.join(duplicates)))
+    return result
+
+
+def _init_worker(settings):
+    """
+    Initializer of the worker processes. Apply the config of the parent process and warm up
+    the parser and the target machine, which are then reused by every job of the worker
+    :param settings: the public names of the config module
+    :return:
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+    take_events()  # forked with the events of the parent process
+    # The files are already compiled in parallel, each one into a single object
+    config.codegen_partitions = 1
+
+    parser_pool.warm('program')
+    initialize()
+    get_target_machine(codemodel='small', opt=config.opt_level)
+
+
+def _compile_job(filename, object_filename):
+    """
+    Compile one file in a worker. Everything the compilation prints is captured into the result,
+    so that the diagnostics of the files don't interleave
+    :param filename:
+    :param object_filename:
+    :return: CompileResult
+    """
+    output = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            compile_file(filename, object_filename)
+        ok = True
+    except (CompileError, CodegenError, OSError, UnicodeDecodeError) as error:
+        # A missing or unreadable source is reported like a compile error
+        output.write('{}: {}\n'.format(filename, error))
+        ok = False
+    except Exception:
+        output.write(traceback.format_exc())
+        ok = False
+    elapsed = time.perf_counter() - start
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        size = 0
+    return CompileResult(filename, object_filename, ok, output.getvalue(), elapsed, size, take_events())
+
+
+def compile_files(filenames, output_dir, jobs=None):
+    """
+    Compile many VSL source files into '<output_dir>/<name>.o' across a process pool
+    :param filenames:
+    :param output_dir:
+    :param jobs: number of the worker processes, os.cpu_count() by default
+    :return: list of CompileResult, in the order of filenames
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    targets = object_filenames(filenames, output_dir)
+
+    settings = {name: getattr(config, name) for name in dir(config) if not name.startswith('_')}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(settings,)) as executor:
+        results = list(executor.map(_compile_job, filenames, targets))
+    for result in results:
+        add_events(result.events)
+    return results
+
+
+def print_report(results, elapsed):
+    """
+    Print the diagnostics of every file, then the per-file wall time and the overall throughput
+    :param results: list of CompileResult
+    :param elapsed: total wall time
+    :return:
+    """
+    for result in results:
+        if result.output:
+            print('==> {} <=='.format(result.filename))
+            print(result.output, end='' if result.output.endswith('\n') else '\n')
+
+    print('{:>10}  {:<8}{}'.format('seconds', 'status', 'file'))
+    for result in results:
+        print('{:>10.3f}  {:<8}{}'.format(result.elapsed, 'ok' if result.ok else 'FAIL', result.filename))
+
+    failed = sum(1 for result in results if not result.ok)
+    total_size = sum(result.size for result in results)
+    print('{} files, {} failed in {:.3f} s: {:.1f} files/s, {:.1f} KB/s'.format(
+        len(results), failed, elapsed, len(results) / elapsed, total_size / 1024 / elapsed))
@@ -1,64 +1,268 @@
-from ctypes import CFUNCTYPE, c_double
+import sys
+import weakref
+from ctypes import CFUNCTYPE, c_double, c_int64
 
 import llvmlite.binding as llvm
 from llvmlite import ir
 
 import config
+from codegen import MEMO_HITS_SUFFIX, MEMO_MISSES_SUFFIX
+from optimizer import get_optimizer
+from tracing import phase, count_instructions
+
+_initialized = False
+
+# Target machines for emitting code, one per configuration. An execution engine takes
+# ownership of its target machine, so the JIT can not share them.
+_target_machines = {}
+
+
+def initialize():
+    """
+    Initialize LLVM once per process
+    :return:
+    """
+    global _initialized
+
+    if not _initialized:
+        with phase('initialize_llvm'):
+            llvm.initialize()
+            llvm.initialize_native_target()
+            llvm.initialize_native_asmprinter()
+        _initialized = True
+
+
+def get_target_machine(**options):
+    """
+    Return the shared target machine of the options, see llvm.Target.create_target_machine()
+    :param options:
+    :return:
+    """
+    key = tuple(sorted(options.items()))
+    target_machine = _target_machines.get(key)
+    if target_machine is None:
+        initialize()
+        with phase('create_target_machine'):
+            target_machine = llvm.Target.from_default_triple().create_target_machine(**options)
+        _target_machines[key] = target_machine
+    return target_machine
+
+
+def dump(stage, title, text):
+    """
+    Print the dump of a stage if it's enabled in config.llvmdump
+    :param stage: one of 'ir', 'optimized' and 'asm'
+    :param title:
+    :param text: a callable returning the text, only called when the stage is enabled
+    :return:
+    """
+    if stage in config.llvmdump:
+        print('======== {} ========'.format(title))
+        print(text())
+
+
+def memo_function_names(module):
+    """
+    Return the names of the memoized functions of a module, see LLVMCodeGenerator._codegen_memo_wrapper()
+    :param module: ir.Module
+    :return:
+    """
+    return [name[:-len(MEMO_HITS_SUFFIX)] for name in module.globals if name.endswith(MEMO_HITS_SUFFIX)]
+
+
+def take_memo_counters(engine, function_names):
+    """
+    Read and reset the hit and miss counters of memoized functions
+    :param engine: execution engine holding the functions
+    :param function_names:
+    :return: list of (function name, hits, misses)
+    """
+    counters = []
+    for name in function_names:
+        hits = c_int64.from_address(engine.get_global_value_address(name + MEMO_HITS_SUFFIX))
+        misses = c_int64.from_address(engine.get_global_value_address(name + MEMO_MISSES_SUFFIX))
+        counters.append((name, hits.value, misses.value))
+        hits.value = misses.value = 0
+    return counters
+
+
+def print_memo_report(counters, file=sys.stderr):
+    """
+    Print the hit rates of the memoized functions
+    :param counters: list of (function name, hits, misses)
+    :param file:
+    :return:
+    """
+    print('===== Memoization report (table size {}) ====='.format(config.memo_table_size), file=file)
+    for name, hits, misses in counters:
+        calls = hits + misses
+        print('{:>12} hits {:>12} misses {:>6.1f}%  {}'.format(
+            hits, misses, 100.0 * hits / calls if calls else 0.0, name), file=file)
 
 
 class VSLCEvaluator(object):
     """Evaluator for VSLC IR code
 
+    Parsed modules are cached per module version, see lower(). Pass the module_version
+    of the LLVMCodeGenerator to reuse the lowering of an unchanged module.
     """
     def __init__(self):
-        llvm.initialize()
-        llvm.initialize_native_target()
-        llvm.initialize_native_asmprinter()
+        initialize()
 
         self.target = llvm.Target.from_default_triple()
 
-    def evaluate(self, module):
-        assert isinstance(module, ir.Module)
+        # ir.Module => (version, llvm.ModuleRef)
+        self._lowered = weakref.WeakKeyDictionary()
+        # ir.Module => (version, execution engine)
+        self._engines = weakref.WeakKeyDictionary()
+        # ir.Module => (version, object code)
+        self._objects = weakref.WeakKeyDictionary()
+
+        # (function name, hits, misses) of the memoized functions in the last evaluate()
+        self.memo_counters = []
 
-        # Convert LLVM IR into in-memory representation
-        llvmmod = llvm.parse_assembly(str(module))
+    def evaluate(self, module, version=None):
+        assert isinstance(module, ir.Module)
 
-        if config.llvmdump:
-            print('======== Unoptimized LLVM IR ========')
-            print(str(module))
+        cached = self._engines.get(module)
+        if version is not None and cached is not None and cached[0] == version:
+            ee = cached[1]
+        else:
+            if cached is not None:
+                cached[1].close()
+                del self._engines[module]
 
-        if config.llvm_optimize:
-            pmb = llvm.create_pass_manager_builder()
-            pmb.opt_level = 2
-            pm = llvm.create_module_pass_manager()
-            pmb.populate(pm)
-            pm.run(llvmmod)
+            # The engine takes ownership of the module, so take it out of the cache
+            llvmmod = self.lower(module, version)
+            self._lowered.pop(module, None)
 
-            if config.llvmdump:
-                print('======== Optimized LLVM IR ========')
-                print(str(llvmmod))
+            # Create a MCJIT execution engine to JIT-compile the module. Note that
+            # ee takes ownership of target_machine, so it has to be recreated anew
+            # each time we call create_mcjit_compiler.
+            with phase('jit'):
+                target_machine = self.target.create_target_machine(opt=config.opt_level)
+                ee = llvm.create_mcjit_compiler(llvmmod, target_machine)
+                ee.finalize_object()
 
-        # Create a MCJIT execution engine to JIT-compile the module. Note that
-        # ee takes ownership of target_machine, so it has to be recreated anew
-        # each time we call create_mcjit_compiler.
-        target_machine = self.target.create_target_machine()
-        with llvm.create_mcjit_compiler(llvmmod, target_machine) as ee:
-            ee.finalize_object()
+            dump('asm', 'Machine code', lambda: target_machine.emit_assembly(llvmmod))
 
-            if config.llvmdump:
-                print('======== Machine code ========')
-                print(target_machine.emit_assembly(llvmmod))
+            if version is not None:
+                self._engines[module] = (version, ee)
 
-            fptr = CFUNCTYPE(c_double)(ee.get_function_address('main'))
+        fptr = CFUNCTYPE(c_double)(ee.get_function_address('main'))
+        with phase('run'):
             result = fptr()
-            return result
+        if config.memoize:
+            self.memo_counters = take_memo_counters(ee, memo_function_names(module))
+            if self.memo_counters:
+                print_memo_report(self.memo_counters, file=sys.stderr)
+        if version is None:
+            ee.close()
+        return result
 
-    def compile_to_object_code(self, module):
+    def lower(self, module, version=None):
+        """Convert LLVM IR into in-memory representation and optimize it if enabled
+
+        The result is cached for the version of the module. A version of None disables the cache.
+        """
+        cached = self._lowered.get(module)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+
+        llvmmod = lower(module)
+        if version is not None:
+            self._lowered[module] = (version, llvmmod)
+        return llvmmod
+
+    def compile_to_object_code(self, module, version=None):
         """Compile previously evaluated code into an object file.
 
         """
-        target_machine = self.target.create_target_machine(codemodel='small')
+        cached = self._objects.get(module)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+
+        llvmmod = self.lower(module, version)
+        with phase('emit') as span:
+            target_machine = get_target_machine(codemodel='small', opt=config.opt_level)
+            obj_code = target_machine.emit_object(llvmmod)
+            span.set(bytes=len(obj_code))
+        if version is not None:
+            self._objects[module] = (version, obj_code)
+        return obj_code
+
+
+def lower(module):
+    """
+    Parse the IR of the module and optimize it if enabled
+    :param module:
+    :return: llvm.ModuleRef
+    """
+    assert isinstance(module, ir.Module)
+
+    initialize()
+
+    with phase('serialize') as span:
+        ir_text = str(module)
+        span.set(bytes=len(ir_text))
+    dump('ir', 'Unoptimized LLVM IR', lambda: ir_text)
+
+    # Convert LLVM IR into in-memory representation
+    with phase('parse_ir'):
+        llvmmod = llvm.parse_assembly(ir_text)
+
+    with phase('optimize', opt_level=config.opt_level) as span:
+        changed = get_optimizer().run(llvmmod)
+        if config.trace:
+            span.set(instructions=count_instructions(llvmmod))
+    if changed:
+        dump('optimized', 'Optimized LLVM IR', lambda: str(llvmmod))
+    return llvmmod
+
+
+class JITSession(object):
+    """Long-lived JIT session of the shell
+
+    One MCJIT execution engine lives as long as the session. Every execute() adds only
+    the module detached from the shell's code generator since the last execute() and runs
+    its 'main.<n>' function. Functions and global variables of the earlier modules stay in
+    the engine, so the variables keep their values between executions.
+    """
+    def __init__(self):
+        initialize()
+
+        self.target = llvm.Target.from_default_triple()
+
+        # The engine takes ownership of the target machine and the empty backing module
+        self.target_machine = self.target.create_target_machine(opt=config.opt_level)
+        self.engine = llvm.create_mcjit_compiler(llvm.parse_assembly(''), self.target_machine)
+
+        # Names of the memoized functions of the added modules
+        self.memo_functions = []
+
+    def execute(self, module, main_function_name):
+        """
+        Add a module to the engine and run its main function
+        :param module: a module returned by LLVMCodeGenerator.detach_module()
+        :param main_function_name: name of the main function of the module
+        :return:
+        """
+        assert isinstance(module, ir.Module)
+
+        llvmmod = lower(module)
+        with phase('jit'):
+            self.engine.add_module(llvmmod)
+            self.engine.finalize_object()
+            self.engine.run_static_constructors()
+
+        dump('asm', 'Machine code', lambda: self.target_machine.emit_assembly(llvmmod))
+
+        fptr = CFUNCTYPE(None)(self.engine.get_function_address(main_function_name))
+        self.memo_functions.extend(memo_function_names(module))
+        with phase('run'):
+            fptr()
+        if config.memoize and self.memo_functions:
+            print_memo_report(take_memo_counters(self.engine, self.memo_functions), file=sys.stderr)
 
-        # Convert LLVM IR into in-memory representation
-        llvmmod = llvm.parse_assembly(str(module))
-        return target_machine.emit_object(llvmmod)
+    def close(self):
+        self.engine.close()
@@ -0,0 +1,212 @@
+"""
+folding.py
+
+Constant folding and algebraic simplification over the AST
+
+It runs between VSLCParser.parse() and LLVMCodeGenerator.generate_code(). Every value of VSL
+is a double, so the folding follows IEEE 754 arithmetic, and only the identities which hold
+for every double (including -0.0, infinities and NaN) are applied:
+
+    x * 1 => x    1 * x => x    x / 1 => x    x - 0 => x
+
+An IF whose test is a constant is replaced by the taken branch, and a WHILE whose test is a
+constant that is not > 0 is dropped.
+"""
+import math
+
+import config
+from ast import Program, Block, BinaryOperation, Number, FunctionCall, Expression
+from tracing import phase, count_nodes
+
+
+def _divide(left, right):
+    """
+    IEEE 754 division, which Python refuses for a zero divisor
+    """
+    if right != 0:
+        return left / right
+    if left == 0 or math.isnan(left):
+        return math.nan
+    return math.copysign(math.inf, left) * math.copysign(1.0, right)
+
+
+_OPERATIONS = {
+    '+': lambda left, right: left + right,
+    '-': lambda left, right: left - right,
+    '*': lambda left, right: left * right,
+    '/': _divide,
+}
+
+
+def _is_number(node, value):
+    """
+    Return True if the node is the literal 'value', +0.0 and -0.0 are different
+    """
+    return isinstance(node, Number) and node.value == value and \
+        math.copysign(1.0, node.value) == math.copysign(1.0, value)
+
+
+class ConstantFolder(object):
+    """Rewrite pass of the AST. The nodes are rewritten in place where possible
+
+    For AST node of class Foo, calls self._fold_Foo. Expression visitors return the
+    rewritten expression, statement visitors return a list of statements to replace it.
+    Expression trees are folded by _fold_expression() with an explicit stack.
+    """
+    def fold(self, node):
+        """
+        Fold a root node as accepted by LLVMCodeGenerator.generate_code()
+        :param node: Program, Block or a list of FunctionDefinition
+        :return: the folded root node
+        """
+        assert isinstance(node, (Program, Block, list))
+
+        if isinstance(node, list):
+            return [self._fold(function) for function in node]
+        return self._fold(node)
+
+    def _fold(self, node):
+        if isinstance(node, Expression):
+            return self._fold_expression(node)
+        method = '_fold_' + node.__class__.__name__
+        return getattr(self, method)(node)
+
+    def _fold_expression(self, root):
+        """
+        Fold an expression tree in post-order, the operands of a node are folded before it
+        :param root: Expression
+        :return: the folded expression
+        """
+        values = []
+        # (node, whether its operands are folded)
+        stack = [(root, False)]
+        while stack:
+            node, folded = stack.pop()
+            if isinstance(node, BinaryOperation):
+                if not folded:
+                    stack.append((node, True))
+                    stack.append((node.right_expression, False))
+                    stack.append((node.left_expression, False))
+                    continue
+                right = values.pop()
+                left = values.pop()
+                values.append(self._fold_BinaryOperation(node, left, right))
+            elif isinstance(node, FunctionCall) and node.argument_list:
+                if not folded:
+                    stack.append((node, True))
+                    stack.extend((argument, False) for argument in reversed(node.argument_list))
+                    continue
+                start = len(values) - len(node.argument_list)
+                node.argument_list = values[start:]
+                del values[start:]
+                values.append(node)
+            else:
+                method = '_fold_' + node.__class__.__name__
+                values.append(getattr(self, method)(node))
+        return values.pop()
+
+    def _fold_Program(self, node):
+        node.function_list = [self._fold(function) for function in node.function_list]
+        return node
+
+    def _fold_FunctionDefinition(self, node):
+        node.body = self._fold(node.body)
+        return node
+
+    def _fold_Block(self, node):
+        statement_list = []
+        for statement in node.statement_list:
+            statement_list.extend(self._fold(statement))
+        node.statement_list = statement_list
+        return node
+
+    # Statements
+
+    def _fold_AssignStatement(self, node):
+        node.right_expression = self._fold(node.right_expression)
+        return [node]
+
+    def _fold_ReturnStatement(self, node):
+        node.expression = self._fold(node.expression)
+        return [node]
+
+    def _fold_PrintStatement(self, node):
+        node.print_list = [self._fold(item) if isinstance(item, Expression) else item for item in node.print_list]
+        return [node]
+
+    def _fold_IfStatement(self, node):
+        node.test = self._fold(node.test)
+        node.then_block = self._fold(node.then_block)
+        if node.else_block is not None:
+            node.else_block = self._fold(node.else_block)
+
+        if not isinstance(node.test, Number):
+            return [node]
+
+        taken_block = node.then_block if node.test.value > 0 else node.else_block
+        if taken_block is None:  # IF without ELSE and the test never holds
+            return []
+        if taken_block.declaration_list:
+            # Declarations can't be moved into the enclosing block without changing which
+            # statements see the new variables. LLVM will fold the constant branch anyway.
+            return [node]
+        return taken_block.statement_list
+
+    def _fold_WhileStatement(self, node):
+        node.test = self._fold(node.test)
+        node.block = self._fold(node.block)
+
+        if isinstance(node.test, Number) and not node.test.value > 0:
+            return []
+        return [node]
+
+    # Expressions
+
+    def _fold_Number(self, node):
+        if node.minus_flag:
+            return Number(-node.value)
+        return node
+
+    def _fold_ID(self, node):
+        return node
+
+    def _fold_Text(self, node):
+        return node
+
+    def _fold_FunctionCall(self, node):  # without arguments
+        return node
+
+    def _fold_BinaryOperation(self, node, left, right):
+        # The operands are folded by _fold_expression()
+        if isinstance(left, Number) and isinstance(right, Number):
+            result = Number(_OPERATIONS[node.operator](left.value, right.value))
+        elif node.operator == '*' and _is_number(right, 1.0) or node.operator == '/' and _is_number(right, 1.0) \
+                or node.operator == '-' and _is_number(right, 0.0):
+            result = left
+        elif node.operator == '*' and _is_number(left, 1.0):
+            result = right
+        else:
+            node.left_expression = left
+            node.right_expression = right
+            return node
+
+        # The unary minus of the operation moves to its result
+        if node.minus_flag:
+            if isinstance(result, Number):
+                result = Number(-result.value)
+            else:
+                result.change_minus_flag()
+        return result
+
+
+def fold(node):
+    """
+    Shortcut for ConstantFolder().fold()
+    :param node:
+    :return:
+    """
+    with phase('fold') as span:
+        node = ConstantFolder().fold(node)
+        if config.trace:
+            span.set(nodes=count_nodes(node))
+        return node
@@ -0,0 +1,198 @@
+"""
+incremental.py
+
+Incremental compilation at the granularity of FunctionDefinition
+
+Every function is generated into its own module, optimized, and kept as bitcode under the
+structural hash of its subtree. The hash also covers the signatures of the functions it calls
+and the fingerprint of cache.py, because the code of a call depends on the callee's parameter
+count. A recompile only generates the functions whose hash changed, links the bitcode of all
+the functions into one module and emits it.
+
+Like in the whole-program codegen, a function only sees the functions defined before it and
+itself. The optimizer sees one function at a time, so no function is inlined into another.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+
+import llvmlite.binding as llvm
+
+import config
+from ast import ASTNode, Program, FunctionCall, node_fields
+from cache import ObjectCache, default_directory, fingerprint
+from codegen import LLVMCodeGenerator, CodegenError
+from evaluator import get_target_machine, lower
+from tracing import phase
+
+def function_key(function, signatures):
+    """
+    Compute the structural hash of a FunctionDefinition
+    :param function: FunctionDefinition
+    :param signatures: function name => number of parameters, of the functions it can call
+    :return: hex digest, and the names of the called functions
+    """
+    digest = hashlib.sha256()
+    callees = set()
+
+    # Pre-order walk. Every node is written with its class and every list with its length,
+    # so that two different trees never write the same sequence.
+    stack = [function]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, ASTNode):
+            if isinstance(item, FunctionCall):
+                callees.add(item.name.name)
+            digest.update(item.__class__.__name__.encode('ascii'))
+            stack.extend(getattr(item, name) for name in reversed(node_fields(item.__class__)))
+        elif isinstance(item, list):
+            digest.update(b'[%d' % len(item))
+            stack.extend(reversed(item))
+        else:
+            digest.update(b'\0' + repr(item).encode('utf-8'))
+
+    for name in sorted(callees):
+        digest.update('\0{}/{}'.format(name, signatures.get(name)).encode('utf-8'))
+    digest.update(fingerprint())
+    return digest.hexdigest(), callees
+
+
+class IncrementalCompiler(object):
+    """Compiles programs, reusing the bitcode of the functions unchanged since earlier compiles
+
+    The bitcode is kept in memory up to max_size bytes, evicting the least recently used first,
+    and on disk when a directory is given.
+    After compile(), self.reused and self.generated count the functions of that compile.
+    """
+    def __init__(self, directory=None, max_size=None):
+        if max_size is None:
+            max_size = config.cache_max_size
+        assert isinstance(max_size, int) and max_size > 0
+
+        # key => bitcode, in least recently used order
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.max_size = max_size
+        self.disk = ObjectCache(directory, suffix='.bc') if directory is not None else None
+
+        self.reused = 0
+        self.generated = 0
+
+    def _get(self, key):
+        bitcode = self.memory.get(key)
+        if bitcode is not None:
+            self.memory.move_to_end(key)
+        elif self.disk is not None:
+            bitcode = self.disk.get(key)
+            if bitcode is not None:
+                self._remember(key, bitcode)
+        return bitcode
+
+    def _put(self, key, bitcode):
+        self._remember(key, bitcode)
+        if self.disk is not None:
+            self.disk.put(key, bitcode)
+
+    def _remember(self, key, bitcode):
+        """
+        Keep the bitcode in memory, then evict the least recently used until it fits in max_size.
+        A long-running server would keep every version of every function otherwise
+        :param key:
+        :param bitcode:
+        :return:
+        """
+        self.memory[key] = bitcode
+        self.memory_size += len(bitcode)
+        while self.memory_size > self.max_size:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    @staticmethod
+    def _generate(function, callees, signatures, module_name):
+        """
+        Generate and optimize the module of one function
+        :return: bitcode
+        """
+        name = function.name.name
+        generator = LLVMCodeGenerator('compile', module_name='{}:{}'.format(module_name, name))
+        generator.constant_prefix = '.str.' + name
+        for callee in sorted(callees):
+            # An unknown callee is left undeclared, so the codegen reports it as usual
+            if callee != name and callee in signatures:
+                generator.declare_function(callee, signatures[callee])
+        generator.generate_code([function])
+        return lower(generator.module).as_bitcode()
+
+    def link(self, program, module_name='<string>'):
+        """
+        Link the optimized bitcode of every function of a program into one module,
+        generating the functions which are not in the cache
+        :param program: Program
+        :param module_name:
+        :return: llvm.ModuleRef
+        """
+        assert isinstance(program, Program)
+
+        self.reused = 0
+        self.generated = 0
+        signatures = {}
+        modules = []
+
+        with phase('incremental', functions=len(program.function_list)) as span:
+            for function in program.function_list:
+                name = function.name.name
+                if name in signatures:
+                    raise CodegenError('Redefinition of function: {}'.format(name))
+                signatures[name] = len(function.parameter_list)
+
+                key, callees = function_key(function, signatures)
+                bitcode = self._get(key)
+                if bitcode is None:
+                    bitcode = self._generate(function, callees, signatures, module_name)
+                    self._put(key, bitcode)
+                    self.generated += 1
+                else:
+                    self.reused += 1
+                modules.append(llvm.parse_bitcode(bitcode))
+            span.set(reused=self.reused, generated=self.generated)
+
+        with phase('link', modules=len(modules)):
+            # Link pairwise level by level. Linking every module into one growing module
+            # costs time in the size of the destination each time, so O(N^2) in total.
+            while len(modules) > 1:
+                for destination, source in zip(modules[::2], modules[1::2]):
+                    destination.link_in(source)
+                modules = modules[::2]
+            linked = modules[0] if modules else llvm.parse_assembly('')
+        linked.name = module_name
+        return linked
+
+    def compile(self, program, module_name='<string>'):
+        """
+        Compile a program into object code
+        :param program: Program
+        :param module_name:
+        :return: object code
+        """
+        llvmmod = self.link(program, module_name)
+        with phase('emit') as span:
+            obj_code = get_target_machine(codemodel='small', opt=config.opt_level).emit_object(llvmmod)
+            span.set(bytes=len(obj_code))
+        return obj_code
+
+
+_compiler = None
+
+
+def get_incremental_compiler():
+    """
+    Return the incremental compiler of the process, which keeps the function bitcode in
+    the 'functions' directory of the cache when config.object_cache is on
+    :return:
+    """
+    global _compiler
+
+    if _compiler is None:
+        _compiler = IncrementalCompiler(os.path.join(default_directory(), 'functions')
+                                        if config.object_cache else None)
+    return _compiler
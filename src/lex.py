@@ -16,6 +16,10 @@ class VSLCLexer(object):
 
     lexer = None  # Wait to be initialized
 
+    # The master lexer built by the first build() in the process. Later builds clone it
+    #  instead of collecting the rules and compiling the master regular expression again.
+    _master_lexer = None
+
     # All lexers must provide a list `tokens` that defines all of the possible token names
     #  that can be produced by the lexer.
     tokens = [
@@ -72,7 +76,10 @@ class VSLCLexer(object):
 
     # Build the lexer
     def build(self):
-        self.lexer = lex.lex(module=self, debug=lexer_debug, optimize=lexer_optimize)
+        if VSLCLexer._master_lexer is None:
+            VSLCLexer._master_lexer = lex.lex(module=self, debug=lexer_debug, optimize=lexer_optimize)
+        self.lexer = VSLCLexer._master_lexer.clone(self)
+        self.lexer.lineno = 1
 
     # Test it output
     def test(self, data):
@@ -118,9 +125,9 @@ class VSLCLexer(object):
     def find_column(_input, token):
         """
         Compute column.
-        :param _input: the input text string
+        :param _input: the input text string, or bytes or mmap read by the VSLCScanner
         :param token: a token instance
         :return:
         """
-        line_start = _input.rfind('\n', 0, token.lexpos) + 1
+        line_start = _input.rfind('\n' if isinstance(_input, str) else b'\n', 0, token.lexpos) + 1
         return (token.lexpos - line_start) + 1
@@ -0,0 +1,157 @@
+"""
+optimizer.py
+
+LLVM optimization pipeline of vslc, configured by the config.opt_level family of settings
+"""
+import sys
+import time
+
+import llvmlite.binding as llvm
+
+import config
+
+# Accepted values of the -O command line option => (opt_level, size_level)
+OPT_LEVELS = {
+    '0': (0, 0),
+    '1': (1, 0),
+    '2': (2, 0),
+    '3': (3, 0),
+    's': (2, 1),
+    'z': (2, 2),
+}
+
+
+# Inlining thresholds of clang by (opt_level, size_level), when config.inline_threshold is None.
+# -O0 and -O1 add no inliner
+INLINE_THRESHOLDS = {
+    (2, 0): 225,
+    (3, 0): 275,
+    (2, 1): 75,
+    (2, 2): 25,
+}
+
+
+def set_opt_level(level):
+    """
+    Set config.opt_level and config.size_level from a -O option value
+    :param level: one of OPT_LEVELS
+    :return:
+    """
+    assert level in OPT_LEVELS, 'unknown optimization level: {}'.format(level)
+
+    config.opt_level, config.size_level = OPT_LEVELS[level]
+
+
+def create_pass_manager_builder():
+    """
+    Create a pass manager builder from the config
+    :return:
+    """
+    pmb = llvm.create_pass_manager_builder()
+    pmb.opt_level = config.opt_level
+    pmb.size_level = config.size_level
+    inline_threshold = config.inline_threshold
+    if inline_threshold is None:
+        inline_threshold = INLINE_THRESHOLDS.get((config.opt_level, config.size_level))
+    if inline_threshold is not None:
+        pmb.inlining_threshold = inline_threshold
+    pmb.loop_vectorize = config.loop_vectorize
+    pmb.slp_vectorize = config.slp_vectorize
+    return pmb
+
+
+class Optimizer(object):
+    """Runs the function passes on every function, then the module passes
+
+    The pass managers are built once for the config at the time of construction.
+    When config.time_passes is on, the time of every function and of the module passes
+    is recorded in self.timings and reported by report().
+    """
+    def __init__(self):
+        self.enabled = config.opt_level > 0 or config.size_level > 0
+        # Without optimization the variables still get promoted from allocas to SSA registers
+        self.promote_only = not self.enabled and config.ssa_promotion
+
+        pmb = create_pass_manager_builder()
+        self.module_pass_manager = llvm.create_module_pass_manager()
+        pmb.populate(self.module_pass_manager)
+        self.pmb = pmb
+
+        # (stage, name, seconds)
+        self.timings = []
+
+    def run(self, llvmmod):
+        """
+        Optimize a module in place
+        :param llvmmod: llvm.ModuleRef
+        :return: True if the module was changed
+        """
+        if not self.enabled and not self.promote_only:
+            return False
+
+        # A function pass manager is bound to its module
+        function_pass_manager = llvm.create_function_pass_manager(llvmmod)
+        if self.promote_only:
+            function_pass_manager.add_sroa_pass()
+        else:
+            self.pmb.populate(function_pass_manager)
+
+        changed = function_pass_manager.initialize()
+        for function in llvmmod.functions:
+            if function.is_declaration:
+                continue
+            start = time.perf_counter()
+            changed |= function_pass_manager.run(function)
+            self._record('function', function.name, start)
+        changed |= function_pass_manager.finalize()
+
+        if self.promote_only:
+            return changed
+
+        start = time.perf_counter()
+        changed |= self.module_pass_manager.run(llvmmod)
+        self._record('module', llvmmod.name, start)
+        return changed
+
+    def _record(self, stage, name, start):
+        if config.time_passes:
+            self.timings.append((stage, name, time.perf_counter() - start))
+
+    def report(self, file=sys.stderr, top=10):
+        """
+        Print the time spent in the function and module passes since the last report
+        :param file:
+        :param top: number of the slowest functions listed
+        :return:
+        """
+        function_timings = [timing for timing in self.timings if timing[0] == 'function']
+        module_timings = [timing for timing in self.timings if timing[0] == 'module']
+
+        print('===== Pass execution timing report (-O{} size {}) ====='.format(
+            config.opt_level, config.size_level), file=file)
+        print('{:>10.4f} s  function passes over {} functions'.format(
+            sum(t for _, _, t in function_timings), len(function_timings)), file=file)
+        print('{:>10.4f} s  module passes over {} modules'.format(
+            sum(t for _, _, t in module_timings), len(module_timings)), file=file)
+        for _, name, elapsed in sorted(function_timings, key=lambda timing: -timing[2])[:top]:
+            print('{:>10.4f} s    {}'.format(elapsed, name), file=file)
+        self.timings = []
+
+
+_optimizer = None
+_optimizer_config = None
+
+
+def get_optimizer():
+    """
+    Return the optimizer of the current config, built again only when the config changed
+    :return:
+    """
+    global _optimizer, _optimizer_config
+
+    current_config = (config.opt_level, config.size_level, config.inline_threshold,
+                      config.loop_vectorize, config.slp_vectorize, config.ssa_promotion)
+    if _optimizer is None or _optimizer_config != current_config:
+        _optimizer = Optimizer()
+        _optimizer_config = current_config
+    return _optimizer
@@ -0,0 +1,172 @@
+"""
+partition.py
+
+Function-level parallel code generation of one program
+
+The functions of a Program are split into partitions. Every partition is generated into its
+own module, optimized and emitted to an object by a worker process, and the objects are
+packed into one static archive. The functions of the other partitions are declared in a module
+when they're called, and resolved by the linker, e.g. 'cc -no-pie a.out'. Like in a single
+module, a function can only call the functions defined before it in the source, whatever the
+partitions.
+
+The optimizer only sees one partition at a time, so no function is inlined across partitions.
+"""
+import heapq
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from ast import Program
+from astcodec import dumps, loads
+from codegen import LLVMCodeGenerator, CodegenError
+from evaluator import VSLCEvaluator, initialize, get_target_machine
+from tracing import phase, take_events, add_events
+
+AR_MAGIC = b'!<arch>\n'
+
+
+def partition(costs, count):
+    """
+    Split items into at most 'count' groups of about the same total cost, largest first
+    into the cheapest group
+    :param costs: cost of every item
+    :param count: number of the groups
+    :return: list of non-empty groups, each a sorted list of item indexes
+    """
+    assert count > 0
+
+    groups = [(0, index, []) for index in range(count)]
+    for item in sorted(range(len(costs)), key=lambda item: -costs[item]):
+        total, index, items = heapq.heappop(groups)
+        items.append(item)
+        heapq.heappush(groups, (total + costs[item], index, items))
+    # Keep the source order of the functions in every group, so the output is reproducible
+    return [sorted(items) for _, _, items in sorted(groups, key=lambda group: group[1]) if items]
+
+
+def _init_worker(settings):
+    """
+    Initializer of the worker processes. Apply the config of the parent process and warm up
+    the target machine
+    :param settings: the public names of the config module
+    :return:
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+    take_events()  # forked with the events of the parent process
+
+    initialize()
+    get_target_machine(codemodel='small', opt=config.opt_level)
+
+
+def _compile_partition(module_name, payloads, declarations):
+    """
+    Generate, optimize and emit one partition in a worker
+    :param module_name:
+    :param payloads: (source index, encoded FunctionDefinition) of the functions of the
+        partition in the source order, see astcodec.py
+    :param declarations: (source index, name, parameter count) of the functions of the other
+        partitions in the source order
+    :return: object code and the traced events
+    """
+    with phase('partition', module=module_name, functions=len(payloads)):
+        generator = LLVMCodeGenerator('compile', module_name=module_name)
+        declarations = iter(declarations)
+        declaration = next(declarations, None)
+        for index, payload in payloads:
+            # Only the functions defined before this one can be called
+            while declaration is not None and declaration[0] < index:
+                generator.external_functions[declaration[1]] = declaration[2]
+                declaration = next(declarations, None)
+            generator.generate_code([loads(payload)])
+
+        obj_code = VSLCEvaluator().compile_to_object_code(generator.module)
+    return obj_code, take_events()
+
+
+def compile_partitioned(program, module_name, partitions, jobs=None):
+    """
+    Compile a program into a static archive of one object per partition
+    :param program: Program
+    :param module_name:
+    :param partitions: number of the partitions
+    :param jobs: number of the worker processes, one per partition by default
+    :return: archive bytes
+    """
+    assert isinstance(program, Program)
+
+    signatures = [(function.name.name, len(function.parameter_list)) for function in program.function_list]
+    defined = set()
+    for name, _ in signatures:
+        # Each partition only sees its own functions, so check the redefinitions here
+        if name in defined:
+            raise CodegenError('Redefinition of function: {}'.format(name))
+        defined.add(name)
+
+    # The encoded size is a fair estimation of the codegen cost, and the workers need it anyway
+    payloads = [dumps(function) for function in program.function_list]
+    groups = partition([len(payload) for payload in payloads], partitions)
+
+    settings = {name: getattr(config, name) for name in dir(config) if not name.startswith('_')}
+    with ProcessPoolExecutor(max_workers=jobs or len(groups), initializer=_init_worker,
+                             initargs=(settings,)) as executor:
+        futures = []
+        for index, group in enumerate(groups):
+            members = set(group)
+            declarations = [(i,) + signature for i, signature in enumerate(signatures) if i not in members]
+            futures.append(executor.submit(_compile_partition, '{}.{}'.format(module_name, index),
+                                           [(i, payloads[i]) for i in group], declarations))
+        objects = []
+        for future in futures:
+            obj_code, events = future.result()
+            objects.append(obj_code)
+            add_events(events)
+
+    return write_archive([('part{}.o'.format(index), obj_code, [signatures[i][0] for i in group])
+                          for index, (group, obj_code) in enumerate(zip(groups, objects))])
+
+
+def _ar_header(name, size):
+    # name, mtime, uid, gid, mode, size, end. Zero timestamps and ids keep the archive reproducible
+    header = '{:<16}{:<12}{:<6}{:<6}{:<8}{:<10}`\n'.format(name, 0, 0, 0, 644, size).encode('ascii')
+    assert len(header) == 60, 'member name too long: {}'.format(name)
+    return header
+
+
+def write_archive(members):
+    """
+    Pack objects into a static archive in the System V (GNU) ar format, with the symbol
+    index which the linker needs to pick the members
+    :param members: list of (member name, object code, names of the defined symbols)
+    :return: archive bytes
+    """
+    symbols = [(symbol, index) for index, (_, _, member_symbols) in enumerate(members) for symbol in member_symbols]
+    names = b''.join(symbol.encode('utf-8') + b'\0' for symbol, _ in symbols)
+    index_size = 4 + 4 * len(symbols) + len(names)
+
+    # Every member is aligned to an even offset
+    offsets = []
+    offset = len(AR_MAGIC) + 60 + index_size + index_size % 2
+    for name, obj_code, _ in members:
+        offsets.append(offset)
+        offset += 60 + len(obj_code) + len(obj_code) % 2
+
+    chunks = [AR_MAGIC, _ar_header('/', index_size), struct.pack('>I', len(symbols))]
+    chunks.extend(struct.pack('>I', offsets[index]) for _, index in symbols)
+    chunks.append(names)
+    chunks.append(b'\n' * (index_size % 2))
+    for name, obj_code, _ in members:
+        chunks.append(_ar_header(name + '/', len(obj_code)))
+        chunks.append(obj_code)
+        chunks.append(b'\n' * (len(obj_code) % 2))
+    return b''.join(chunks)
+
+
+def partition_count():
+    """
+    Number of the partitions of config.codegen_partitions, where 0 is one per CPU
+    :return:
+    """
+    return config.codegen_partitions or os.cpu_count() or 1
@@ -0,0 +1,63 @@
+"""
+protocol.py
+
+Framed protocol between the vslc compile server and its clients
+
+A frame is a 4-byte big-endian length followed by that many bytes of a UTF-8 JSON object.
+A request carries an 'op' and its arguments, a response carries 'ok' and either the result
+or an 'error'. This module only depends on the standard library, so a client starts fast.
+"""
+import json
+import os
+import struct
+import tempfile
+
+HEADER = struct.Struct('>I')
+
+# Refuse frames larger than this, a corrupted length would allocate gigabytes otherwise
+MAX_FRAME_SIZE = 1 << 30
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def default_socket_path():
+    """
+    Unix socket path of the server of the current user
+    :return:
+    """
+    return os.path.join(tempfile.gettempdir(), 'vslc-{}.sock'.format(os.getuid()))
+
+
+def write_frame(stream, message):
+    """
+    Write a message as one frame and flush it
+    :param stream: binary file object
+    :param message: JSON serializable dict
+    :return:
+    """
+    payload = json.dumps(message).encode('utf-8')
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def read_frame(stream):
+    """
+    Read one frame
+    :param stream: binary file object
+    :return: the message, or None at the end of the stream
+    """
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) != HEADER.size:
+        raise ProtocolError('truncated frame header')
+    size, = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError('frame too large: {} bytes'.format(size))
+
+    payload = stream.read(size)
+    if len(payload) != size:
+        raise ProtocolError('truncated frame')
+    return json.loads(payload.decode('utf-8'))
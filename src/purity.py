@@ -0,0 +1,46 @@
+"""
+purity.py
+
+Purity analysis of functions for the memoization
+
+A function is pure when its result only depends on its arguments and calling it has no
+effect, so a call can be replaced by the result of an earlier call with the same arguments.
+That holds for a function which
+
+    has no PRINT
+    only calls itself and pure functions
+    only uses its parameters and the variables declared at the top of its body
+
+The last rule excludes the global variables of the shell, and the variables declared in nested
+blocks, whose names could refer to a global variable outside of the block.
+"""
+from ast import walk, FunctionCall, ID, PrintStatement, VariableDeclaration
+
+
+def is_pure(function, pure_functions):
+    """
+    Return True if a function is pure
+    :param function: FunctionDefinition
+    :param pure_functions: names of the pure functions defined before it
+    :return:
+    """
+    names = {parameter.name for parameter in function.parameter_list}
+    names.update(variable.name for declaration in function.body.declaration_list
+                 for variable in declaration.variable_list)
+
+    # The ID nodes naming the callees of the calls, they are not variables
+    callee_ids = set()
+    for node in walk(function.body):
+        if isinstance(node, PrintStatement):
+            return False
+        elif isinstance(node, FunctionCall):
+            if node.name.name != function.name.name and node.name.name not in pure_functions:
+                return False
+            callee_ids.add(id(node.name))
+        elif isinstance(node, ID):
+            if node.name not in names and id(node) not in callee_ids:
+                return False
+        elif isinstance(node, VariableDeclaration):
+            if node not in function.body.declaration_list:
+                return False
+    return True
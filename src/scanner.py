@@ -0,0 +1,189 @@
+"""
+scanner.py
+
+An alternative tokenizer backend for vslc.
+
+All the token rules of VSLCLexer are joined into a single compiled regular expression.
+Tokens are yielded lazily as compact (type, value, lineno, lexpos) tuples from a str,
+or from bytes such as a memory-mapped file. Keywords and numbers are converted per batch
+of matches instead of in a callback per token.
+"""
+import mmap
+import re
+from itertools import islice
+
+from lex import VSLCLexer
+
+# Number of matches converted together
+BATCH_SIZE = 4096
+
+# Token rules in the order ply tries them: function rules in definition order first,
+#  then string rules by decreasing regular expression length.
+_RULES = (
+    ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),
+    ('NUMBER', r'\d+\.?\d*'),
+    ('COMMENT', r'//[^\n]*\n?'),
+    ('newline', r'\n+'),
+    ('TEXT', VSLCLexer.t_TEXT),
+    ('ASSIGN', VSLCLexer.t_ASSIGN),
+    ('PLUS', VSLCLexer.t_PLUS),
+    ('TIMES', VSLCLexer.t_TIMES),
+    ('LPAREN', VSLCLexer.t_LPAREN),
+    ('RPAREN', VSLCLexer.t_RPAREN),
+    ('LBRACK', VSLCLexer.t_LBRACK),
+    ('RBRACK', VSLCLexer.t_RBRACK),
+    ('MINUS', VSLCLexer.t_MINUS),
+    ('DIVIDE', VSLCLexer.t_DIVIDE),
+    ('COMMA', VSLCLexer.t_COMMA),
+    ('error', r'[^ \t]'),
+)
+
+# Make the groups inside the rules non-capturing, so that the group index of a rule is its position.
+# Ignored characters are consumed as the prefix of every match instead of being matches of their own.
+_REGEX = '[ \t]*(?:' + '|'.join('({})'.format(re.sub(r'(?<!\\)\((?!\?)', '(?:', regex))
+                                for _, regex in _RULES) + ')'
+
+# Token type of each group index. The group index of a match is its m.lastindex
+_TYPES = (None,) + tuple(name for name, _ in _RULES)
+
+
+def _group_index(name):
+    return _TYPES.index(name)
+
+
+_ID, _NUMBER, _COMMENT, _NEWLINE, _ERROR = (
+    _group_index(name) for name in ('ID', 'NUMBER', 'COMMENT', 'newline', 'error'))
+
+
+class ScanToken(object):
+    """A token handed to ply. It only exists when the scanner is driven by the parser
+
+    """
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return 'ScanToken({},{!r},{},{})'.format(self.type, self.value, self.lineno, self.lexpos)
+
+
+class VSLCScanner(object):
+    """Single-regex tokenizer producing the same token set as VSLCLexer
+
+    """
+    tokens = VSLCLexer.tokens
+    reserved = VSLCLexer.reserved
+
+    _str_pattern = re.compile(_REGEX)
+    _bytes_pattern = re.compile(_REGEX.encode('ascii'))
+
+    lexer = None  # Wait to be initialized
+
+    def build(self):
+        """
+        Build a ply compatible lexer object on top of the scanner, see ScannerLexer
+        :return:
+        """
+        self.lexer = ScannerLexer(self)
+
+    def scan(self, data):
+        """
+        Yield (type, value, lineno, lexpos) tuples lazily
+        :param data: a str, bytes or a mmap.mmap object
+        :return:
+        """
+        if isinstance(data, str):
+            matches = self._str_pattern.finditer(data)
+            decode = None
+        else:
+            matches = self._bytes_pattern.finditer(data)
+            decode = bytes.decode
+
+        types = _TYPES
+        reserved_get = self.reserved.get
+        lineno = 1
+        while True:
+            batch = list(islice(matches, BATCH_SIZE))
+            if not batch:
+                break
+
+            # Collect the significant tokens of the batch
+            kinds = []
+            texts = []
+            linenos = []
+            positions = []
+            for match in batch:
+                index = match.lastindex
+                if index == _NEWLINE:
+                    lineno += len(match.group(index))
+                elif index == _COMMENT:
+                    lineno += 1  # still +1 lino, same as VSLCLexer.t_COMMENT
+                elif index == _ERROR:
+                    print("Illegal character '%s'" % match.group(index))
+                else:
+                    kinds.append(index)
+                    texts.append(match.group(index))
+                    linenos.append(lineno)
+                    positions.append(match.start(index))
+
+            # Convert the numbers and look up the keywords in bulk
+            number_texts = [text for kind, text in zip(kinds, texts) if kind == _NUMBER]
+            numbers = iter(list(map(float, number_texts)))
+            if decode is not None:
+                texts = list(map(decode, texts))
+            id_texts = [text for kind, text in zip(kinds, texts) if kind == _ID]
+            id_types = iter(list(map(reserved_get, id_texts, ['ID'] * len(id_texts))))
+
+            for kind, text, token_lineno, position in zip(kinds, texts, linenos, positions):
+                if kind == _NUMBER:
+                    yield 'NUMBER', next(numbers), token_lineno, position
+                elif kind == _ID:
+                    yield next(id_types), text, token_lineno, position
+                else:
+                    yield types[kind], text, token_lineno, position
+
+    def scan_file(self, filename):
+        """
+        Memory-map a file and yield its tokens lazily, see scan()
+        :param filename:
+        :return:
+        """
+        with open(filename, 'rb') as source_file:
+            try:
+                data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # an empty file can not be mapped
+                return
+            try:
+                yield from self.scan(data)
+            finally:
+                data.close()
+
+
+class ScannerLexer(object):
+    """Adapter giving VSLCScanner the input()/token() interface which ply.yacc expects
+
+    """
+    def __init__(self, scanner):
+        assert isinstance(scanner, VSLCScanner)
+
+        self.scanner = scanner
+        self.lineno = 1
+        self.lexpos = 0
+        self._tokens = iter(())
+
+    def input(self, data):
+        self._tokens = self.scanner.scan(data)
+        self.lineno = 1
+        self.lexpos = 0
+
+    def token(self):
+        token = next(self._tokens, None)
+        if token is None:
+            return None
+        self.lineno = token[2]
+        self.lexpos = token[3]
+        return ScanToken(*token)
@@ -0,0 +1,209 @@
+"""
+server.py
+
+Long-running compile server of vslc
+
+The server keeps the parsers, LLVM and the target machines warm, so that a request only pays
+for the work on its own source. Requests are framed by protocol.py and served one at a time,
+on a Unix socket or on stdin/stdout:
+
+    {"op": "compile", "source": <code> or "filename": <path>, "output": <object file, optional>}
+    {"op": "evaluate", "source": <code> or "filename": <path>}
+    {"op": "ping"}, {"op": "stats"}, {"op": "shutdown"}
+
+Everything printed while a request is served, including the output of the evaluated program,
+is returned in the 'output' of its response. vslcc.py is the client.
+
+A client may disconnect at any time, e.g. on Ctrl-C during a slow compile. The socket server
+then logs the broken connection to stderr and accepts the next one, the request itself is
+still served to the end.
+"""
+import base64
+import io
+import os
+import socket
+import sys
+import time
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+import config
+from codegen import LLVMCodeGenerator, CodegenError
+from driver import CompileError, compile_source, parse_source
+from evaluator import VSLCEvaluator, initialize, get_target_machine
+from protocol import ProtocolError, read_frame, write_frame
+from utils import capture_fd
+from yacc import parser_pool
+
+
+class CompileServer(object):
+    """Serves the requests with a warm frontend and backend
+
+    The parser tables, LLVM and the target machine are loaded once by the constructor.
+    """
+    def __init__(self):
+        start = time.perf_counter()
+        parser_pool.warm('program')
+        initialize()
+        get_target_machine(codemodel='small', opt=config.opt_level)
+        self.evaluator = VSLCEvaluator()
+        self.warmup_time = time.perf_counter() - start
+
+        self.requests = 0
+        self.failures = 0
+        self.running = True
+
+        self._handlers = {
+            'compile': self._compile,
+            'evaluate': self._evaluate,
+            'ping': lambda request, output: {},
+            'stats': self._stats,
+            'shutdown': self._shutdown,
+        }
+
+    def handle(self, request):
+        """
+        Serve one request
+        :param request: dict
+        :return: the response dict
+        """
+        start = time.perf_counter()
+        self.requests += 1
+
+        handler = self._handlers.get(request.get('op')) if isinstance(request, dict) else None
+        if handler is None:
+            self.failures += 1
+            return {'ok': False, 'error': 'Unknown request: {!r}'.format(request)}
+
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output), redirect_stderr(output):
+                response = handler(request, output)
+            response['ok'] = True
+        except (CompileError, CodegenError, OSError) as error:
+            response = {'ok': False, 'error': str(error)}
+        except Exception:
+            response = {'ok': False, 'error': traceback.format_exc()}
+        if not response['ok']:
+            self.failures += 1
+        response['output'] = output.getvalue()
+        response['elapsed'] = time.perf_counter() - start
+        return response
+
+    @staticmethod
+    def _read_source(request):
+        if 'source' in request:
+            return request['source'], request.get('filename', '<request>')
+        with open(request['filename'], 'r') as source_code_file:
+            return source_code_file.read(), request['filename']
+
+    def _compile(self, request, output):
+        code, filename = self._read_source(request)
+        obj_code = compile_source(code, filename)
+
+        if 'output' in request:
+            with open(request['output'], 'wb') as obj_file:
+                obj_file.write(obj_code)
+            return {'size': len(obj_code)}
+        return {'size': len(obj_code), 'object': base64.b64encode(obj_code).decode('ascii')}
+
+    def _evaluate(self, request, output):
+        code, filename = self._read_source(request)
+        generator = LLVMCodeGenerator('compile', module_name=filename)
+        generator.generate_code(parse_source(code))
+
+        with capture_fd(1, output):
+            result = self.evaluator.evaluate(generator.module)
+        return {'result': result}
+
+    def _stats(self, request, output):
+        return {'requests': self.requests, 'failures': self.failures, 'warmup_time': self.warmup_time}
+
+    def _shutdown(self, request, output):
+        self.running = False
+        return {}
+
+
+def serve_stream(server, instream, outstream):
+    """
+    Serve the requests of one stream until its end or a shutdown request
+    :param server: CompileServer
+    :param instream: binary file object
+    :param outstream: binary file object
+    :return:
+    """
+    while server.running:
+        try:
+            request = read_frame(instream)
+        except (ProtocolError, ValueError) as error:
+            write_frame(outstream, {'ok': False, 'error': 'Protocol error: {}'.format(error)})
+            return
+        if request is None:
+            return
+        write_frame(outstream, server.handle(request))
+
+
+def serve_stdio(server):
+    """
+    Serve the requests on stdin, the responses are written to stdout
+    :param server: CompileServer
+    :return:
+    """
+    # The frames go to a private copy of stdout, and the stdout file descriptor is pointed to
+    # stderr. So nothing else written to stdout can corrupt the frames.
+    outstream = os.fdopen(os.dup(1), 'wb')
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    with outstream:
+        serve_stream(server, sys.stdin.buffer, outstream)
+
+
+def serve_socket(server, path):
+    """
+    Serve the connections of a Unix socket, one at a time
+    :param server: CompileServer
+    :param path: socket path
+    :return:
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        if os.path.exists(path):
+            os.unlink(path)  # left by a dead server
+    else:
+        raise RuntimeError('A server is already listening on {}'.format(path))
+    finally:
+        probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    # The server reads and writes any file of the user on request
+    os.chmod(path, 0o600)
+    listener.listen()
+    try:
+        while server.running:
+            connection, _ = listener.accept()
+            try:
+                with connection, connection.makefile('rwb') as stream:
+                    serve_stream(server, stream, stream)
+            except OSError as error:  # BrokenPipeError, ConnectionResetError of a gone client
+                print('vslc server: connection lost: {}'.format(error), file=sys.stderr)
+    finally:
+        listener.close()
+        os.unlink(path)
+
+
+def serve(path):
+    """
+    Run a compile server until a shutdown request
+    :param path: Unix socket path, or '-' for stdin/stdout
+    :return:
+    """
+    server = CompileServer()
+    print('vslc server warmed up in {:.3f} s, serving on {}'.format(
+        server.warmup_time, 'stdin' if path == '-' else path), file=sys.stderr)
+    if path == '-':
+        serve_stdio(server)
+    else:
+        serve_socket(server, path)
@@ -0,0 +1,123 @@
+"""
+streaming.py
+
+Streaming compilation of huge sources with bounded memory
+
+The source file is memory-mapped and tokenized by the VSLCScanner, so it's never read into a
+string. The parser hands every FunctionDefinition to the StreamingCompiler as soon as it's
+reduced, which generates its code into the module of the current chunk and drops its AST.
+When the chunk holds config.streaming_chunk_instructions instructions, it's optimized and
+emitted to an object, and a new chunk starts. The objects are packed into a static archive
+like the partitions of partition.py.
+
+So the memory is bounded by the largest function and one chunk, besides the object code
+emitted so far. Functions of earlier chunks are declared in a chunk when they're called.
+"""
+import mmap
+
+import config
+from codegen import LLVMCodeGenerator, CodegenError
+from evaluator import VSLCEvaluator
+from folding import fold
+from partition import write_archive
+from tracing import phase
+from yacc import VSLCParser
+
+
+class StreamingError(Exception):
+    pass
+
+
+class StreamingCompiler(object):
+    """Compiles a source file function by function into a static archive of chunk objects"""
+    def __init__(self, module_name='<string>', chunk_instructions=None):
+        self.module_name = module_name
+        self.chunk_instructions = chunk_instructions or config.streaming_chunk_instructions
+
+        # function name => number of parameters, of every function so far
+        self.signatures = {}
+        # (member name, object code, defined function names) of the emitted chunks
+        self.members = []
+
+        self.generator = None
+        self.chunk_functions = []
+        self.instructions = 0
+
+    def _start_chunk(self):
+        self.generator = LLVMCodeGenerator('compile', module_name='{}.{}'.format(self.module_name, len(self.members)))
+        self.generator.constant_prefix = '.str.{}'.format(len(self.members))
+        # The earlier functions of this chunk are in its module, the others are external
+        self.generator.external_functions = self.signatures.copy()
+        self.chunk_functions = []
+        self.instructions = 0
+
+    def add_function(self, function):
+        """
+        Generate the code of a function into the current chunk, the parser hook of VSLCParser
+        :param function: FunctionDefinition
+        :return:
+        """
+        name = function.name.name
+        if name in self.signatures:
+            raise CodegenError('Redefinition of function: {}'.format(name))
+
+        if self.generator is None:
+            self._start_chunk()
+        if config.ast_fold:
+            function, = fold([function])
+        self.generator.generate_code([function])
+        self.signatures[name] = len(function.parameter_list)
+        self.chunk_functions.append(name)
+
+        self.instructions += sum(len(block.instructions) for block in self.generator.module.get_global(name).blocks)
+        if self.instructions >= self.chunk_instructions:
+            self.flush()
+
+    def flush(self):
+        """
+        Optimize and emit the current chunk
+        :return:
+        """
+        if self.generator is None:
+            return
+        with phase('chunk', functions=len(self.chunk_functions), instructions=self.instructions):
+            obj_code = VSLCEvaluator().compile_to_object_code(self.generator.module)
+        self.members.append(('chunk{}.o'.format(len(self.members)), obj_code, self.chunk_functions))
+        self.generator = None
+
+    def compile_file(self, filename):
+        """
+        Compile a VSL source file
+        :param filename:
+        :return: static archive bytes
+        """
+        parser = VSLCParser('program', lexer_backend='scanner')
+        parser.on_function = self.add_function
+
+        with open(filename, 'rb') as source_file:
+            try:
+                data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # an empty file can not be mapped
+                data = b''
+            try:
+                node = parser.parse(data)
+            finally:
+                # Drop the token iterator and the input, which hold buffers of the mapping
+                parser.lexer.lexer.input(b'')
+                parser.input = None
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+        if node is None:
+            raise StreamingError('compilation failed')
+        self.flush()
+        return write_archive(self.members)
+
+
+def compile_streaming(filename):
+    """
+    Shortcut for StreamingCompiler(filename).compile_file(filename)
+    :param filename:
+    :return: static archive bytes
+    """
+    return StreamingCompiler(filename).compile_file(filename)
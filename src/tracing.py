@@ -0,0 +1,179 @@
+"""
+tracing.py
+
+Phase tracing of vslc
+
+    with phase('codegen', module=name) as span:
+        ...
+        if config.trace:
+            span.set(instructions=count_instructions(module))
+
+Every phase records its wall time, CPU time and the peak RSS of the process, plus the peak
+of the Python heap when config.trace_memory is on. Phases nest, and the trace is written in
+the Chrome trace event format by write(), for chrome://tracing or https://ui.perfetto.dev.
+
+When config.trace is off, phase() returns one shared object whose methods do nothing, so
+the instrumented code pays a function call per phase. Counting is guarded by config.trace.
+"""
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+import config
+from ast import ASTNode, walk
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Phase(object):
+    """A traced phase, recorded into the tracer when it exits"""
+    __slots__ = ('tracer', 'name', 'args', 'start', 'cpu_start', 'peak')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.peak = 0
+
+    def set(self, **args):
+        """
+        Add arguments to the record of the phase, e.g. counts known at its end
+        :param args:
+        :return:
+        """
+        self.args.update(args)
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            # The peak so far belongs to the enclosing phase
+            if self.tracer.stack:
+                parent = self.tracer.stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.tracer.stack.append(self)
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        cpu = time.process_time() - self.cpu_start
+        self.tracer.stack.pop()
+
+        args = self.args
+        args['cpu_ms'] = round(cpu * 1e3, 3)
+        args['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            args['peak_heap_kb'] = self.peak // 1024
+            if self.tracer.stack:
+                parent = self.tracer.stack[-1]
+                parent.peak = max(parent.peak, self.peak)
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+
+        # perf_counter() is the monotonic clock of the system on Linux, so the events of
+        # the worker processes line up with the events of the parent
+        self.tracer.events.append({
+            'name': self.name,
+            'cat': 'vslc',
+            'ph': 'X',
+            'ts': self.start * 1e6,
+            'dur': (end - self.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': 0,
+            'args': args,
+        })
+        return False
+
+
+class Tracer(object):
+    """Collects the events of the phases of this process"""
+    def __init__(self):
+        self.events = []
+        # The phases being run, innermost last
+        self.stack = []
+
+
+_tracer = Tracer()
+
+
+def phase(name, **args):
+    """
+    Context manager tracing a phase when config.trace is on
+    :param name: name of the phase
+    :param args: arguments recorded with the phase
+    :return: Phase, or a shared null phase when tracing is off
+    """
+    if not config.trace:
+        return _NULL_PHASE
+    if config.trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return Phase(_tracer, name, args)
+
+
+def take_events():
+    """
+    Remove and return the events recorded so far, e.g. to ship them from a worker process
+    :return: list of events
+    """
+    events = _tracer.events
+    _tracer.events = []
+    return events
+
+
+def add_events(events):
+    """
+    Add the events recorded by another process
+    :param events:
+    :return:
+    """
+    _tracer.events.extend(events)
+
+
+def write(filename):
+    """
+    Write the events recorded so far as a Chrome trace
+    :param filename:
+    :return:
+    """
+    with open(filename, 'w') as trace_file:
+        json.dump({'traceEvents': _tracer.events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+def count_nodes(node):
+    """
+    Count the AST nodes of a tree, or of a list of trees
+    :param node:
+    :return:
+    """
+    roots = node if isinstance(node, list) else [node]
+    return sum(1 for root in roots if isinstance(root, ASTNode) for _ in walk(root))
+
+
+def count_instructions(module):
+    """
+    Count the instructions of the functions defined in a module
+    :param module: ir.Module or llvm.ModuleRef
+    :return:
+    """
+    if hasattr(module, 'global_values'):  # ir.Module
+        return sum(len(block.instructions) for function in module.functions for block in function.blocks)
+    return sum(len(list(block.instructions)) for function in module.functions if not function.is_declaration
+               for block in function.blocks)
@@ -0,0 +1,472 @@
+"""
+typeinfer.py
+
+Inference of the local variables and the expressions which can be computed in i64
+
+Every value of VSL is a double. Integer arithmetic gives the same results only while the values
+are integers which the double holds exactly, and never -0.0. So the inference bounds every
+integral value by an interval, running the function body abstractly:
+
+    a Number is [v, v] when its value is an integer of magnitude below 2^53, but not -0.0
+    an ID is the interval of the variable at that point
+    +, - and * are the intervals of the results, a division and a FunctionCall have none
+    a result outside of +-(2^53 - 1) has none, as the double would be rounded
+    a product has none when an operand can be 0 and the other negative, and a negation has
+    none when the operand can be 0, as the double would be -0.0
+
+The test of an IF or a WHILE narrows the intervals of the variables in its branches, e.g. the
+body of 'WHILE 100 - i' only sees i <= 99. A WHILE is run until its intervals are stable.
+
+The intervals alone can't bound an accumulator like s in 'WHILE i DO { s := s + i  i := i - 1 }',
+so a WHILE also bounds its trip count when its test compares a counter with a constant, and the
+body steps the counter towards it once per iteration. The state then also bounds the change of
+every variable during one iteration, and a variable stays within its interval at the entry of
+the loop plus the trip count times its change. The other bounds which keep growing are widened
+to +-(2^53 - 1).
+
+A variable assigned a value without an interval is demoted, and the inference starts again
+without it, until no variable is demoted.
+
+Only the variables declared at the top of the body are considered, which are in scope in every
+statement and can't be confused with a variable of another scope. When config.integer_inference
+is on, LLVMCodeGenerator keeps the integral variables in i64 and computes the integral
+expressions in i64, and converts them to double where a double is needed: divisions, calls,
+RETURN and PRINT.
+"""
+import itertools
+import math
+
+from ast import postorder, walk, AssignStatement, BinaryOperation, Block, ID, IfStatement, Number, \
+    PrintStatement, ReturnStatement, Text, VariableDeclaration, WhileStatement
+
+# Doubles hold every integer of a smaller magnitude
+MAX_EXACT_INTEGER = 2 ** 53
+
+# Bounds of the intervals
+_MIN = -MAX_EXACT_INTEGER + 1
+_MAX = MAX_EXACT_INTEGER - 1
+
+# Bounds of the change of a variable, the difference of two values within the bounds above
+_CHANGE_MIN = 2 * _MIN
+_CHANGE_MAX = 2 * _MAX
+
+# Rounds of a WHILE which widen the growing bounds to the bounds of the trip count, before
+# widening them to the limits
+_BOUNDED_ROUNDS = 8
+
+
+def is_integer_literal(value):
+    """
+    Return True if a Number value is integral
+    :param value: float
+    :return:
+    """
+    return value.is_integer() and -MAX_EXACT_INTEGER < value < MAX_EXACT_INTEGER and \
+        not (value == 0 and math.copysign(1.0, value) < 0)
+
+
+def _limits(key):
+    """
+    Return the bounds of the intervals of a key of a state
+    :param key: a variable name, or (id() of a WHILE, variable name) for the change of the
+        variable since the start of the current iteration of the loop
+    :return:
+    """
+    return (_MIN, _MAX) if isinstance(key, str) else (_CHANGE_MIN, _CHANGE_MAX)
+
+
+def _clip(key, low, high):
+    low_limit, high_limit = _limits(key)
+    return max(low, low_limit), min(high, high_limit)
+
+
+def _hull(interval, other):
+    return min(interval[0], other[0]), max(interval[1], other[1])
+
+
+def _contains(interval, other):
+    return interval[0] <= other[0] and other[1] <= interval[1]
+
+
+def _join(state, other):
+    """
+    Return the union of the intervals of two states
+    :param state: key => (low, high), see _limits()
+    :param other:
+    :return:
+    """
+    return {key: _hull(interval, other[key]) for key, interval in state.items()}
+
+
+def _meet(state, other):
+    """
+    Return the intersection of the intervals of two states, which both contain the same values
+    :param state:
+    :param other:
+    :return:
+    """
+    return {key: (max(low, other[key][0]), min(high, other[key][1])) for key, (low, high) in state.items()}
+
+
+class _IntervalAnalysis(object):
+    """One abstract run of a function body, with the demoted variables left out
+
+    A statement in a loop runs several times. Its last run is in the stable state of the loop,
+    so the intervals recorded last hold for every execution of the statement.
+    """
+    def __init__(self):
+        # id() of an expression node => its interval in the last run, or None
+        self.intervals = {}
+        # id() of an AssignStatement => the name of the variable and the interval of the value
+        # in the last run, or None
+        self.assignments = {}
+
+    def demoted(self):
+        """
+        Return the variables assigned a value without an interval
+        :return: set
+        """
+        return {name for name, interval in self.assignments.values() if interval is None}
+
+    def expression(self, expression, state):
+        """
+        Return the interval of an expression in a state, recording the intervals of its nodes
+        :param expression: Expression
+        :param state:
+        :return: (low, high) or None
+        """
+        intervals = self.intervals
+        for node in postorder(expression):
+            node_class = node.__class__
+            if node_class is Number:
+                value = node.value
+                interval = (int(value), int(value)) if is_integer_literal(value) else None
+            elif node_class is ID:
+                interval = state.get(node.name)
+            elif node_class is BinaryOperation:
+                interval = _operation(node.operator, intervals[id(node.left_expression)],
+                                      intervals[id(node.right_expression)])
+            else:  # FunctionCall
+                interval = None
+            if interval is not None and node.minus_flag:
+                low, high = interval
+                interval = (-high, -low) if low > 0 or high < 0 else None
+            intervals[id(node)] = interval
+        return intervals[id(expression)]
+
+    def offset(self, expression, name):
+        """
+        Return the bounds of an expression minus the current value of a variable, when it adds to
+        or subtracts from the variable, e.g. 's + i * 2'. The intervals of its nodes are the ones
+        recorded by the last expression()
+        :param expression: Expression
+        :param name: variable name
+        :return: (low, high) or None
+        """
+        intervals = self.intervals
+        offsets = {}
+        for node in postorder(expression):
+            offset = None
+            if node.minus_flag:
+                pass
+            elif node.__class__ is ID:
+                if node.name == name:
+                    offset = (0, 0)
+            elif node.__class__ is BinaryOperation and node.operator in ('+', '-'):
+                left, right = offsets[id(node.left_expression)], offsets[id(node.right_expression)]
+                left_interval = intervals[id(node.left_expression)]
+                right_interval = intervals[id(node.right_expression)]
+                if left is not None and right_interval is not None:
+                    offset = _operation(node.operator, left, right_interval, _CHANGE_MIN, _CHANGE_MAX)
+                elif node.operator == '+' and right is not None and left_interval is not None:
+                    offset = _operation('+', left_interval, right, _CHANGE_MIN, _CHANGE_MAX)
+            offsets[id(node)] = offset
+        return offsets[id(expression)]
+
+    def block(self, block, state):
+        for statement in block.statement_list:
+            state = self.statement(statement, state)
+        return state
+
+    def statement(self, statement, state):
+        """
+        Run a statement
+        :param statement: Statement
+        :param state: the intervals of the variables before the statement
+        :return: the intervals of the variables after the statement
+        """
+        statement_class = statement.__class__
+        if statement_class is AssignStatement:
+            interval = self.expression(statement.right_expression, state)
+            name = statement.left_variable.name
+            if name in state:
+                self.assignments[id(statement)] = (name, interval)
+                offset = self.offset(statement.right_expression, name)
+                state = dict(state)
+                state[name] = interval if interval is not None else (_MIN, _MAX)
+                for key, (low, high) in state.items():
+                    if isinstance(key, tuple) and key[1] == name:
+                        state[key] = _clip(key, low + offset[0], high + offset[1]) if offset is not None \
+                            else (_CHANGE_MIN, _CHANGE_MAX)
+        elif statement_class is IfStatement:
+            self.expression(statement.test, state)
+            then_state = self.block(statement.then_block, _narrow(statement.test, state, True))
+            else_state = _narrow(statement.test, state, False)
+            if statement.else_block is not None:
+                else_state = self.block(statement.else_block, else_state)
+            state = _join(then_state, else_state)
+        elif statement_class is WhileStatement:
+            state = self.loop(statement, state)
+        elif statement_class is Block:
+            state = self.block(statement, state)
+        elif statement_class is ReturnStatement:
+            # The state goes on to the following statements, which is less precise but sound
+            self.expression(statement.expression, state)
+        elif statement_class is PrintStatement:
+            for item in statement.print_list:
+                if not isinstance(item, Text):
+                    self.expression(item, state)
+        return state
+
+    def loop(self, statement, entry):
+        """
+        Run a WHILE until the state at the start of its iterations is stable
+        :param statement: WhileStatement
+        :param entry: the state before the loop
+        :return: the state after the loop
+        """
+        trips = _trip_count(statement, entry)
+        state = entry
+        for rounds in itertools.count():
+            self.expression(statement.test, state)
+            after, bounds = self.iterate(statement, entry, state, trips)
+            grown = {}
+            for key, interval in state.items():
+                if _contains(interval, after[key]) or bounds is not None and _contains(interval, bounds[key]):
+                    grown[key] = interval
+                elif bounds is not None and rounds < _BOUNDED_ROUNDS:
+                    grown[key] = _hull(_hull(interval, after[key]), bounds[key])
+                else:
+                    low_limit, high_limit = _limits(key)
+                    grown[key] = (interval[0] if after[key][0] >= interval[0] else low_limit,
+                                  interval[1] if after[key][1] <= interval[1] else high_limit)
+            if grown == state:
+                break
+            state = grown
+
+        # Every state at the start of an iteration is within all of them
+        state = _meet(state, after)
+        if bounds is not None:
+            state = _meet(state, bounds)
+        # Run once more in the final state, so that the recorded intervals are the ones of it
+        self.expression(statement.test, state)
+        self.iterate(statement, entry, state, trips)
+        return _narrow(statement.test, state, False)
+
+    def iterate(self, statement, entry, state, trips):
+        """
+        Run one iteration of a WHILE
+        :param statement: WhileStatement
+        :param entry: the state before the loop
+        :param state: the state at the start of the iteration
+        :param trips: the most iterations of the loop, or None
+        :return: the state at the start of the next iteration joined with entry, and the bounds
+            of every state at the start of an iteration from the trip count, or None
+        """
+        loop = id(statement)
+        body_state = dict(_narrow(statement.test, state, True))
+        for key in entry:
+            if isinstance(key, str):
+                body_state[(loop, key)] = (0, 0)
+        out = self.block(statement.block, body_state)
+
+        after = _join(entry, {key: interval for key, interval in out.items()
+                              if isinstance(key, str) or key[0] != loop})
+        if trips is None:
+            return after, None
+        bounds = {}
+        for key, (low, high) in entry.items():
+            change_low, change_high = out[(loop, key if isinstance(key, str) else key[1])]
+            bounds[key] = _clip(key, low + min(0, trips * change_low), high + max(0, trips * change_high))
+        return after, bounds
+
+
+def _integer_literal(node):
+    """
+    Return the value of an integral Number, or None
+    :param node: Expression
+    :return: int or None
+    """
+    if isinstance(node, Number) and is_integer_literal(node.value):
+        return -int(node.value) if node.minus_flag else int(node.value)
+    return None
+
+
+def _step(name, block, assignments):
+    """
+    Return the step of a loop counter, when its only assignment in the loop body is a
+    'name := name + k' or 'name := name - k' statement of the body itself
+    :param name: variable name
+    :param block: the loop body
+    :param assignments: AssignStatement of the variable in the body
+    :return: int or None
+    """
+    if len(assignments) != 1 or assignments[0] not in block.statement_list:
+        return None
+    expression = assignments[0].right_expression
+    if expression.minus_flag or not isinstance(expression, BinaryOperation) or expression.operator not in ('+', '-'):
+        return None
+    left, right = expression.left_expression, expression.right_expression
+    if isinstance(left, ID) and left.name == name and not left.minus_flag:
+        step = _integer_literal(right)
+        if step is not None and expression.operator == '-':
+            step = -step
+    elif isinstance(right, ID) and right.name == name and not right.minus_flag and expression.operator == '+':
+        step = _integer_literal(left)
+    else:
+        return None
+    return step or None
+
+
+def _trip_count(statement, state):
+    """
+    Return the most iterations of a WHILE entered in a state. The test has to compare a counter
+    with a literal or a variable the body doesn't assign, and the body has to step the counter
+    towards it, e.g. 'WHILE i DO { ... i := i - 1 }' or 'WHILE n - i DO { ... i := i + 1 }'
+    :param statement: WhileStatement
+    :param state:
+    :return: int, or None when the trip count is not bounded
+    """
+    test = statement.test
+    if test.minus_flag:
+        return None
+    if isinstance(test, ID):
+        left, right = test, Number(0.0)
+    elif isinstance(test, BinaryOperation) and test.operator == '-':
+        left, right = test.left_expression, test.right_expression
+    else:
+        return None
+
+    assignments = {}
+    for node in walk(statement.block):
+        if isinstance(node, AssignStatement):
+            assignments.setdefault(node.left_variable.name, []).append(node)
+
+    def constant(node):
+        value = _integer_literal(node)
+        if value is not None:
+            return value, value
+        if isinstance(node, ID) and not node.minus_flag and node.name not in assignments:
+            return state.get(node.name)
+        return None
+
+    # The loop runs while left > right, so a counter on the left has to decrease, and one on
+    # the right has to increase
+    for counter, limit, direction in ((left, right, -1), (right, left, 1)):
+        if not isinstance(counter, ID) or counter.minus_flag or counter.name not in state:
+            continue
+        step = _step(counter.name, statement.block, assignments.get(counter.name, []))
+        limit_interval = constant(limit)
+        if step is None or limit_interval is None or (step > 0) != (direction > 0):
+            continue
+        low, high = state[counter.name]
+        distance = high - limit_interval[0] if direction < 0 else limit_interval[1] - low
+        return max(0, -(-distance // abs(step)))
+    return None
+
+
+def _operation(operator, left, right, low_limit=_MIN, high_limit=_MAX):
+    """
+    Return the interval of a BinaryOperation
+    :param operator:
+    :param left: interval of the left operand, or None
+    :param right: interval of the right operand, or None
+    :param low_limit: the result has no interval below it
+    :param high_limit: the result has no interval above it
+    :return:
+    """
+    if left is None or right is None or operator == '/':
+        return None
+    if operator == '+':
+        low, high = left[0] + right[0], left[1] + right[1]
+    elif operator == '-':
+        low, high = left[0] - right[1], left[1] - right[0]
+    else:
+        # 0 times a negative number is -0.0
+        if left[0] <= 0 <= left[1] and right[0] < 0 or right[0] <= 0 <= right[1] and left[0] < 0:
+            return None
+        products = (left[0] * right[0], left[0] * right[1], left[1] * right[0], left[1] * right[1])
+        low, high = min(products), max(products)
+    if low < low_limit or high > high_limit:
+        return None
+    return low, high
+
+
+def _narrow(test, state, holds):
+    """
+    Return the state narrowed by the test of an IF or a WHILE
+    :param test: Expression, which holds when it is > 0
+    :param state:
+    :param holds: whether the test holds
+    :return:
+    """
+    if test.minus_flag:
+        return state
+    if isinstance(test, ID):
+        left, right = test, Number(0.0)
+    elif isinstance(test, BinaryOperation) and test.operator == '-' and \
+            not test.left_expression.minus_flag and not test.right_expression.minus_flag:
+        left, right = test.left_expression, test.right_expression
+    else:
+        return state
+
+    def interval(node):
+        if isinstance(node, ID):
+            return state.get(node.name)
+        if isinstance(node, Number) and is_integer_literal(node.value):
+            return int(node.value), int(node.value)
+        return None
+
+    left_interval, right_interval = interval(left), interval(right)
+    if left_interval is None or right_interval is None:
+        return state
+    if holds:
+        # left > right, so left >= right + 1 as both are integers
+        left_interval = (max(left_interval[0], right_interval[0] + 1), left_interval[1])
+        right_interval = (right_interval[0], min(right_interval[1], left_interval[1] - 1))
+    else:
+        left_interval = (left_interval[0], min(left_interval[1], right_interval[1]))
+        right_interval = (max(right_interval[0], left_interval[0]), right_interval[1])
+    # An empty interval means the branch is never taken, keep the state then
+    if left_interval[0] > left_interval[1] or right_interval[0] > right_interval[1]:
+        return state
+
+    state = dict(state)
+    if isinstance(left, ID):
+        state[left.name] = left_interval
+    if isinstance(right, ID):
+        state[right.name] = right_interval
+    return state
+
+
+def infer_integers(function):
+    """
+    Infer the integral variables and expressions of a function
+    :param function: FunctionDefinition
+    :return: (set of the variable names, set of id() of the expression nodes)
+    """
+    variables = {variable.name for declaration in function.body.declaration_list
+                 for variable in declaration.variable_list}
+    variables.difference_update(parameter.name for parameter in function.parameter_list)
+    for node in walk(function.body):
+        if isinstance(node, VariableDeclaration) and node not in function.body.declaration_list:
+            variables.difference_update(variable.name for variable in node.variable_list)
+
+    while True:
+        analysis = _IntervalAnalysis()
+        analysis.block(function.body, {name: (0, 0) for name in variables})
+        demoted = analysis.demoted()
+        if not demoted:
+            break
+        variables = variables - demoted
+    return variables, {key for key, interval in analysis.intervals.items() if interval is not None}
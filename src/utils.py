@@ -1,6 +1,8 @@
+import ctypes
+import os
 import platform
-import random
-import string
+import tempfile
+from contextlib import contextmanager
 
 from llvmlite._version import get_versions as llvmlite_version
 
@@ -56,9 +58,26 @@ def print_help():
     """)
 
 
-def ran6():
+_libc = ctypes.CDLL(None)
+
+
+@contextmanager
+def capture_fd(fd, output):
     """
-    Generate a random 6 chars
+    Redirect a file descriptor into a temporary file and append what was written to output.
+    The C stdio buffers are flushed at the end, so the printf() of JIT code is captured too
+    :param fd: file descriptor, e.g. 1 for stdout
+    :param output: text stream
     :return:
     """
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    with tempfile.TemporaryFile() as capture_file:
+        saved_fd = os.dup(fd)
+        os.dup2(capture_file.fileno(), fd)
+        try:
+            yield
+        finally:
+            _libc.fflush(None)
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+            capture_file.seek(0)
+            output.write(capture_file.read().decode('utf-8', 'replace'))
@@ -3,15 +3,24 @@ vslc.py
 
 Entry point of vslcpy
 """
+import argparse
 import inspect
 import sys
+import time
 
-from ast import Program
+import config
+import tracing
 
-from codegen import LLVMCodeGenerator
+from codegen import LLVMCodeGenerator, CodegenError
+from driver import CompileError, compile_file, compile_files, print_report
+from folding import fold
 from utils import predict_start, error_print, hello, print_help
-from yacc import VSLCParser
-from evaluator import VSLCEvaluator
+from yacc import parser_pool
+from evaluator import JITSession
+from partition import partition_count
+from protocol import default_socket_path
+from server import serve
+from optimizer import OPT_LEVELS, set_opt_level, get_optimizer
 
 
 def _compile(filename):
@@ -20,31 +29,46 @@ def _compile(filename):
     :param filename: filename of VSL source file
     :return:
     """
-    with open(filename, 'r') as source_code_file:
-        code = source_code_file.read()
+    try:
+        compile_file(filename, 'a.out')
+    except (CompileError, CodegenError, OSError, UnicodeDecodeError) as error:
+        error_print('{}: {}'.format(filename, error))
+        sys.exit(1)
 
-        parser = VSLCParser()
-        node = parser.parse(code)
-
-        assert isinstance(node, Program)
-
-        generator = LLVMCodeGenerator('compile', module_name=filename)
-        generator.generate_code(node)
+    if partition_count() == 1 and not config.streaming:
+        print('Object code has been output to the \'a.out\' file.')
+    else:
+        print('Static archive has been output to the \'a.out\' file.')
 
-        evaluator = VSLCEvaluator()
-        obj_code = evaluator.compile_to_object_code(generator.module)
+    if config.time_passes:
+        get_optimizer().report()
 
-        with open('a.out', 'rb+') as obj_file:
-            obj_file.write(obj_code)
 
-        print('Object code has been output to the \'a.out\' file.')
+def _compile_many(filenames, output_dir, jobs):
+    """
+    Compile the files into the output directory across a process pool
+    :param filenames: filenames of VSL source files
+    :param output_dir:
+    :param jobs: number of the worker processes
+    :return: True if all the files are compiled
+    """
+    start = time.perf_counter()
+    try:
+        results = compile_files(filenames, output_dir, jobs)
+    except CompileError as error:
+        error_print(str(error))
+        return False
+    print_report(results, time.perf_counter() - start)
+    return all(result.ok for result in results)
 
 
-def _iscommand(command, generator):
+def _iscommand(command, generator, session):
     """
     Return False if is not a command,
     Otherwise execute the command
     :param command:
+    :param generator: code generator of the shell
+    :param session: JITSession of the shell
     :return:
     """
     commands = ('H', 'P', 'E', 'Q')
@@ -57,9 +81,11 @@ def _iscommand(command, generator):
     elif command == 'P':
         print(generator.module)
     elif command == 'E':
-        evaluator = VSLCEvaluator()
-        evaluator.evaluate(generator.module)
-    elif command == 'P':
+        # Only the code input since the last 'E' is added to the session and executed
+        session.execute(*generator.detach_module())
+        if config.time_passes:
+            get_optimizer().report()
+    elif command == 'Q':
         print('Good Bye')
         exit(0)
     return True
@@ -71,6 +97,7 @@ def _shell():
     :return:
     """
     generator = LLVMCodeGenerator('shell', module_name='<stdin>')  # init llvm before we can interact with the shell
+    session = JITSession()
     hello()
     code = ''  # init input data
     while True:
@@ -84,15 +111,18 @@ def _shell():
                     line = input('... ')
             elif line == '':  # empty line
                 continue
-            elif _iscommand(line, generator):  # continue if line is a command
+            elif _iscommand(line, generator, session):  # continue if line is a command
                 continue
             else:  # single line input
                 code += line
 
             # parse code
             starting_symbol = predict_start(code)
-            parser = VSLCParser(parser_start=starting_symbol)
-            node = parser.parse(code)
+            with parser_pool.parser(starting_symbol) as parser:
+                node = parser.parse(code)
+
+            if config.ast_fold:
+                node = fold(node)
 
             # code gen. Only function_list, block and program's code_gen() are public
             generator.generate_code(node)
@@ -117,10 +147,60 @@ def main():
     Main entry of vslc
     :return:
     """
-    if len(sys.argv) == 1:
-        _shell()
-    else:
-        _compile(sys.argv[1])
+    parser = argparse.ArgumentParser(description='A Very Simple Language Compiler')
+    parser.add_argument('files', nargs='*', metavar='file', help='VSL source files. Enter the shell mode if omitted')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='compile every file into <output-dir>/<name>.o across a process pool')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of the worker processes, the number of CPUs by default')
+    parser.add_argument('-O', dest='opt_level', choices=sorted(OPT_LEVELS), default=None,
+                        help='optimization level, s and z optimize for size')
+    parser.add_argument('--partitions', type=int, default=None, metavar='N',
+                        help='generate and emit a single file in N parallel partitions, 0 for one per CPU')
+    parser.add_argument('--serve', nargs='?', const=default_socket_path(), default=None, metavar='SOCKET',
+                        help='run a compile server on a Unix socket, or on stdin/stdout for \'-\'')
+    parser.add_argument('--streaming', action='store_true',
+                        help='compile function by function from a memory map, for huge sources')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only compile the functions changed since an earlier compile')
+    parser.add_argument('--memoize', action='store_true',
+                        help='memoize the pure functions, the shell reports the hit rates')
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help='write the time, CPU time and memory of every phase to FILE as a Chrome trace')
+    parser.add_argument('--trace-memory', action='store_true', help='also trace the peak Python heap of the phases')
+    parser.add_argument('--time-passes', action='store_true', help='report the time of the optimization passes')
+    args = parser.parse_args()
+
+    if args.opt_level is not None:
+        set_opt_level(args.opt_level)
+    if args.time_passes:
+        config.time_passes = True
+    if args.partitions is not None:
+        config.codegen_partitions = args.partitions
+    if args.streaming:
+        config.streaming = True
+    if args.incremental:
+        config.incremental = True
+    if args.memoize:
+        config.memoize = True
+    if args.trace is not None:
+        config.trace = True
+        config.trace_memory = args.trace_memory
+
+    try:
+        if args.serve is not None:
+            serve(args.serve)
+        elif not args.files:
+            _shell()
+        elif len(args.files) == 1 and args.output_dir is None:
+            _compile(args.files[0])
+        else:
+            if not _compile_many(args.files, args.output_dir or '.', args.jobs):
+                sys.exit(1)
+    finally:
+        if args.trace is not None:
+            tracing.write(args.trace)
+            print('Trace has been written to the \'{}\' file.'.format(args.trace), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+"""
+vslcc.py
+
+Thin client of the vslc compile server, see server.py. Start the server first with
+'python vslc.py --serve'. Only the standard library is imported, so a request costs little
+more than the Python startup.
+"""
+import argparse
+import os
+import socket
+import sys
+
+from protocol import default_socket_path, read_frame, write_frame
+
+
+def request(message, socket_path=None):
+    """
+    Send one request to the server and return its response
+    :param message: request dict
+    :param socket_path: None for the default socket of the user
+    :return: response dict
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with connection:
+        connection.connect(socket_path or default_socket_path())
+        with connection.makefile('rwb') as stream:
+            write_frame(stream, message)
+            return read_frame(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client of the vslc compile server')
+    parser.add_argument('file', nargs='?', help='VSL source file')
+    parser.add_argument('-o', '--output', default='a.out', help='object file, a.out by default')
+    parser.add_argument('--run', action='store_true', help='evaluate the program instead of compiling it')
+    parser.add_argument('--socket', default=None, help='socket of the server')
+    parser.add_argument('--stats', action='store_true', help='print the statistics of the server')
+    parser.add_argument('--shutdown', action='store_true', help='stop the server')
+    args = parser.parse_args()
+
+    if args.shutdown:
+        message = {'op': 'shutdown'}
+    elif args.stats:
+        message = {'op': 'stats'}
+    elif args.file is None:
+        parser.error('a source file is required')
+    elif args.run:
+        message = {'op': 'evaluate', 'filename': os.path.abspath(args.file)}
+    else:
+        message = {'op': 'compile', 'filename': os.path.abspath(args.file), 'output': os.path.abspath(args.output)}
+
+    try:
+        response = request(message, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("vslcc: no server on {}, start one with 'python vslc.py --serve'".format(
+            args.socket or default_socket_path()), file=sys.stderr)
+        sys.exit(2)
+
+    sys.stdout.write(response.get('output', ''))
+    if not response['ok']:
+        print(response['error'], file=sys.stderr)
+        sys.exit(1)
+    if args.stats:
+        for name in ('requests', 'failures', 'warmup_time'):
+            print('{}: {}'.format(name, response[name]))
+    elif message['op'] == 'compile':
+        print('Object code has been output to the \'{}\' file.'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
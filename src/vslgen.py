@@ -0,0 +1,159 @@
+"""
+vslgen.py
+
+Generator of synthetic VSL programs for the benchmarks
+
+Every generated program has a 'main' function, terminates and is deterministic, so it can be
+carried through every phase up to the JIT execution. The shape of a program is one of SHAPES
+and its size grows linearly with the scale:
+
+    functions    'scale' small functions, called in turn by main
+    statements   one function of 'scale' assignments
+    expressions  'scale' assignments of expressions nested 'depth' parentheses deep
+    prints       'scale' PRINT statements of texts and numbers
+    recursion    'scale' recursive functions, each recursing 'depth' times
+"""
+
+
+def generate_function(index, statements):
+    """
+    Generate the source code of a VSL function with some arithmetic statements
+    :param index: suffix of the function name
+    :param statements: number of the statements in the body
+    :return:
+    """
+    lines = ['FUNC f{}(a, b)'.format(index), '{', '  VAR x, y']
+    for i in range(statements):
+        lines.append('  x := (a + {i}) * b - y / 2.5  // statement {i}'.format(i=i))
+        lines.append('  y := x - {}'.format(i))
+    lines.append('  PRINT "x=", x, "\\n"')
+    lines.append('  RETURN x + y')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_source(size):
+    """
+    Generate a VSL program of at least 'size' bytes
+    :param size:
+    :return:
+    """
+    chunks = []
+    length = 0
+    index = 0
+    while length < size:
+        chunk = generate_function(index, 20)
+        chunks.append(chunk)
+        length += len(chunk)
+        index += 1
+    return ''.join(chunks)
+
+
+def generate_program(functions, statements):
+    """
+    Generate a VSL program with a main function calling the first function
+    :param functions: number of the functions besides main
+    :param statements: number of the statements of each function
+    :return:
+    """
+    code = ''.join(generate_function(i, statements) for i in range(functions))
+    return code + 'FUNC main()\n{\n  RETURN f0(1, 2)\n}\n'
+
+
+def generate_expression(operands, index):
+    """
+    Generate a balanced expression tree over the variables a, b and literals
+    """
+    if operands == 1:
+        return ('a', 'b', str(index % 10 + 1))[index % 3]
+    left = operands // 2
+    operator = '+-*/'[index % 4]
+    return '({} {} {})'.format(generate_expression(left, index * 2 + 1), operator,
+                               generate_expression(operands - left, index * 2 + 2))
+
+
+def generate_nested_expression(depth, index):
+    """
+    Generate an expression nested 'depth' parentheses deep, e.g. 'a + (b * (1 - (a / 2)))'
+    """
+    expression = ('a', 'b', str(index % 10 + 1))[index % 3]
+    for level in range(depth):
+        operand = ('a', 'b', str((index + level) % 10 + 1))[(index + level) % 3]
+        expression = '{} {} ({})'.format(operand, '+-*'[level % 3], expression)
+    return expression
+
+
+def _generate_functions(scale, depth):
+    # Small functions of a few statements, main calls all of them
+    chunks = [generate_function(i, 2).replace('  PRINT "x=", x, "\\n"\n', '') for i in range(scale)]
+    # One call per statement, a single sum of all the calls would nest too deep
+    lines = ['FUNC main()', '{', '  VAR s', '  s := 0']
+    lines.extend('  s := s + f{}({}, 2)'.format(i, i % 7) for i in range(scale))
+    lines.append('  RETURN s')
+    lines.append('}')
+    return ''.join(chunks) + '\n'.join(lines) + '\n'
+
+
+def _generate_statements(scale, depth):
+    lines = ['FUNC main()', '{', '  VAR a, b', '  a := 1', '  b := 2']
+    for i in range(scale):
+        lines.append('  a := (a + {}) * 0.5 - b / 4'.format(i % 10))
+        lines.append('  b := b - a / {}'.format(i % 10 + 1))
+    lines.append('  RETURN a + b')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def _generate_expressions(scale, depth):
+    lines = ['FUNC main()', '{', '  VAR a, b', '  a := 1', '  b := 2']
+    for i in range(scale):
+        lines.append('  {} := {}'.format('ab'[i % 2], generate_nested_expression(depth, i)))
+    lines.append('  RETURN a + b')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def _generate_prints(scale, depth):
+    lines = ['FUNC main()', '{', '  VAR i', '  i := 0']
+    for i in range(scale):
+        lines.append('  PRINT "line ", i, ": ", {}, " of {}\\n"'.format(i % 10, scale))
+        lines.append('  i := i + 1')
+    lines.append('  RETURN i')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def _generate_recursion(scale, depth):
+    chunks = []
+    for i in range(scale):
+        chunks.append('FUNC r{i}(n)\n{{\n  IF n THEN RETURN r{i}(n - 1) + {step} FI\n  RETURN 0\n}}\n'.format(
+            i=i, step=i % 10 + 1))
+    lines = ['FUNC main()', '{', '  VAR s', '  s := 0']
+    lines.extend('  s := s + r{}({})'.format(i, depth) for i in range(scale))
+    lines.append('  RETURN s')
+    lines.append('}')
+    return ''.join(chunks) + '\n'.join(lines) + '\n'
+
+
+# Shape name => generator(scale, depth)
+SHAPES = {
+    'functions': _generate_functions,
+    'statements': _generate_statements,
+    'expressions': _generate_expressions,
+    'prints': _generate_prints,
+    'recursion': _generate_recursion,
+}
+
+
+def generate(shape, scale, depth=32):
+    """
+    Generate a VSL program of a shape
+    :param shape: one of SHAPES
+    :param scale: the size of the program grows linearly with it
+    :param depth: nesting depth of 'expressions' and recursion depth of 'recursion'
+    :return: VSL source code
+    """
+    assert shape in SHAPES, 'unknown shape: {}'.format(shape)
+    assert scale >= 0 and depth >= 0
+
+    return SHAPES[shape](scale, depth)
@@ -3,6 +3,10 @@ yacc.py
 
 We use non-terminators' names from the grammar definitions of VSL
 
+List rules append to the list of p[1] in place and pass it up as p[0]. The list object is
+only referenced by that one symbol on the parser stack, and copying it in every reduction
+would cost O(N^2) for a list of N items.
+
 Example:
  def p_expression_plus(p):
      'expression : expression PLUS term'
@@ -12,10 +16,15 @@ Example:
      p[0] = p[1] + p[3]
 
 """
+from contextlib import contextmanager
+
 import ply.yacc as yacc
 
+import config
 from config import parser_debug, parser_optimize, write_table
 from lex import VSLCLexer
+from scanner import VSLCScanner
+from tracing import phase, count_nodes
 from ast import BinaryOperation, Number, ID, FunctionCall, IfStatement, WhileStatement, AssignStatement, \
     VariableDeclaration, Program, FunctionDefinition, Block, PrintStatement, ReturnStatement, Text
 
@@ -30,14 +39,33 @@ class VSLCParser(object):
         ('right', 'UMINUS'),  # Unary minus operator
     )
 
-    def __init__(self, parser_start='program'):
+    def __init__(self, parser_start='program', lexer_backend=None):
+        """
+        :param parser_start: start symbol
+        :param lexer_backend: 'ply' or 'scanner', config.lexer_backend by default.
+                              Only the scanner accepts bytes and mmap input
+        """
         assert isinstance(parser_start, str), 'parser_start should be a str'
 
-        self.lexer = VSLCLexer()
-        self.lexer.build()  # THIS LINE: Don't forget to build the lexer
+        self.parser_start = parser_start
+
+        # Called with every FunctionDefinition as soon as it's reduced, which is then left out
+        # of the function list of the Program. So a caller can process the functions one by one
+        # and release them, see streaming.py
+        self.on_function = None
 
-        self.parser = yacc.yacc(module=self, start=parser_start, debug=parser_debug, optimize=parser_optimize,
-                                write_tables=write_table)
+        with phase('build_parser', start=parser_start):
+            if (lexer_backend or config.lexer_backend) == 'scanner':
+                self.lexer = VSLCScanner()
+            else:
+                self.lexer = VSLCLexer()
+            self.lexer.build()  # THIS LINE: Don't forget to build the lexer
+
+            # Every start symbol has its own table module, otherwise switching the start symbol
+            # invalidates the signature of a shared 'parsetab' and yacc() regenerates the tables.
+            self.parser = yacc.yacc(module=self, start=parser_start, debug=parser_debug, optimize=parser_optimize,
+                                    write_tables=write_table, tabmodule='parsetab_' + parser_start,
+                                    debugfile='parser_' + parser_start + '.out')
 
     def parse(self, input=None):
         """
@@ -46,7 +74,24 @@ class VSLCParser(object):
         :return:
         """
         self.input = input
-        return self.parser.parse(input)
+        lexer = self.lexer.lexer
+        lexer.lineno = 1  # The instance may be reused by the ParserPool
+        with phase('parse', start=self.parser_start) as span:
+            if not config.trace:
+                return self.parser.parse(input, lexer=lexer)
+
+            tokens = 0
+
+            def next_token():
+                nonlocal tokens
+                token = lexer.token()
+                if token is not None:
+                    tokens += 1
+                return token
+
+            node = self.parser.parse(input, lexer=lexer, tokenfunc=next_token)
+            span.set(bytes=len(input or ''), tokens=tokens, nodes=count_nodes(node) if node is not None else 0)
+            return node
 
     # ======== Start of Parser Definitions ======== #
 
@@ -97,7 +142,8 @@ class VSLCParser(object):
         if len(p) == 2:
             p[0] = [p[1]]
         else:
-            p[0] = p[1] + [p[3]]
+            p[1].append(p[3])
+            p[0] = p[1]
 
     # Top-level program stuff
     def p_program(self, p):
@@ -108,15 +154,22 @@ class VSLCParser(object):
         '''function_list : function_list function
                          | function
         '''
+        # A function is None when it's been handed to self.on_function
         if len(p) == 2:
-            p[0] = [p[1]]
+            p[0] = [p[1]] if p[1] is not None else []
         else:
-            p[0] = p[1] + [p[2]]
+            if p[2] is not None:
+                p[1].append(p[2])
+            p[0] = p[1]
 
     # function definition stuff
     def p_function(self, p):
         'function : FUNC ID LPAREN variable_list RPAREN LBRACK block RBRACK'
-        p[0] = FunctionDefinition(ID(p[2]), p[4], p[7])
+        function = FunctionDefinition(ID(p[2]), p[4], p[7])
+        if self.on_function is not None:
+            self.on_function(function)
+            function = None
+        p[0] = function
 
     def p_variable_list_variable_list(self, p):
         '''variable_list : empty
@@ -129,7 +182,8 @@ class VSLCParser(object):
             else:
                 p[0] = []
         else:
-            p[0] = p[1] + [ID(p[3])]
+            p[1].append(ID(p[3]))
+            p[0] = p[1]
 
     def p_block(self, p):
         'block : declaration_list statement_list'
@@ -147,7 +201,8 @@ class VSLCParser(object):
             else:
                 p[0] = []
         else:
-            p[0] = p[1] + [p[2]]
+            p[1].append(p[2])
+            p[0] = p[1]
 
     def p_declaration(self, p):
         'declaration : VAR variable_list'
@@ -165,7 +220,8 @@ class VSLCParser(object):
             else:
                 p[0] = []
         else:
-            p[0] = p[1] + [p[2]]
+            p[1].append(p[2])
+            p[0] = p[1]
 
     def p_statement(self, p):
         '''statement : assign_statement
@@ -197,7 +253,8 @@ class VSLCParser(object):
         if len(p) == 2:
             p[0] = [p[1]]
         else:
-            p[0] = p[1] + [p[3]]  # Will p[1] not be a list?
+            p[1].append(p[3])
+            p[0] = p[1]
 
     def p_print_statement_print_item(self, p):
         '''print_item : expression
@@ -232,3 +289,64 @@ class VSLCParser(object):
             ))
         else:
             error_print('Syntax error at EOF')
+
+
+class ParserPool(object):
+    """Process-wide pool of ready VSLCParser instances
+
+    The lexer and the LALR tables of a start symbol are built once. Idle parsers are kept
+    in a free list per start symbol and handed out again by acquire().
+    """
+    start_symbols = ('program', 'function_list', 'block')
+
+    def __init__(self):
+        self._idle = {start: [] for start in self.start_symbols}
+
+    def warm(self, *parser_starts):
+        """
+        Build one idle parser for each start symbol in advance
+        :param parser_starts: start symbols, all of them by default
+        :return:
+        """
+        for parser_start in parser_starts or self.start_symbols:
+            if not self._idle[parser_start]:
+                self._idle[parser_start].append(VSLCParser(parser_start=parser_start))
+
+    def acquire(self, parser_start='program'):
+        """
+        Take an idle parser of the start symbol, or build a new one when there is no idle one
+        :param parser_start:
+        :return:
+        """
+        assert parser_start in self._idle, 'unknown start symbol: {}'.format(parser_start)
+
+        idle = self._idle[parser_start]
+        if idle:
+            return idle.pop()
+        return VSLCParser(parser_start=parser_start)
+
+    def release(self, parser):
+        """
+        Give back a parser taken by acquire()
+        :param parser:
+        :return:
+        """
+        assert isinstance(parser, VSLCParser)
+
+        parser.input = None  # Don't keep the last input alive
+        self._idle[parser.parser_start].append(parser)
+
+    @contextmanager
+    def parser(self, parser_start='program'):
+        """
+        with parser_pool.parser('block') as parser:
+            node = parser.parse(code)
+        """
+        parser = self.acquire(parser_start)
+        try:
+            yield parser
+        finally:
+            self.release(parser)
+
+
+parser_pool = ParserPool()